@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#     _____           _
+#    / ____|         | |
+#   | (___   ___ __ _| | ___
+#    \___ \ / __/ _` | |/ _ \
+#    ____) | (_| (_| | |  __/
+#   |_____/ \___\__,_|_|\___|
+#
+# Scale benchmark. It generates configuration files with the given numbers of servers and runs
+# "--create all", "--generate-config all", "--restart all" and "--delete all" against the in-memory
+# fake OpenStack. For every operation the wall time and the number of API calls are reported.
+#
+#     ./benchmarks/scale.py [--sizes 10 100 1000] [--latency 0.002] [--boot-time 0.1] [--parallel 8]
+#
+import os
+import sys
+import time
+import yaml
+import argparse
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+OPERATIONS = [("create", ["--create", "all"]),
+              ("generate-config", ["--generate-config", "all"]),
+              ("restart", ["--restart", "all"]),
+              ("delete", ["--delete", "all"])]
+
+IMAGES = ["Ubuntu 20.04", "Ubuntu 22.04", "Debian 12"]
+FLAVORS = ["m1.small", "m1.medium"]
+KEYPAIRS = 4
+SERVERS_PER_NETWORK = 50
+
+
+# generateConfig(servers, initScript) returns a configuration with the given number of servers.
+# Every server is connected to one of the data networks with a fixed address and to the shared
+# control network with an address allocated by OpenStack.
+def generateConfig(servers, initScript):
+    networks = max(1, (servers + SERVERS_PER_NETWORK - 1) // SERVERS_PER_NETWORK)
+    config = {"parameters": {"dns_nameservers": ["8.8.8.8"],
+                             "users": {image: "user" for image in IMAGES}},
+              "networks": [{"name": "bench_control", "cidr": "172.16.0.0/16"}] +
+                          [{"name": "bench_data" + str(n), "cidr": "10." + str(n) + ".0.0/16"}
+                           for n in range(networks)],
+              "servers": []}
+    for i in range(servers):
+        network = i // SERVERS_PER_NETWORK
+        index = i % SERVERS_PER_NETWORK + 10
+        config["servers"].append({
+            "name": "bench_srv" + str(i),
+            "image": IMAGES[i % len(IMAGES)],
+            "flavor": FLAVORS[i % len(FLAVORS)],
+            "keypair": "bench_key" + str(i % KEYPAIRS),
+            "init-script": initScript,
+            "networks": [{"name": "bench_data" + str(network), "ipv4": "10." + str(network) + ".0." + str(index)},
+                         {"name": "bench_control"}]})
+    return config
+
+
+# runOperation(cloud, argv) runs "main.py" with the arguments and returns its wall time and API calls
+def runOperation(cloud, argv):
+    import main
+    from os_resolver import resolver
+
+    # Every operation is a separate run of the tool, it starts with a cold per-run cache
+    resolver.reset()
+    cloud.resetCalls()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        main.main(argv)
+        elapsed = time.perf_counter() - start
+    return elapsed, cloud.resetCalls()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the infrastructure manager against a fake OpenStack.')
+    parser.add_argument("--sizes", dest='sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help="Numbers of servers in the generated configurations")
+    parser.add_argument("--latency", dest='latency', type=float, default=0.0,
+                        help="Latency of every API call, seconds")
+    parser.add_argument("--boot-time", dest='boot_time', type=float, default=0.0,
+                        help="Time from a server creation to its ACTIVE state, seconds")
+    parser.add_argument("--delete-time", dest='delete_time', type=float, default=0.0,
+                        help="Time from a server deletion request to its disappearance, seconds")
+    parser.add_argument("--page-size", dest='page_size', type=int, default=100,
+                        help="Number of resources in one page of a list call")
+    parser.add_argument("--parallel", dest='parallel', type=int, default=1,
+                        help="Value of the \"--parallel\" argument of the tool")
+    parser.add_argument("--poll-interval", dest='poll_interval', type=float, default=0.01,
+                        help="Interval of the status polling of the tool, seconds")
+    parser.add_argument("--verbose", dest='verbose', action="store_true", default=False,
+                        help="Print the number of calls of every API operation")
+    arguments = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="openstack-vim-bench-")
+    # Neither the state cache nor the generated files must touch the user's directories
+    os.environ["XDG_CACHE_HOME"] = os.path.join(workDir, "cache")
+    os.chdir(workDir)
+
+    from globals import conn
+    from benchmarks.fake_openstack import FakeConnection
+    import os_teardown
+    import os_poller
+    os_teardown.TEARDOWN_POLL_INTERVAL = arguments.poll_interval
+    os_poller.POLL_INTERVAL_MIN = arguments.poll_interval
+    os_poller.POLL_INTERVAL_MAX = arguments.poll_interval * 10
+
+    initScript = os.path.join(workDir, "init.sh")
+    with open(initScript, "w") as f:
+        f.write("#!/bin/bash\nsudo apt -y install python3-minimal 2>&1\n")
+
+    print('%8s  %-16s %10s %10s' % ("servers", "operation", "time, s", "API calls"))
+    for size in arguments.sizes:
+        cloud = FakeConnection(latency=arguments.latency, bootTime=arguments.boot_time,
+                               deleteTime=arguments.delete_time, pageSize=arguments.page_size)
+        for image in IMAGES:
+            cloud.addImage(image)
+        for flavor in FLAVORS:
+            cloud.addFlavor(flavor)
+        conn.use(cloud)
+
+        configFile = os.path.join(workDir, "config-" + str(size) + ".yml")
+        with open(configFile, "w") as f:
+            yaml.safe_dump(generateConfig(size, initScript), f)
+
+        for title, argv in OPERATIONS:
+            elapsed, calls = runOperation(cloud, argv + ["--config", configFile,
+                                                         "--ssh-dir", os.path.join(workDir, "ssh-" + str(size)),
+                                                         "--parallel", str(arguments.parallel)])
+            print('%8d  %-16s %10.2f %10d' % (size, title, elapsed, sum(calls.values())))
+            if arguments.verbose:
+                for operation, count in sorted(calls.items(), key=lambda c: -c[1]):
+                    print('%30s %-28s %8d' % ("", operation, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#     _____ _             _
+#    / ____| |           | |
+#   | (___ | |_ __ _ _ __| |_ _   _ _ __
+#    \___ \| __/ _` | '__| __| | | | '_ \
+#    ____) | || (_| | |  | |_| |_| | |_) |
+#   |_____/ \__\__,_|_|   \__|\__,_| .__/
+#                                  | |
+#                                  |_|
+#
+# Startup time benchmark. It measures the time of the command line invocations, that must not touch
+# the OpenStack SDK, and fails if argument parsing or configuration file loading imports openstacksdk.
+#
+#     ./benchmarks/startup.py [--runs N]
+#
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+EXAMPLE_CONFIG = os.path.join(ROOT, "config.yml.example")
+
+# The code parses the arguments and loads the configuration file the same way "main()" does,
+# then reports if the SDK has been imported on the way
+SDK_CHECK = '''
+import sys
+import main
+arguments = main.buildArgumentParser().parse_args(["--create", "all", "--config", sys.argv[1]])
+config = main.loadYamlConfig(arguments.configuration_file)
+assert config is not None
+print("openstack" in sys.modules)
+'''
+
+
+# timeCommand(command, runs) returns the best wall time of "runs" executions of the command, seconds
+def timeCommand(command, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of the infrastructure manager.')
+    parser.add_argument("--runs", dest='runs', type=int, default=5,
+                        help="Number of executions of every command, the best time is reported")
+    arguments = parser.parse_args()
+
+    cases = [("python (interpreter only)", [sys.executable, "-c", "pass"]),
+             ("main.py --help", [sys.executable, MAIN, "--help"]),
+             ("main.py --create all --config <missing>", [sys.executable, MAIN, "--create", "all",
+                                                          "--config", "does-not-exist.yml"]),
+             ("parse arguments + load config", [sys.executable, "-c", SDK_CHECK, EXAMPLE_CONFIG])]
+
+    for title, command in cases:
+        print('%-45s %8.1f ms' % (title, timeCommand(command, arguments.runs) * 1000))
+
+    # The SDK must not be imported before the first API call
+    result = subprocess.run([sys.executable, "-c", SDK_CHECK, EXAMPLE_CONFIG], cwd=ROOT,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0 or result.stdout.strip() != "False":
+        print('FAILED: openstacksdk is imported during argument parsing or configuration loading.')
+        return 1
+    print('OK: argument parsing and configuration loading do not import openstacksdk.')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,111 @@
 import os
-from openstack import connection
-import openstack.config
+import time
+import threading
+
+from os_profile import profiler, instrument
+from os_regions import currentRegion, getRegionLabel
+from os_auth import tokenCache, sizeConnectionPool
 
 # ---------------------------------------------------------------
 # Global definitions
 
-config = openstack.config.get_cloud_region(cloud='openstack')
-conn = connection.Connection(config=config)
+# Name of the cloud in clouds.yaml used for all operations
+CLOUD_NAME = 'openstack'
+
+# Services of the connection, which calls are recorded by the profiler
+INSTRUMENTED_SERVICES = ("compute", "network", "image", "identity", "block_storage")
+
+
+# The OpenStack connection is created on the first real API use. Neither the openstacksdk import nor
+# the cloud config parsing are done for "--help", wrong arguments or an invalid configuration file.
+# Every region (see os_regions) has its own connection, the region of the current operation is used.
+class LazyConnection(object):
+    def __init__(self):
+        # Region -> connection, None is the default cloud CLOUD_NAME
+        self._connections = {}
+        self._lock = threading.Lock()
+        # Number of the HTTP connections kept per host, see configure()
+        self._poolSize = 1
+
+    # connect() returns the OpenStack connection of the current region and creates it, if it does not exist yet
+    def connect(self):
+        region = currentRegion()
+        connection = self._connections.get(region)
+        if connection is None:
+            with self._lock:
+                connection = self._connections.get(region)
+                if connection is None:
+                    connection = self._connections[region] = self._createConnection(region)
+        return connection
+
+    # configure(parallel) sizes the HTTP connection pool of the connections created later to the number of
+    # the parallel workers, the poller thread has its own connection of the pool
+    def configure(self, parallel):
+        self._poolSize = parallel + 1
+
+    # _createConnection(region) creates the connection to the region of the cloud from clouds.yaml. The keystone
+    # token of the previous run is reused, if it is still valid, see os_auth
+    def _createConnection(self, region):
+        from openstack import connection
+        import openstack.config
+
+        cloud = CLOUD_NAME if region is None else region.cloud
+        label = CLOUD_NAME if region is None else region.label
+        with profiler.phase("auth"):
+            start = time.perf_counter()
+            if region is None or region.name is None:
+                config = openstack.config.get_cloud_region(cloud=cloud)
+            else:
+                config = openstack.config.get_cloud_region(cloud=cloud, region_name=region.name)
+            newConnection = connection.Connection(config=config)
+            sizeConnectionPool(newConnection.session, self._poolSize)
+            cached = tokenCache.attach(newConnection.session.auth, tokenCache.getKey(config, label))
+            profiler.record("identity", "connect", time.perf_counter() - start, label)
+            # The token is requested on the first API call, fetch it here to tell it from the call
+            if profiler.enabled and not cached:
+                instrument("identity", newConnection).authorize()
+        return newConnection
+
+    # use(connection, region) replaces the connection of the region (the default cloud if None) with
+    # an already created one
+    def use(self, connection, region=None):
+        with self._lock:
+            self._connections[region] = connection
+
+    # isConnected() returns True if a connection has already been created
+    def isConnected(self):
+        return bool(self._connections)
+
+    def __getattr__(self, name):
+        attr = getattr(self.connect(), name)
+        # Service proxies (compute, network, image, ...) record their calls, if "--profile" is requested
+        if name in INSTRUMENTED_SERVICES:
+            return instrument(name, attr)
+        return attr
+
+
+conn = LazyConnection()
+
+# Result lines might be printed from several worker threads at once
+_reportLock = threading.Lock()
+
+# Locks serializing creation of the same named resource (network, keypair, ...) by parallel workers
+_resourceLocks = {}
+_resourceLocksLock = threading.Lock()
+
+
+# report(message) prints a result line without interleaving it with lines of other worker threads.
+# If several regions are managed at once, the line is prefixed with the region of the current operation
+def report(message):
+    message = getRegionLabel() + message
+    with _reportLock:
+        print(message, flush=True)
+
+
+# getResourceLock(kind, name) returns the lock guarding creation of the resource "name" of the type "kind"
+# in the current region
+def getResourceLock(kind, name):
+    with _resourceLocksLock:
+        return _resourceLocks.setdefault((currentRegion(), kind, name), threading.Lock())
 
 # ---------------------------------------------------------------
@@ -1,23 +1,100 @@
 #!/usr/bin/env python
 import os
-import yaml
+import sys
+import json
+import hashlib
 import argparse
+import contextlib
 
-from os_configs import generateConfig
-from os_servers import deleteAllServers, deleteServerByName, createAllServers, createServerByName
-from os_networks import deleteAllNetworks, deleteNetworkByName, createAllNetworks, createNetworkByName
+from globals import conn, report
+from os_configs import collectHostsConfig, writeConfigs, buildDynamicInventory, getConfigSSHDirectory
+from os_inventory import loadCachedInventory, INVENTORY_CACHE_TTL
+from os_scheduler import createInfrastructure, getCreatedServerNames
+from os_teardown import deleteInfrastructure
+from os_plan import computePlan, printPlan, applyPlan
+from os_state import state, STATE_DIRECTORY
+from os_journal import journal
+from os_resolver import resolver, refreshState
+from os_retry import controller
+from os_profile import profiler
+from os_model import loadConfig, validateConfig, ConfigurationError
+from os_regions import parseRegion, runInRegions
+from os_environment import saveSnapshots, restoreSnapshots
 
+# The modules of the daemon (http.server) and of the readiness checks (asyncio) are imported only by the operations
+# using them, like the OpenStack SDK is. The defaults of their arguments are kept here
 
-def loadYamlConfig(fileName):
+# Local HTTP port of the daemon
+DAEMON_PORT = 8780
+# Interval between two checks of the infrastructure by the daemon, seconds
+DAEMON_POLL_INTERVAL = 30
+# Maximum time to wait for the servers to become reachable, seconds
+READY_TIMEOUT = 600
+
+
+# loadYamlConfig(fileName, arguments) loads the configuration file and checks it before any API call.
+# The local files used by the servers are checked only for the operations creating them.
+# The function returns the InfrastructureConfig or None if the configuration is invalid
+def loadYamlConfig(fileName, arguments=None):
     if not os.path.exists(fileName):
         print('File ' + fileName + ' does not exist. Plese, use the "--config" argument to provide path to '
                                    'existing configuration file.')
         return None
-    with open(fileName) as f:
-        config = yaml.full_load(f)
-        return config
+    try:
+        config = loadConfig(fileName)
+    except ConfigurationError as e:
+        printConfigErrors(fileName, e.errors)
+        return None
+
+    ssh_dir = None
+    if arguments is not None and (arguments.object_c is not None or arguments.object_r is not None or
+                                  arguments.apply or arguments.daemon or arguments.restore is not None):
+        ssh_dir = arguments.ssh_directory
+    errors, warnings = validateConfig(config, ssh_dir)
+    for warning in warnings:
+        print('Warning: ' + warning)
+    if errors:
+        printConfigErrors(fileName, errors)
+        return None
+    return config
+
+
+# printConfigErrors(fileName, errors) prints the errors found in the configuration file
+def printConfigErrors(fileName, errors):
+    if len(errors) == 1:
+        print('Configuration file ' + fileName + ' is invalid: ' + errors[0])
+        return
+    print('Configuration file ' + fileName + ' is invalid:')
+    for error in errors:
+        print('    ' + error)
+
+
+# getRegions(config, arguments) returns the list of the clouds and regions from the "--cloud" arguments or from
+# "parameters.clouds" of the configuration file. An empty list means the default cloud. An invalid "--cloud"
+# argument raises ValueError
+def getRegions(config, arguments):
+    values = arguments.clouds or config.parameters.get("clouds") or []
+    return list(dict.fromkeys(parseRegion(value) for value in values))
+
+
+# positiveInteger(value) converts a command line argument to an integer greater than zero
+def positiveInteger(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('"' + value + '" is not a positive integer')
+    return number
 
 
+# nonNegativeInteger(value) converts a command line argument to an integer greater than or equal to zero
+def nonNegativeInteger(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError('"' + value + '" is not a non-negative integer')
+    return number
+
+
+# manageInfrastructure(config, arguments) executes "--create", "--delete" or "--restart" and returns the results
+# of the creation, see createInfrastructure()
 def manageInfrastructure(config, arguments):
     objectsToDelete = None
     if arguments.object_d is not None:
@@ -27,36 +104,31 @@ def manageInfrastructure(config, arguments):
 
     if objectsToDelete is not None:
         if "all" in objectsToDelete:
-            deleteAllServers(config)
-            deleteAllNetworks(config)
+            deleteInfrastructure(config, [s["name"] for s in config.get("servers", [])],
+                                 [n["name"] for n in config.get("networks", [])])
             if len(objectsToDelete) > 1:
                 print('Operation "--delete" with the argument "all" has been executed. Other parameters were ignored.')
         elif "servers" in objectsToDelete:
-            deleteAllServers(config)
+            deleteInfrastructure(config, [s["name"] for s in config.get("servers", [])], [])
             if len(objectsToDelete) > 1:
                 print('Operation "--delete" with the argument "servers" has been executed. '
                       'Other parameters were ignored.')
         elif "networks" in objectsToDelete:
-            deleteAllNetworks(config)
+            deleteInfrastructure(config, [], [n["name"] for n in config.get("networks", [])])
             if len(objectsToDelete) > 1:
                 print('Operation "--delete" with the argument "networks" has been executed. '
                       'Other parameters were ignored.')
         else:
+            serversToDelete = []
+            networksToDelete = []
             for obj in objectsToDelete:
-                isDeleted = False
-                for servConfig in config["servers"]:
-                    if servConfig["name"] == obj:
-                        deleteServerByName(obj)
-                        isDeleted = True
-                        break
-                if not isDeleted:
-                    for netwConfig in config["networks"]:
-                        if netwConfig["name"] == obj:
-                            deleteNetworkByName(obj)
-                            isDeleted = True
-                            break
-                if not isDeleted:
+                if config.getServer(obj) is not None:
+                    serversToDelete.append(obj)
+                elif config.getNetwork(obj) is not None:
+                    networksToDelete.append(obj)
+                else:
                     print('The arguments "' + obj + '" for operation "--delete" is unknown.')
+            deleteInfrastructure(config, serversToDelete, networksToDelete)
 
     objectsToCreate = None
     if arguments.object_r is not None:
@@ -64,39 +136,38 @@ def manageInfrastructure(config, arguments):
     if arguments.object_c is not None:
         objectsToCreate = arguments.object_c
 
+    results = {}
     if objectsToCreate is not None:
         if "all" in objectsToCreate:
-            createAllNetworks(config)
-            createAllServers(config, arguments)
+            results = createInfrastructure(config, [s["name"] for s in config.get("servers", [])],
+                                           [n["name"] for n in config.get("networks", [])], arguments)
             if len(objectsToCreate) > 1:
                 print('Operation "--create" with the argument "all" has been executed. Other parameters were ignored.')
         elif "servers" in objectsToCreate:
-            createAllServers(config, arguments)
+            if "servers" in config.keys():
+                results = createInfrastructure(config, [s["name"] for s in config["servers"]], [], arguments)
+            else:
+                print('No "servers" section has been found in the configuration file.')
             if len(objectsToCreate) > 1:
                 print('Operation "--create" with the argument "servers" has been executed. '
                       'Other parameters were ignored.')
         elif "networks" in objectsToCreate:
-            createAllNetworks(config)
+            results = createInfrastructure(config, [], [n["name"] for n in config.get("networks", [])], arguments)
             if len(objectsToCreate) > 1:
                 print('Operation "--create" with the argument "networks" has been executed. '
                       'Other parameters were ignored.')
         else:
+            serversToCreate = []
+            networksToCreate = []
             for obj in objectsToCreate:
-                isCreated = False
-                for servConfig in config["servers"]:
-                    if servConfig["name"] == obj:
-                        createServerByName(config, obj, arguments)
-                        isCreated = True
-                        break
-                if not isCreated:
-                    for netwConfig in config["networks"]:
-                        if netwConfig["name"] == obj:
-                            createNetworkByName(config, obj)
-                            isCreated = True
-                            break
-                if not isCreated:
+                if config.getServer(obj) is not None:
+                    serversToCreate.append(obj)
+                elif config.getNetwork(obj) is not None:
+                    networksToCreate.append(obj)
+                else:
                     print('The arguments "' + obj + '" for operation "--create" is unknown.')
-    return
+            results = createInfrastructure(config, serversToCreate, networksToCreate, arguments)
+    return results
 
 
 ############################################################
@@ -108,7 +179,8 @@ def manageInfrastructure(config, arguments):
 #   |_|  |_|\__,_|_|_| |_| |   | |
 #                         \_\ /_/
 #############################################################
-def main():
+# buildArgumentParser() returns the parser of the command line arguments
+def buildArgumentParser():
     parser = argparse.ArgumentParser(description='Manage virtual OpenStack infrastructure.',
                                      formatter_class=argparse.RawTextHelpFormatter)
 
@@ -124,6 +196,24 @@ def main():
     groupAction.add_argument("--restart", dest='object_r', nargs='+', default=None, type=str,
                              help="Delete the virtual infrastructure and create it from scratch.\n"
                                   "OBJECT_TO_RESTART = [ <server_name> | <network_name> | servers | networks | all ]")
+    groupAction.add_argument("--plan", dest='plan', action="store_true", default=False,
+                             help="Compare the virtual infrastructure with the configuration file and print\n"
+                                  "missing, orphaned and drifted resources without changing anything.")
+    groupAction.add_argument("--apply", dest='apply', action="store_true", default=False,
+                             help="Print the plan like \"--plan\" does and change only the resources from it.")
+    groupAction.add_argument("--save-snapshot", dest='save_snapshot', type=str, default=None, metavar='TAG',
+                             help="Snapshot every server of the configuration file to the images \"<server>@TAG\".")
+    groupAction.add_argument("--restore", dest='restore', type=str, default=None, metavar='TAG',
+                             help="Rebuild every server from its snapshot \"<server>@TAG\", the missing servers\n"
+                                  "are created from it. The init scripts are not run again.")
+    groupAction.add_argument("--daemon", dest='daemon', action="store_true", default=False,
+                             help="Keep running, create the missing networks and servers, recreate the servers\n"
+                                  "in the ERROR state and serve the ssh config and the Ansible inventory\n"
+                                  "on the local HTTP port \"--daemon-port\".")
+    groupAction.add_argument("--list", dest='inventory_list', action="store_true", default=False,
+                             help="Print the Ansible dynamic inventory of the running hosts in JSON.")
+    groupAction.add_argument("--host", dest='inventory_host', type=str, default=None, metavar='HOST',
+                             help="Print the Ansible variables of the host in JSON.")
 
     group_config = parser.add_argument_group('Generating configurations options')
     group_config.add_argument("--generate-config", dest='config_type', default=None, type=str,
@@ -131,37 +221,266 @@ def main():
                               help="Generate ssh config file and/or ansible inventory file "
                                    "based on infrastructure config\n"
                                    "CONFIG_TYPE = [ ssh | ansible | all ]")
+    group_config.add_argument("--incremental", dest='incremental', action="store_true", default=False,
+                              help="Re-query only the servers changed since the previous \"--generate-config\"\n"
+                                   "and rewrite the files only if their content has changed")
+    group_config.add_argument("--inventory-ttl", dest='inventory_ttl', type=nonNegativeInteger, default=None,
+                              metavar='SECONDS',
+                              help="Maximum age of the inventory cached for \"--list\" and \"--host\",\n"
+                                   "it overrides \"parameters.inventory_ttl\", " + str(INVENTORY_CACHE_TTL) +
+                                   " seconds by default")
+
+    group_daemon = parser.add_argument_group('Daemon options')
+    group_daemon.add_argument("--daemon-port", dest='daemon_port', type=nonNegativeInteger, default=DAEMON_PORT,
+                              metavar='PORT',
+                              help="Local HTTP port of the daemon, " + str(DAEMON_PORT) + " by default")
+    group_daemon.add_argument("--daemon-interval", dest='daemon_interval', type=positiveInteger,
+                              default=DAEMON_POLL_INTERVAL, metavar='SECONDS',
+                              help="Interval between two checks of the infrastructure, " +
+                                   str(DAEMON_POLL_INTERVAL) + " seconds by default")
+
+    group_ready = parser.add_argument_group('Readiness options')
+    group_ready.add_argument("--wait-ready", dest='wait_ready', nargs='?', const='ssh', default=None,
+                             choices=['ssh', 'cloud-init'],
+                             help="After \"--create\", \"--restart\", \"--apply\" or \"--restore\" wait until every\n"
+                                  "new server answers on the ssh port of its addresses (\"ssh\", by default)\n"
+                                  "and optionally until its cloud-init has finished (\"cloud-init\")")
+    group_ready.add_argument("--ready-timeout", dest='ready_timeout', type=positiveInteger, default=READY_TIMEOUT,
+                             metavar='SECONDS',
+                             help="Maximum time to wait for the servers to become ready, " + str(READY_TIMEOUT) +
+                                  " seconds by default")
 
     parser.add_argument("--config", dest='configuration_file', type=str, default="config.yml",
                         help="Virtual infrastructure configuration file")
     parser.add_argument("--ssh-dir", dest='ssh_directory', type=str,
                         default=os.path.expanduser("~") + os.path.sep + ".ssh",
                         help="Path to a folder for saving generated ssh keys")
+    parser.add_argument("--cloud", dest='clouds', action="append", default=None, metavar='CLOUD[:REGION]',
+                        help="Cloud of clouds.yaml and optionally its region to apply the configuration to.\n"
+                             "Repeat it to run the operations in several regions concurrently,\n"
+                             "it overrides \"parameters.clouds\" of the configuration file")
+    parser.add_argument("--parallel", dest='parallel', type=positiveInteger, default=1, metavar='N',
+                        help="Number of networks, keypairs and servers created concurrently")
+    parser.add_argument("--refresh-state", dest='refresh_state', action="store_true", default=False,
+                        help="Rebuild the cache of the resources IDs, that is kept between the runs")
+    parser.add_argument("--resume", dest='resume', action="store_true", default=False,
+                        help="Continue the interrupted run of the same operation from its journal: the networks\n"
+                             "and servers it has finished are not looked up again, the servers it has left\n"
+                             "booting or being deleted are awaited by their IDs")
+    parser.add_argument("--profile", dest='profile', action="store_true", default=False,
+                        help="Print the time spent in the OpenStack API calls per phase and per operation")
+    parser.add_argument("--profile-trace", dest='profile_trace', type=str, default=None, metavar='FILE',
+                        help="Save every OpenStack API call of the run in a JSON file, implies \"--profile\"")
+    return parser
+
 
-    arguments = parser.parse_args()
+def main(argv=None):
+    arguments = buildArgumentParser().parse_args(argv)
 
     if arguments.object_c is None and \
             arguments.object_r is None and \
             arguments.object_d is None and \
+            not arguments.plan and \
+            not arguments.apply and \
+            arguments.save_snapshot is None and \
+            arguments.restore is None and \
+            not arguments.daemon and \
+            not arguments.inventory_list and \
+            arguments.inventory_host is None and \
+            not arguments.refresh_state and \
             arguments.config_type is None:
         print('No operation is specified. ')
-        print('Please, use "--create", "--delete", "--restart" or "--generate-config" operation.')
+        print('Please, use "--create", "--delete", "--restart", "--plan", "--apply", "--save-snapshot", "--restore", '
+              '"--daemon", "--list", "--host" or "--generate-config" operation.')
         print('Run "' + os.path.basename(__file__) + ' -h|--help" for additional information.')
         return
 
-    config = loadYamlConfig(arguments.configuration_file)
+    # Ansible runs the script as a dynamic inventory with "--list" or "--host"
+    if arguments.inventory_list or arguments.inventory_host is not None:
+        if not printDynamicInventory(arguments):
+            sys.exit(1)
+        return
+
+    if arguments.profile or arguments.profile_trace is not None:
+        profiler.enable()
+    else:
+        profiler.disable()
+
+    config = loadYamlConfig(arguments.configuration_file, arguments)
     if config is None:
         return
+    try:
+        regions = getRegions(config, arguments)
+    except ValueError as e:
+        print('Invalid "--cloud" argument: ' + str(e))
+        return
+
+    if arguments.daemon:
+        from os_daemon import runDaemon
+        runDaemon(config, regions, arguments)
+        return
+
+    try:
+        if not regions:
+            writeConfigs(runInRegion(config, arguments), arguments)
+        else:
+            # Every region has its own connection, cache and state, the operations run in all of them at once
+            run = runInRegion if len(regions) == 1 else runInRegionSafely
+            results = runInRegions(regions, lambda: run(config, arguments))
+            hostsConfig = []
+            for region, regionHosts in results:
+                hostsConfig.extend(regionHosts or [])
+            writeConfigs(hostsConfig, arguments)
+    finally:
+        if profiler.enabled:
+            printProfile(arguments)
+
+
+# runInRegion(config, arguments) executes the operations in the current region and returns the hosts information
+# for the generated files or None
+def runInRegion(config, arguments):
+    # Number of API requests in flight is adapted to the control plane load, but never exceeds the workers number
+    controller.configure(arguments.parallel)
+    conn.configure(arguments.parallel)
+
+    # Resources IDs resolved in the previous runs with the same cloud and configuration file
+    state.load(arguments.configuration_file, arguments.refresh_state)
+    try:
+        return runOperations(config, arguments)
+    finally:
+        journal.close()
+        state.save()
+
+
+# runInRegionSafely(config, arguments) executes the operations in the current region like runInRegion() does,
+# a failure of one region is reported and does not stop the other regions
+def runInRegionSafely(config, arguments):
+    try:
+        return runInRegion(config, arguments)
+    except Exception as e:
+        report('Operations in the region ...   FAILED: ' + str(e))
+        return None
+
+
+# printDynamicInventory(arguments) prints the Ansible dynamic inventory ("--list") or the variables of one host
+# ("--host") in JSON. The inventory is cached for "--inventory-ttl" seconds, the playbooks running one after another
+# or concurrently share one listing of the resources. Only the JSON is printed to the standard output, the other
+# messages are printed to the standard error. The function returns False if the inventory can not be made
+def printDynamicInventory(arguments):
+    output = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        config = loadYamlConfig(arguments.configuration_file, arguments)
+        if config is None:
+            return False
+        try:
+            regions = getRegions(config, arguments)
+        except ValueError as e:
+            print('Invalid "--cloud" argument: ' + str(e))
+            return False
+
+        ttl = arguments.inventory_ttl
+        if ttl is None:
+            ttl = config.parameters.get("inventory_ttl", INVENTORY_CACHE_TTL)
+        ssh_dir = getConfigSSHDirectory(arguments)
+        # The cache file is kept for every configuration file, ssh directory and set of regions
+        key = "\n".join([os.path.abspath(arguments.configuration_file), ssh_dir] + [r.label for r in regions])
+        path = os.path.join(STATE_DIRECTORY, "inventory-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] +
+                            ".json")
+        inventory = loadCachedInventory(path, ttl,
+                                        lambda: buildDynamicInventory(collectAllHosts(config, regions, arguments),
+                                                                      ssh_dir))
+
+    if arguments.inventory_host is not None:
+        inventory = inventory["_meta"]["hostvars"].get(arguments.inventory_host, {})
+    json.dump(inventory, output, indent=2, sort_keys=True)
+    output.write("\n")
+    return True
+
+
+# collectAllHosts(config, regions, arguments) returns the running hosts of all the regions
+def collectAllHosts(config, regions, arguments):
+    if not regions:
+        return collectHostsConfig(config, arguments)
+    hostsConfig = []
+    for region, regionHosts in runInRegions(regions, lambda: collectHostsConfig(config, arguments)):
+        hostsConfig.extend(regionHosts)
+    return hostsConfig
+
+
+# printProfile(arguments) prints the timing report of the OpenStack API calls and saves the trace file
+def printProfile(arguments):
+    # The lookups of all the regions are summed up
+    stats = {}
+    for regionResolver in resolver.instances():
+        for kind, s in regionResolver.stats().items():
+            total = stats.setdefault(kind, {"hits": 0, "misses": 0})
+            total["hits"] += s["hits"]
+            total["misses"] += s["misses"]
+    stats = {kind: stats[kind] for kind in sorted(stats)}
+    cacheLines = [kind + ': ' + str(s["hits"]) + ' hits, ' + str(s["misses"]) + ' misses' for kind, s in stats.items()]
+    # The user data module is imported only by the runs using it, like the OpenStack SDK is
+    from os_userdata import userDataBuilder
+    userData = userDataBuilder.stats()
+    userDataLines = []
+    if userData["hits"] or userData["misses"]:
+        userDataLines.append(str(userData["hits"]) + ' hits, ' + str(userData["misses"]) + ' built')
+    profiler.printSummary([("Lookup cache:", cacheLines), ("User data cache:", userDataLines)])
+    if arguments.profile_trace is not None:
+        profiler.writeTrace(arguments.profile_trace, {"argv": vars(arguments), "cache": stats, "user_data": userData})
+        print('')
+        print('Trace of the API calls has been saved to ' + arguments.profile_trace)
+
+
+# openJournal(operation, arguments) starts the journal of the operation changing the resources, "--resume" continues
+# the journal of its interrupted run. The read-only operations keep the journal of the interrupted run intact
+def openJournal(operation, arguments):
+    journal.open(arguments.configuration_file, operation, arguments.resume)
+
+
+# runOperations(config, arguments) executes the operations requested in the command line. The function returns
+# the hosts information for "--generate-config" or None, the files are written once for all the regions
+def runOperations(config, arguments):
+    # If "--refresh-state" argument is provided, need to resolve all the resources from the config again
+    if arguments.refresh_state:
+        refreshState(config)
+
+    # Names of the servers created or rebuilt by the run
+    serverNames = []
 
     # If any of "--create", "--delete" or "--restart" arguments is provided, need to change the infrastructure
     if arguments.object_c is not None or \
             arguments.object_d is not None or \
             arguments.object_r is not None:
-        manageInfrastructure(config, arguments)
+        operation = "create" if arguments.object_c is not None else \
+            "delete" if arguments.object_d is not None else "restart"
+        openJournal(operation, arguments)
+        serverNames.extend(getCreatedServerNames(manageInfrastructure(config, arguments)))
+
+    # If "--save-snapshot" or "--restore" argument is provided, need to snapshot the servers or return them to
+    # their snapshots
+    if arguments.save_snapshot is not None:
+        saveSnapshots(config, list(config.servers), arguments.save_snapshot, arguments)
+    if arguments.restore is not None:
+        openJournal("restore", arguments)
+        serverNames.extend(restoreSnapshots(config, list(config.servers), arguments.restore, arguments))
+
+    # If "--plan" or "--apply" argument is provided, need to compare the infrastructure with the config
+    if arguments.plan or arguments.apply:
+        plan = computePlan(config)
+        printPlan(plan)
+        if arguments.apply:
+            openJournal("apply", arguments)
+            serverNames.extend(getCreatedServerNames(applyPlan(config, plan, arguments)))
+
+    # If "--wait-ready" argument is provided, need to wait until the new servers can be used
+    if arguments.wait_ready is not None and serverNames:
+        from os_readiness import waitForReadiness
+        waitForReadiness(config, serverNames, arguments)
 
-    # If "--generate-config" argument is provided, need to generate config(s)
+    # If "--generate-config" argument is provided, need to collect the running hosts for the config(s)
     if arguments.config_type is not None:
-        generateConfig(config, arguments)
+        return collectHostsConfig(config, arguments)
+    return None
 
 
 #
@@ -0,0 +1,133 @@
+#                  _   _
+#       /\        | | | |
+#      /  \  _   _| |_| |__
+#     / /\ \| | | | __| '_ \
+#    / ____ \ |_| | |_| | | |
+#   /_/    \_\__,_|\__|_| |_|
+#
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+# Directory for the cached keystone tokens, one file per cloud, region and user
+TOKEN_DIRECTORY = os.path.join(os.environ.get("XDG_CONFIG_HOME", os.path.join(os.path.expanduser("~"), ".config")),
+                               "openstack-vim")
+# A cached token is not used if it expires in less than this number of seconds, a run must not outlive it
+TOKEN_EXPIRY_MARGIN = 300
+# Parameters of the "auth" section of clouds.yaml, which are not a part of the cache key
+SECRET_AUTH_PARAMETERS = ("password", "application_credential_secret", "token", "passcode", "totp")
+# Connections of the HTTP pool kept by default by requests, the pool is never made smaller
+HTTP_POOL_SIZE_MIN = 10
+
+
+# Persistent cache of the keystone tokens. The token of the previous run is reused until shortly before it expires,
+# so the runs following each other authenticate once. The files are readable by their owner only, a file with wider
+# permissions is ignored. A token rejected by the cloud (HTTP 401) is dropped and the new one is saved.
+class TokenCache(object):
+    def __init__(self, directory=TOKEN_DIRECTORY):
+        self._directory = directory
+        self._lock = threading.Lock()
+
+    # getKey(cloudConfig, label) returns the cache key of the cloud config of openstacksdk: the identity of the user,
+    # the project and the region without the secrets
+    @staticmethod
+    def getKey(cloudConfig, label):
+        auth = cloudConfig.config.get("auth") or {}
+        identity = {name: value for name, value in auth.items() if name not in SECRET_AUTH_PARAMETERS}
+        key = json.dumps([label, cloudConfig.config.get("auth_type"), identity], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    # _getPath(key) returns the path of the token file
+    def _getPath(self, key):
+        return os.path.join(self._directory, "token-" + key + ".json")
+
+    # load(key) returns the saved state of the auth plugin or None, if there is no token, which is valid long enough
+    def load(self, key):
+        path = self._getPath(key)
+        try:
+            info = os.stat(path)
+            # The token of another user or a token readable by others is not trusted
+            if info.st_uid != os.getuid() or info.st_mode & 0o077:
+                self.drop(key)
+                return None
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cached, dict) or cached.get("expires_at", 0) - TOKEN_EXPIRY_MARGIN < time.time():
+            return None
+        return cached.get("state")
+
+    # save(key, state, expiresAt) writes the state of the auth plugin, which only the current user can read
+    def save(self, key, state, expiresAt):
+        with self._lock:
+            os.makedirs(self._directory, mode=0o700, exist_ok=True)
+            fd, tmpName = tempfile.mkstemp(dir=self._directory, prefix=".token-")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"expires_at": expiresAt, "state": state}, f)
+                os.replace(tmpName, self._getPath(key))
+            except BaseException:
+                os.unlink(tmpName)
+                raise
+
+    # drop(key) deletes the token file
+    def drop(self, key):
+        with self._lock:
+            try:
+                os.unlink(self._getPath(key))
+            except OSError:
+                pass
+
+    # attach(auth, key) restores the cached token of the keystoneauth plugin "auth" and makes the plugin save every
+    # new token it gets and drop the cached one, when the cloud rejects it. The function returns True if a cached
+    # token has been restored. The plugins, which can not export their state, are left as they are
+    def attach(self, auth, key):
+        if not hasattr(auth, "get_auth_state") or not hasattr(auth, "set_auth_state"):
+            return False
+
+        state = self.load(key)
+        restored = False
+        if state is not None:
+            try:
+                auth.set_auth_state(state)
+                restored = True
+            except Exception:
+                self.drop(key)
+        # Token saved to the file, it is compared on every request, that is cheaper than a file write
+        saved = [auth.auth_ref.auth_token if restored else None]
+        getAccess = auth.get_access
+        invalidate = auth.invalidate
+
+        def getCachedAccess(session, **kwargs):
+            access = getAccess(session, **kwargs)
+            if access.auth_token != saved[0] and access.expires is not None:
+                saved[0] = access.auth_token
+                self.save(key, auth.get_auth_state(), access.expires.timestamp())
+            return access
+
+        # keystoneauth invalidates the token after HTTP 401 and authenticates again
+        def invalidateCachedToken():
+            saved[0] = None
+            self.drop(key)
+            return invalidate()
+
+        auth.get_access = getCachedAccess
+        auth.invalidate = invalidateCachedToken
+        return restored
+
+
+# sizeConnectionPool(session, poolSize) makes the HTTP session of the connection keep up to "poolSize" connections
+# per host, so the parallel workers reuse the TLS connections instead of opening new ones
+def sizeConnectionPool(session, poolSize):
+    from keystoneauth1.session import TCPKeepAliveAdapter
+
+    poolSize = max(HTTP_POOL_SIZE_MIN, poolSize)
+    for scheme in ("https://", "http://"):
+        session.session.mount(scheme, TCPKeepAliveAdapter(pool_connections=poolSize, pool_maxsize=poolSize))
+
+
+tokenCache = TokenCache()
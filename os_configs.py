@@ -10,153 +10,282 @@
 import os
 import re
 
-from os_networks import getNetworkBySubnetID, getNetworkByID
-from globals import conn
+from os_inventory import takeInventorySnapshot, getSnapshotServer, getSnapshotPorts, \
+    getSnapshotNetworkByID, getSnapshotNetworkBySubnetID, takeIncrementalSnapshot, loadInventoryState, \
+    saveInventoryState
+from os_profile import inPhase
+from os_regions import currentRegion
+from globals import report
 
 
-# printSSHConfig(config, filename, path, ssh_dir) makes a file of ssh syntax with the existing hosts parameters
-def printSSHConfig(config, arguments):
-    ssh_dir = os.path.expanduser("~") + os.path.sep + ".ssh"
-    if arguments.ssh_directory is not None:
-        ssh_dir = arguments.ssh_directory
+# renderSSHConfig(config, ssh_dir) returns the text of the ssh config with the existing hosts parameters.
+# Every network has its own section of the file, the hosts of several regions are grouped by the region first.
+def renderSSHConfig(config, ssh_dir):
+    # Group hosts entries by the region and the network name
+    hosts = sorted(config, key=lambda i: (i.get("region", ""), i['network']))
+
+    # Regular expression pattern to separate IPv4 and IPv6 addresses
+    pattern = re.compile("^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$")
+
+    lines = []
+    curr_netw = None
+    for host in hosts:
+        # If new network, make a subtitle in a comment
+        if curr_netw != (host.get("region"), host["network"]):
+            curr_netw = (host.get("region"), host["network"])
+            if host.get("region") is None:
+                lines.append('\n# SSH configuration for network "' + host["network"] + '"\n')
+            else:
+                lines.append('\n# SSH configuration for network "' + host["network"] + '" of region "' +
+                             host["region"] + '"\n')
+
+        # The hosts have the next hostname pattern: <server>_<network>_[ipv4|ipv6]
+        if pattern.match(host["ip"]):
+            lines.append("Host " + host["name"] + "_v4\n")
+        else:
+            lines.append("Host " + host["name"] + "_v6\n")
+
+        # Write hosts parameters using ssh config syntax
+        lines.append("    Hostname " + host["ip"] + "\n")
+        if "username" in host:
+            lines.append("    User " + host["username"] + "\n")
+        lines.append("    IdentityFile " + ssh_dir + os.path.sep + host["keypair"] + "\n")
+        lines.append("    StrictHostKeyChecking no\n\n")
+    return "".join(lines)
+
 
-    # Group hosts entries by the network name
-    hosts = sorted(config, key=lambda i: i['network'])
+# renderAnsibleInventory(config, ssh_dir) returns the text of the ansible inventory with the existing hosts
+# parameters. Every network and IP version has its own group of the inventory. The groups of the hosts of several
+# regions are prefixed with the region and are the children of the group of their region.
+def renderAnsibleInventory(config, ssh_dir):
+    # Group hosts entries by the region and the network name
+    hosts = sorted(config, key=lambda i: (i.get("region", ""), i['network'], i["ipversion"]))
 
     # Regular expression pattern to separate IPv4 and IPv6 addresses
     pattern = re.compile("^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$")
 
-    curr_netw = ""
-    with open(os.path.expanduser(".") + os.path.sep + "config", "w") as f:
-        for host in hosts:
-            # If new network, make a subtitle in a comment
-            if curr_netw != host["network"]:
-                curr_netw = host["network"]
-                f.write('\n# SSH configuration for network "' + curr_netw + '"\n')
-
-            # The hosts have the next hostname pattern: <server>_<network>_[ipv4|ipv6]
-            if pattern.match(host["ip"]):
-                f.write("Host " + host["name"] + "_v4\n")
+    # root element "All" with its "children" subelement
+    lines = ["all:\n", "  children:\n"]
+
+    curr_group = None
+    # Region -> names of the groups of its hosts
+    regions = {}
+    for host in hosts:
+        group = getInventoryGroupName(host)
+        # If a new network or a new IP version, make a new ansible template subtree
+        if curr_group != group:
+            curr_group = group
+            if host.get("region") is not None:
+                regions.setdefault(host["region"], []).append(group)
+                lines.append('\n# Region "' + host["region"] + '", network "' + host["network"] + '", IPv' +
+                             str(host["ipversion"]) + "\n")
             else:
-                f.write("Host " + host["name"] + "_v6\n")
+                lines.append('\n# Network "' + host["network"] + '", IPv' + str(host["ipversion"]) + "\n")
+            lines.append("    " + group + ":\n")
+            lines.append("      hosts:\n")
 
-            # Write hosts parameters using ssh config syntax
-            f.write("    Hostname " + host["ip"] + "\n")
-            f.write("    User " + host["username"] + "\n")
-            f.write("    IdentityFile " + ssh_dir + os.path.sep + host["keypair"] + "\n")
-            f.write("    StrictHostKeyChecking no\n\n")
+        # The hosts have the next hostname pattern: <server>_<network>_[ipv4|ipv6]
+        if pattern.match(host["ip"]):
+            lines.append("        " + host["name"] + "_v4:\n")
+        else:
+            lines.append("        " + host["name"] + "_v6:\n")
 
-    # Final print message
-    print('ssh config is generated and saved to "' + os.path.expanduser(".") + os.path.sep + 'config"')
-    print('To see generated ssh config run')
-    print('    cat ' + os.path.expanduser(".") + os.path.sep + 'config')
-    print('To append generated config to ssh config file run')
-    print('    cat ' + os.path.expanduser(".") + os.path.sep + 'config' + ' >> ' + ssh_dir + os.path.sep + 'config')
-    return
+        # Write hosts parameters using ansible inventory syntax
+        lines.append('          ansible_host: ' + host["ip"] + "\n")
+        if "username" in host:
+            lines.append('          ansible_user: ' + host["username"] + "\n")
+        lines.append('          ansible_ssh_private_key_file: ' + ssh_dir + os.path.sep + host["keypair"] + "\n")
+        lines.append('          ansible_ssh_common_args: \'-o StrictHostKeyChecking=no\'\n')
 
+    # Group of every region with the groups of its networks
+    for region, groups in regions.items():
+        lines.append('\n# Region "' + region + '"\n')
+        lines.append("    " + region + ":\n")
+        lines.append("      children:\n")
+        for group in groups:
+            lines.append("        " + group + ":\n")
+    return "".join(lines)
 
-# printAnsibleInventory(config, filename, path, ssh_dir) makes a file of ssh syntax with the existing hosts parameters
-def printAnsibleInventory(config, arguments):
+
+# getInventoryGroupName(host) returns the ansible group of the host: <network>_ipv<N>, prefixed with the region of
+# the host, if several regions are managed
+def getInventoryGroupName(host):
+    group = host["network"] + "_ipv" + str(host["ipversion"])
+    if host.get("region") is not None:
+        group = host["region"] + "_" + group
+    return group
+
+
+# buildDynamicInventory(config, ssh_dir) returns the ansible inventory of the existing hosts in the JSON format of
+# the dynamic inventory scripts ("--list"). It has the same groups and host variables as renderAnsibleInventory()
+def buildDynamicInventory(config, ssh_dir):
+    hosts = sorted(config, key=lambda i: (i.get("region", ""), i['network'], i["ipversion"]))
+
+    inventory = {"_meta": {"hostvars": {}}, "all": {"children": []}}
+    for host in hosts:
+        group = getInventoryGroupName(host)
+        if group not in inventory:
+            inventory[group] = {"hosts": []}
+            # The groups of the networks of a region are the children of the group of the region
+            parent = inventory["all"]
+            if host.get("region") is not None:
+                if host["region"] not in inventory:
+                    inventory[host["region"]] = {"children": []}
+                    inventory["all"]["children"].append(host["region"])
+                parent = inventory[host["region"]]
+            parent["children"].append(group)
+
+        # The hosts have the next hostname pattern: <server>_<network>_[v4|v6]
+        name = host["name"] + "_v" + str(host["ipversion"])
+        inventory[group]["hosts"].append(name)
+        hostVars = {"ansible_host": host["ip"],
+                    "ansible_ssh_private_key_file": ssh_dir + os.path.sep + host["keypair"],
+                    "ansible_ssh_common_args": "-o StrictHostKeyChecking=no"}
+        if "username" in host:
+            hostVars["ansible_user"] = host["username"]
+        inventory["_meta"]["hostvars"][name] = hostVars
+    return inventory
+
+
+# writeGeneratedFile(fileName, content) writes the content to the file, unless the file already has it.
+# The function returns True if the file has been written
+def writeGeneratedFile(fileName, content):
+    try:
+        with open(fileName) as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    with open(fileName, "w") as f:
+        f.write(content)
+    return True
+
+
+# getConfigSSHDirectory(arguments) returns the directory of the private keys used in the generated files
+def getConfigSSHDirectory(arguments):
     ssh_dir = os.path.expanduser("~") + os.path.sep + ".ssh"
     if arguments.ssh_directory is not None:
         ssh_dir = arguments.ssh_directory
+    return ssh_dir
 
-    # Group hosts entries by the network name
-    hosts = sorted(config, key=lambda i: (i['network'], i["ipversion"]))
 
-    # Regular expression pattern to separate IPv4 and IPv6 addresses
-    pattern = re.compile("^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$")
+# printSSHConfig(config, arguments) makes a file of ssh syntax with the existing hosts parameters
+def printSSHConfig(config, arguments):
+    ssh_dir = getConfigSSHDirectory(arguments)
+    fileName = os.path.expanduser(".") + os.path.sep + "config"
+
+    # Final print message
+    if not writeGeneratedFile(fileName, renderSSHConfig(config, ssh_dir)):
+        print('ssh config "' + fileName + '" is up to date')
+        return
+    print('ssh config is generated and saved to "' + fileName + '"')
+    print('To see generated ssh config run')
+    print('    cat ' + fileName)
+    print('To append generated config to ssh config file run')
+    print('    cat ' + fileName + ' >> ' + ssh_dir + os.path.sep + 'config')
+    return
 
-    with open(os.path.expanduser(".") + os.path.sep + "inventory.yml", "w") as f:
-        # root element "All" with its "children" subelement
-        f.write("all:\n")
-        f.write("  children:\n")
-
-        curr_netw = ""
-        curr_ipversion = 0
-        for host in hosts:
-            # If a new network or a new IP version, make a new ansible template subtree
-            if curr_netw != host["network"] or curr_ipversion != host["ipversion"]:
-                curr_netw = host["network"]
-                curr_ipversion = host["ipversion"]
-
-                f.write('\n# Network "' + curr_netw + '", IPv' + str(curr_ipversion) + "\n")
-                f.write("    " + curr_netw + "_ipv" + str(curr_ipversion) + ":\n")
-                f.write("      hosts:\n")
-
-            # The hosts have the next hostname pattern: <server>_<network>_[ipv4|ipv6]
-            if pattern.match(host["ip"]):
-                f.write("        " + host["name"] + "_v4:\n")
-            else:
-                f.write("        " + host["name"] + "_v6:\n")
 
-            # Write hosts parameters using ansible inventory syntax
-            f.write('          ansible_host: ' + host["ip"] + "\n")
-            f.write('          ansible_user: ' + host["username"] + "\n")
-            f.write('          ansible_ssh_private_key_file: ' + ssh_dir + os.path.sep + host["keypair"] + "\n")
-            f.write('          ansible_ssh_common_args: \'-o StrictHostKeyChecking=no\'\n')
+# printAnsibleInventory(config, arguments) makes an ansible inventory file with the existing hosts parameters
+def printAnsibleInventory(config, arguments):
+    ssh_dir = getConfigSSHDirectory(arguments)
+    fileName = os.path.expanduser(".") + os.path.sep + "inventory.yml"
 
     # Final print message
-    print('Ansible inventory file is generated and saved to "' + os.path.expanduser(".") + os.path.sep + 'inventory.yml"')
+    if not writeGeneratedFile(fileName, renderAnsibleInventory(config, ssh_dir)):
+        print('Ansible inventory file "' + fileName + '" is up to date')
+        return
+    print('Ansible inventory file is generated and saved to "' + fileName + '"')
     print('To see generated Ansible inventory file run')
-    print('    cat ' + os.path.expanduser(".") + os.path.sep + 'inventory.yml')
+    print('    cat ' + fileName)
     return
 
 
-# generateSSHConfig(config) prepares the list of running hosts with their parameters for ssh config and
-# ansible inventory template generation
-def generateSSHConfig(config):
+# generateSSHConfig(config, snapshot, quiet) prepares the list of running hosts with their parameters for ssh config
+# and ansible inventory template generation. All the information is taken from the inventory snapshot, so the
+# generation costs a constant number of API calls regardless of the number of servers and ports. The servers, which
+# are not running, are reported unless "quiet" is True.
+def generateSSHConfig(config, snapshot=None, quiet=False):
+    # Servers, ports, subnets and networks are listed only once
+    if snapshot is None:
+        snapshot = takeInventorySnapshot()
+
+    # Regular expression pattern to separate IPv4 and IPv6 addresses
+    pattern = re.compile("^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$")
+
     # Empty list of running hosts
     conf = []
     for servConfig in config["servers"]:
-        server = conn.compute.find_server(servConfig["name"])
+        server = getSnapshotServer(snapshot, servConfig["name"])
 
         # Ignore servers, that are not running
         if server is None:
-            print('Server "' + servConfig["name"] + '" is not running.')
+            if not quiet:
+                report('Server "' + servConfig["name"] + '" is not running.')
             continue
 
-        # Regular expression pattern to separate IPv4 and IPv6 addresses
-        pattern = re.compile("^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$")
-
         # Looking for ports of current server
-        for port in conn.network.ports():
-            if port["device_id"] == server["id"]:
-                # Every port IP address has to have separate "host" entry
-                for fi in port["fixed_ips"]:
-                    host = {"name": servConfig["name"] + "_" + getNetworkBySubnetID(fi["subnet_id"])["name"],
-                            "network": getNetworkByID(port["network_id"])["name"],
-                            "ip": fi["ip_address"],
-                            "keypair": servConfig["keypair"]}
-
-                    # Get the username for the server
-                    try:
-                        username = config["parameters"]["users"][servConfig["image"]]
-                    except Exception:
-                        username = None
-
-                    # Include only initialized value
-                    if username is not None:
-                        host["username"] = username
-
-                    # IP version
-                    if pattern.match(host["ip"]):
-                        host["ipversion"] = 4
-                    else:
-                        host["ipversion"] = 6
-
-                    # Save gathered information
-                    conf.append(host)
+        for port in getSnapshotPorts(snapshot, server["id"]):
+            portNetwork = getSnapshotNetworkByID(snapshot, port["network_id"])
+            # Every port IP address has to have separate "host" entry
+            for fi in port["fixed_ips"]:
+                subnetNetwork = getSnapshotNetworkBySubnetID(snapshot, fi["subnet_id"])
+                # The port belongs to a network, that is not visible for the project
+                if portNetwork is None or subnetNetwork is None:
+                    continue
+
+                host = {"name": servConfig["name"] + "_" + subnetNetwork["name"],
+                        "network": portNetwork["name"],
+                        "ip": fi["ip_address"],
+                        "keypair": servConfig["keypair"],
+                        "server": servConfig["name"]}
+
+                # The same server exists in every region, its hosts names are prefixed with the region
+                region = currentRegion()
+                if region is not None and region.showLabel:
+                    host["region"] = region.slug
+                    host["name"] = region.slug + "_" + host["name"]
+
+                # Get the username for the server
+                try:
+                    username = config["parameters"]["users"][servConfig["image"]]
+                except Exception:
+                    username = None
+
+                # Include only initialized value
+                if username is not None:
+                    host["username"] = username
+
+                # IP version
+                if pattern.match(host["ip"]):
+                    host["ipversion"] = 4
+                else:
+                    host["ipversion"] = 6
+
+                # Save gathered information
+                conf.append(host)
     return conf
 
 
-# generateConfig(config, arguments) prepares hosts information and generates ssh config and/or
-# ansible inventory file template
-def generateConfig(config, arguments):
-    # If any config generation is required
+# collectHostsConfig(config, arguments) returns the hosts information of the current region, see generateSSHConfig()
+@inPhase("config generation")
+def collectHostsConfig(config, arguments):
+    # Make special structure with the information about running virtual hosts
+    # from a single snapshot of the project resources
+    serverNames = [servConfig["name"] for servConfig in config["servers"]]
+    if not arguments.incremental:
+        return generateSSHConfig(config, takeInventorySnapshot())
+    # The "--incremental" generation keeps the snapshot for the next one
+    snapshot = takeIncrementalSnapshot(serverNames, loadInventoryState(arguments.configuration_file))
+    hostsConfig = generateSSHConfig(config, snapshot)
+    saveInventoryState(snapshot, serverNames, arguments.configuration_file)
+    return hostsConfig
+
+
+# writeConfigs(hostsConfig, arguments) generates ssh config and/or ansible inventory file of the hosts of one or
+# several regions
+def writeConfigs(hostsConfig, arguments):
     if arguments.config_type is not None:
-        # Make special structure with the information about running virtual hosts
-        hostsConfig = generateSSHConfig(config)
         # Generate both configs
         if "all" in arguments.config_type:
             printSSHConfig(hostsConfig, arguments)
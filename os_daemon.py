@@ -0,0 +1,248 @@
+#    _____
+#   |  __ \
+#   | |  | | __ _  ___ _ __ ___   ___  _ __
+#   | |  | |/ _` |/ _ \ '_ ` _ \ / _ \| '_ \
+#   | |__| | (_| |  __/ | | | | | (_) | | | |
+#   |_____/ \__,_|\___|_| |_| |_|\___/|_| |_|
+#
+import json
+import time
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from globals import CLOUD_NAME, report
+from os_regions import runInRegions, currentRegion
+from os_inventory import takeInventorySnapshot, takeIncrementalSnapshot, getInventoryState, getSnapshotServer, \
+    getSnapshotNetworkByName
+from os_configs import generateSSHConfig, renderSSHConfig, renderAnsibleInventory, buildDynamicInventory, \
+    getConfigSSHDirectory
+from os_scheduler import createInfrastructure
+from os_teardown import deleteInfrastructure
+from os_state import state
+from os_retry import controller
+
+# The checks list only the servers changed since the previous one, everything is listed again after this interval
+DAEMON_FULL_REFRESH_INTERVAL = 600
+# A resource, which can not be created, is tried again after the backoff, doubled after every failure up to the max
+DAEMON_RETRY_BACKOFF = 60
+DAEMON_RETRY_BACKOFF_MAX = 900
+# The documents are served to the local consumers only
+DAEMON_ADDRESS = "127.0.0.1"
+
+
+# Documents served by the daemon: the ssh config, the Ansible inventory file, the Ansible dynamic inventory and
+# the state of the reconciliation. They are rendered once per change of the running hosts and served from memory.
+class InventoryDocuments(object):
+    def __init__(self, ssh_dir):
+        self._ssh_dir = ssh_dir
+        self._lock = threading.Lock()
+        # Region label (the cloud name for the default cloud) -> running hosts, see generateSSHConfig()
+        self._hosts = {}
+        # Region label -> state of the reconciliation
+        self._status = {}
+        # Path -> (content type, body), replaced as a whole on every change
+        self._documents = {}
+
+    # publish(hosts, status) updates the running hosts and the reconciliation state of the current region
+    def publish(self, hosts, status):
+        region = currentRegion()
+        label = CLOUD_NAME if region is None else region.label
+        with self._lock:
+            self._status[label] = status
+            documents = dict(self._documents)
+            if self._hosts.get(label) != hosts or not documents:
+                self._hosts[label] = hosts
+                documents = self._render([host for regionHosts in self._hosts.values() for host in regionHosts])
+            documents["/status"] = ("application/json",
+                                    json.dumps(self._status, indent=2, sort_keys=True).encode("utf-8"))
+            self._documents = documents
+
+    # _render(hosts) returns the documents of the running hosts
+    def _render(self, hosts):
+        inventory = buildDynamicInventory(hosts, self._ssh_dir)
+        documents = {"/config": ("text/plain", renderSSHConfig(hosts, self._ssh_dir).encode("utf-8")),
+                     "/inventory.yml": ("application/yaml",
+                                        renderAnsibleInventory(hosts, self._ssh_dir).encode("utf-8")),
+                     "/inventory": ("application/json", json.dumps(inventory, sort_keys=True).encode("utf-8"))}
+        for name, hostVars in inventory["_meta"]["hostvars"].items():
+            documents["/host/" + name] = ("application/json", json.dumps(hostVars, sort_keys=True).encode("utf-8"))
+        return documents
+
+    # get(path) returns (content type, body) of the document or None
+    def get(self, path):
+        return self._documents.get(path)
+
+    # isReady() returns True if the documents have been rendered at least once
+    def isReady(self):
+        return bool(self._documents)
+
+
+# Handler of the HTTP requests of the daemon, every answer is taken from the InventoryDocuments of the server
+class _DocumentHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        documents = self.server.documents
+        if not documents.isReady():
+            self.send_error(503, "The infrastructure has not been checked yet")
+            return
+        document = documents.get(self.path.split("?", 1)[0])
+        if document is None:
+            self.send_error(404)
+            return
+        contentType, body = document
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # The requests are not logged, the consumers might ask very often
+    def log_message(self, format, *args):
+        pass
+
+
+# Reconciler of one region: it checks the infrastructure every "--daemon-interval" seconds and creates the missing
+# networks and servers and recreates the servers in the ERROR state. The actual state is kept in memory, the checks
+# list only the servers changed since the previous check (see takeIncrementalSnapshot()). A resource, which can not
+# be created, is tried again after a growing backoff, so a broken one does not make every check slow.
+class Reconciler(object):
+    def __init__(self, config, arguments, documents):
+        self._config = config
+        self._arguments = arguments
+        self._documents = documents
+        self._serverNames = list(config.servers)
+        # Inventory state of the previous check, None before the first check
+        self._inventoryState = None
+        self._fullRefreshTime = 0
+        # "server:<name>" or "network:<name>" -> (number of failed attempts, time of the next attempt)
+        self._retries = {}
+
+    # run(stop) checks the infrastructure until the event "stop" is set
+    def run(self, stop):
+        controller.configure(self._arguments.parallel)
+        state.load(self._arguments.configuration_file, self._arguments.refresh_state)
+        try:
+            while not stop.is_set():
+                try:
+                    self.check()
+                except Exception as e:
+                    report('Check of the infrastructure ...   FAILED: ' + str(e))
+                state.save()
+                stop.wait(self._arguments.daemon_interval)
+        finally:
+            state.save()
+
+    # check() refreshes the actual state, repairs the drift and publishes the running hosts
+    def check(self):
+        snapshot = self.refresh()
+        status, changed = self.reconcile(snapshot)
+        if changed:
+            # The created networks are not known to the incremental refresh
+            snapshot = self.refresh(full=True)
+        status["checked_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._documents.publish(generateSSHConfig(self._config, snapshot, quiet=True), status)
+
+    # refresh(full) returns the snapshot of the actual state. Only the servers changed since the previous
+    # refresh are listed, unless "full" is True or the full refresh interval has passed
+    def refresh(self, full=False):
+        now = time.monotonic()
+        if full or self._inventoryState is None or now >= self._fullRefreshTime:
+            snapshot = takeInventorySnapshot()
+            self._fullRefreshTime = now + DAEMON_FULL_REFRESH_INTERVAL
+        else:
+            snapshot = takeIncrementalSnapshot(self._serverNames, self._inventoryState)
+        self._inventoryState = getInventoryState(snapshot, self._serverNames)
+        return snapshot
+
+    # reconcile(snapshot) creates the missing networks and servers and recreates the servers in the ERROR state.
+    # The function returns the state of the reconciliation and True if anything has been changed
+    def reconcile(self, snapshot):
+        networks = [name for name in self._config.networks if getSnapshotNetworkByName(snapshot, name) is None]
+        missing = []
+        broken = []
+        for name in self._serverNames:
+            server = getSnapshotServer(snapshot, name)
+            if server is None:
+                missing.append(name)
+            elif server["status"] == "ERROR":
+                broken.append(name)
+        status = {"missing_networks": networks, "missing_servers": missing, "error_servers": broken}
+
+        now = time.monotonic()
+        networks = [name for name in networks if self._isDue("network:" + name, now)]
+        missing = [name for name in missing if self._isDue("server:" + name, now)]
+        broken = [name for name in broken if self._isDue("server:" + name, now)]
+        if not networks and not missing and not broken:
+            return status, False
+
+        report('Drift found: ' + str(len(networks)) + ' missing network(s), ' + str(len(missing)) +
+               ' missing server(s), ' + str(len(broken)) + ' server(s) in the ERROR state.')
+        if broken:
+            deleteInfrastructure(self._config, broken, [])
+        results = createInfrastructure(self._config, missing + broken, networks, self._arguments)
+
+        now = time.monotonic()
+        for name in networks:
+            self._recordAttempt("network:" + name, results.get("network:" + name) is not None, now)
+        for name in missing + broken:
+            servConfig = self._config.getServer(name)
+            if "template" in servConfig:
+                created = (results.get("template:" + servConfig["template"]) or {}).get(name)
+            else:
+                created = results.get("server:" + name)
+            self._recordAttempt("server:" + name, created is not None, now)
+        return status, True
+
+    # _isDue(key, now) returns True if the resource can be created now, it is not waiting for the next attempt
+    def _isDue(self, key, now):
+        return self._retries.get(key, (0, 0))[1] <= now
+
+    # _recordAttempt(key, succeeded, now) schedules the next attempt to create the resource, which has failed
+    def _recordAttempt(self, key, succeeded, now):
+        if succeeded:
+            self._retries.pop(key, None)
+            return
+        failures = self._retries.get(key, (0, 0))[0] + 1
+        self._retries[key] = (failures, now + min(DAEMON_RETRY_BACKOFF * 2 ** (failures - 1), DAEMON_RETRY_BACKOFF_MAX))
+
+
+# runDaemon(config, regions, arguments) keeps the infrastructure of the configuration in all the regions until
+# the process is interrupted (Ctrl+C or SIGTERM) and serves the ssh config and the Ansible inventory of
+# the running hosts on the local HTTP port "--daemon-port":
+#   /config        - ssh config
+#   /inventory.yml - Ansible inventory file
+#   /inventory     - Ansible dynamic inventory in JSON, like "--list"
+#   /host/<host>   - Ansible variables of the host in JSON, like "--host"
+#   /status        - missing resources and the time of the last check of every region
+def runDaemon(config, regions, arguments):
+    documents = InventoryDocuments(getConfigSSHDirectory(arguments))
+    try:
+        server = ThreadingHTTPServer((DAEMON_ADDRESS, arguments.daemon_port), _DocumentHandler)
+    except OSError as e:
+        print('Port ' + str(arguments.daemon_port) + ' can not be used: ' + str(e))
+        return
+    server.daemon_threads = True
+    server.documents = documents
+    threading.Thread(target=server.serve_forever, name="inventory-server", daemon=True).start()
+    print('Serving the ssh config and the Ansible inventory on http://' + DAEMON_ADDRESS + ':' +
+          str(server.server_address[1]) + '/')
+
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    def reconcile():
+        Reconciler(config, arguments, documents).run(stop)
+    worker = threading.Thread(target=(lambda: runInRegions(regions, reconcile)) if regions else reconcile,
+                              name="reconciler")
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        print('Stopping after the current check...')
+        stop.set()
+        worker.join()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,205 @@
+#    ______            _                                      _
+#   |  ____|          (_)                                    | |
+#   | |__   _ ____   ___ _ __ ___  _ __  _ __ ___   ___ _ __ | |_
+#   |  __| | '_ \ \ / / | '__/ _ \| '_ \| '_ ` _ \ / _ \ '_ \| __|
+#   | |____| | | \ V /| | | | (_) | | | | | | | | |  __/ | | | |_
+#   |______|_| |_|\_/ |_|_|  \___/|_| |_|_| |_| |_|\___|_| |_|\__|
+#
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from globals import conn, report
+from os_retry import callWithRetry, callCreateWithRetry
+from os_poller import poller, ACTIVE, ServerStatusError
+from os_regions import withCurrentRegion
+from os_model import InfrastructureConfig
+from os_scheduler import createInfrastructure, getCreatedServerNames
+from os_profile import inPhase
+
+# Maximum time to wait for the snapshot images, seconds
+SNAPSHOT_WAIT_TIMEOUT = 3600
+# Interval between two checks of the snapshot images and the maximum interval, seconds
+SNAPSHOT_POLL_INTERVAL_MIN = 2.0
+SNAPSHOT_POLL_INTERVAL_MAX = 30.0
+# Growth of the interval after a check, which has not found any finished image
+SNAPSHOT_POLL_BACKOFF = 1.5
+# Statuses of the servers, which can be snapshotted
+SNAPSHOT_SERVER_STATUSES = ("ACTIVE", "SHUTOFF", "PAUSED", "SUSPENDED")
+# Statuses of the images, which will never become active
+FAILED_IMAGE_STATUSES = ("killed", "deleted", "deactivated")
+
+
+# getSnapshotImageName(serverName, tag) returns the name of the snapshot image of the server with the tag
+def getSnapshotImageName(serverName, tag):
+    return serverName + "@" + tag
+
+
+# isServerSnapshot(image, serverName) returns True if the image is a snapshot of the server with any tag
+def isServerSnapshot(image, serverName):
+    return image is not None and image["name"].startswith(getSnapshotImageName(serverName, ""))
+
+
+# saveSnapshots(config, serverNames, tag, arguments) snapshots the servers "serverNames" at once: the snapshot
+# requests are sent by up to "arguments.parallel" workers, then all the images are awaited together with one image
+# list call per check. The images are named "<server>@<tag>", the older images of the same name are deleted only
+# after the new ones are active, so a failed save does not lose the previous snapshot of the tag.
+@inPhase("snapshot save")
+def saveSnapshots(config, serverNames, tag, arguments):
+    wanted = set(serverNames)
+    servers = {}
+    for server in callWithRetry(lambda: list(conn.compute.servers())):
+        if server["name"] in wanted:
+            servers.setdefault(server["name"], server)
+    previous = {}
+    for image in callWithRetry(lambda: list(conn.image.images())):
+        previous.setdefault(image["name"], []).append(image)
+
+    requested = []
+    for name in dict.fromkeys(serverNames):
+        title = 'Snapshot of server "' + name + '" to "' + getSnapshotImageName(name, tag) + '"'
+        server = servers.get(name)
+        if server is None:
+            report(title + ' ...   SKIPPED: The server does not exist.')
+        elif server["status"] not in SNAPSHOT_SERVER_STATUSES:
+            report(title + ' ...   FAILED: The server is in ' + server["status"] + ' state.')
+        else:
+            requested.append((name, title, server))
+
+    # findSnapshot(name) returns the new snapshot image of the server, which a failed request might have created
+    def findSnapshot(name):
+        previousIDs = set(image["id"] for image in previous.get(getSnapshotImageName(name, tag), []))
+        for image in callWithRetry(lambda: list(conn.image.images())):
+            if image["name"] == getSnapshotImageName(name, tag) and image["id"] not in previousIDs:
+                return image
+        return None
+
+    def requestSnapshot(item):
+        name, title, server = item
+        try:
+            image = callCreateWithRetry(lambda: findSnapshot(name), conn.compute.create_server_image, server,
+                                        getSnapshotImageName(name, tag),
+                                        metadata={"openstack_vim_server": name, "openstack_vim_tag": tag})
+            return image, None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, arguments.parallel)) as executor:
+        images = list(executor.map(withCurrentRegion(requestSnapshot), requested))
+
+    errors = waitForImages([image["id"] for image, error in images if image is not None])
+    for (name, title, server), (image, error) in zip(requested, images):
+        if image is not None:
+            error = errors.get(image["id"])
+        if error is not None:
+            report(title + ' ...   FAILED: ' + error)
+            continue
+        # The previous snapshots of the tag are replaced
+        for old in previous.get(getSnapshotImageName(name, tag), []):
+            callWithRetry(conn.image.delete_image, old, ignore_missing=True)
+        report(title + ' ...   OK')
+
+
+# waitForImages(imageIDs) waits until all the images are active and returns a dictionary of image ID -> the reason
+# of the failure of the images, which have failed. All the pending images are checked with one list call
+def waitForImages(imageIDs):
+    pending = set(imageIDs)
+    errors = {}
+    interval = SNAPSHOT_POLL_INTERVAL_MIN
+    deadline = time.monotonic() + SNAPSHOT_WAIT_TIMEOUT
+    while pending:
+        time.sleep(interval)
+        # Glance can not filter the images by a list of IDs, all of them are listed
+        images = {image["id"]: image for image in callWithRetry(lambda: list(conn.image.images()))}
+        finished = 0
+        for imageID in list(pending):
+            image = images.get(imageID)
+            if image is not None and image["status"] == "active":
+                pending.discard(imageID)
+                finished += 1
+            elif image is None or image["status"] in FAILED_IMAGE_STATUSES:
+                pending.discard(imageID)
+                errors[imageID] = 'Image ' + imageID + ' is ' + ("deleted" if image is None else image["status"]) + '.'
+        if time.monotonic() > deadline:
+            for imageID in pending:
+                errors[imageID] = 'Timeout while waiting for the image ' + imageID + '.'
+            break
+        interval = SNAPSHOT_POLL_INTERVAL_MIN if finished else min(SNAPSHOT_POLL_INTERVAL_MAX,
+                                                                  interval * SNAPSHOT_POLL_BACKOFF)
+    return errors
+
+
+# restoreSnapshots(config, serverNames, tag, arguments) returns the servers "serverNames" to their snapshots of
+# the tag. The existing servers are rebuilt from their snapshots, they keep their ports and addresses, the missing
+# servers are created from them. Neither runs the init script again, the snapshot is already provisioned.
+# The rebuild requests are sent by up to "arguments.parallel" workers and awaited together by the server poller,
+# the missing servers are created meanwhile like "--create" does it. The function returns the names of the restored
+# servers
+@inPhase("snapshot restore")
+def restoreSnapshots(config, serverNames, tag, arguments):
+    wanted = set(serverNames)
+    servers = {}
+    for server in callWithRetry(lambda: list(conn.compute.servers())):
+        if server["name"] in wanted:
+            servers.setdefault(server["name"], server)
+    images = {}
+    for image in callWithRetry(lambda: list(conn.image.images())):
+        if image["status"] == "active":
+            images.setdefault(image["name"], image)
+
+    rebuilt = []
+    missing = []
+    for name in dict.fromkeys(serverNames):
+        imageName = getSnapshotImageName(name, tag)
+        if imageName not in images:
+            report('Restore of server "' + name + '" from "' + imageName + '" ...   FAILED: '
+                   'The snapshot does not exist.')
+        elif name in servers:
+            rebuilt.append((name, servers[name], images[imageName]))
+        else:
+            missing.append(name)
+
+    def requestRebuild(item):
+        name, server, image = item
+        try:
+            return poller.watch(callWithRetry(conn.compute.rebuild_server, server, image=image["id"]), ACTIVE), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, arguments.parallel)) as executor:
+        watches = list(executor.map(withCurrentRegion(requestRebuild), rebuilt))
+
+    restored = []
+    if missing:
+        networkNames = dict.fromkeys(netw["name"] for name in missing for netw in config.getServer(name)["networks"]
+                                     if config.getNetwork(netw["name"]) is not None)
+        results = createInfrastructure(getRestoreConfig(config, missing, tag), missing, list(networkNames), arguments)
+        restored.extend(getCreatedServerNames(results))
+
+    for (name, server, image), (watch, error) in zip(rebuilt, watches):
+        title = 'Restore of server "' + name + '" from "' + image["name"] + '"'
+        if watch is not None:
+            try:
+                watch.wait()
+            except ServerStatusError as e:
+                error = str(e)
+        if error is not None:
+            report(title + ' ...   FAILED: ' + error)
+        else:
+            report(title + ' ...   OK')
+            restored.append(name)
+    return restored
+
+
+# getRestoreConfig(config, serverNames, tag) returns the configuration, in which the servers "serverNames" boot from
+# their snapshots of the tag without the init script. The servers of a template are created one by one, every one
+# has its own snapshot
+def getRestoreConfig(config, serverNames, tag):
+    restored = set(serverNames)
+    servers = []
+    for servConfig in config["servers"]:
+        if servConfig["name"] in restored:
+            servConfig = dict(servConfig, instance_snapshot=getSnapshotImageName(servConfig["name"], tag))
+            servConfig.pop("init-script", None)
+            servConfig.pop("template", None)
+        servers.append(servConfig)
+    return InfrastructureConfig(dict(config, servers=servers))
@@ -6,11 +6,12 @@
 #   |_|    |_|\__,_| \_/ \___/|_|
 #
 #
+from os_resolver import resolver
 
 
 # isFlavorExist(flavorName) returns True if an flavor with the name flavorName exists.
 def isFlavorExist(conn, flavorName):
-    if conn.compute.find_flavor(flavorName) is not None:
+    if resolver.get("flavor", flavorName) is not None:
         return True
     return False
 
@@ -18,7 +19,7 @@ def isFlavorExist(conn, flavorName):
 # getFlavorByName(flavorName) returns flavor object of the flavor with the name flavorName.
 # if the flavor does not exist, the function returns None
 def getFlavorByName(conn, flavorName):
-    flavor = conn.compute.find_flavor(flavorName)
+    flavor = resolver.get("flavor", flavorName)
     if flavor is not None:
         return flavor
     return None
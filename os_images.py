@@ -7,15 +7,15 @@
 #                           __/ |
 #                          |___/
 
-from globals import conn
+from os_resolver import resolver
 
 
 # isImageExist(imageName) returns True if an image with the name imageName exists.
 def isImageExist(imageName):
-    return conn.compute.find_image(imageName) is not None
+    return resolver.get("image", imageName) is not None
 
 
 # getImageByName(imageName) returns image object of the image with the name imageName.
 # if the image does not exist, the function returns None
 def getImageByName(imageName):
-    return conn.compute.find_image(imageName)
\ No newline at end of file
+    return resolver.get("image", imageName)
\ No newline at end of file
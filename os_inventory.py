@@ -0,0 +1,306 @@
+#    _____                      _
+#   |_   _|                    | |
+#     | |  _ ____   _____ _ __ | |_ ___  _ __ _   _
+#     | | | '_ \ \ / / _ \ '_ \| __/ _ \| '__| | | |
+#    _| |_| | | \ V /  __/ | | | || (_) | |  | |_| |
+#   |_____|_| |_|\_/ \___|_| |_|\__\___/|_|   \__, |
+#                                              __/ |
+#                                             |___/
+import os
+import json
+import time
+import fcntl
+
+from globals import conn, report, CLOUD_NAME
+from os_regions import currentRegion
+from os_state import getStatePath
+
+# Format of the inventory state file, the files of the other formats are ignored
+INVENTORY_STATE_VERSION = 2
+# Maximum age of the cached dynamic inventory ("--list"), seconds
+INVENTORY_CACHE_TTL = 60
+# If more than this part of the servers has changed, one listing of all ports is cheaper than per server queries
+INCREMENTAL_LIMIT = 0.5
+
+# Fields of the resources kept in the inventory state file
+SERVER_FIELDS = ("id", "name", "status", "updated")
+PORT_FIELDS = ("id", "network_id", "device_id", "fixed_ips", "revision_number")
+SUBNET_FIELDS = ("id", "network_id")
+NETWORK_FIELDS = ("id", "name")
+
+
+# takeInventorySnapshot() lists servers, ports, subnets and networks of the project once each and
+# returns a dictionary of id-keyed indexes over them:
+#   "servers"        - server name -> server object
+#   "portsByDevice"  - device (server) ID -> list of its ports
+#   "subnets"        - subnet ID -> subnet object
+#   "networks"       - network ID -> network object
+#   "networksByName" - network name -> network object
+#   "timestamp"      - time of the latest server change
+# The snapshot is used to answer all lookups of a config generation without any further API calls.
+def takeInventorySnapshot():
+    snapshot = {"servers": {}, "portsByDevice": {}, "subnets": {}, "networks": {}, "networksByName": {}}
+
+    servers = list(conn.compute.servers())
+    for server in servers:
+        # OpenStack does not force unique server names, keep the first one like "find_server" would do
+        if server["name"] not in snapshot["servers"]:
+            snapshot["servers"][server["name"]] = server
+    # Time of the latest server change, the next "--incremental" generation asks for the servers changed since it
+    snapshot["timestamp"] = _latestTimestamp(None, servers)
+
+    for port in conn.network.ports():
+        snapshot["portsByDevice"].setdefault(port["device_id"], []).append(port)
+
+    for subnet in conn.network.subnets():
+        snapshot["subnets"][subnet["id"]] = subnet
+
+    for network in conn.network.networks():
+        snapshot["networks"][network["id"]] = network
+        snapshot["networksByName"].setdefault(network["name"], network)
+
+    return snapshot
+
+
+# getSnapshotServer(snapshot, name) returns the server with the name "name" or None if it is not running.
+def getSnapshotServer(snapshot, name):
+    return snapshot["servers"].get(name)
+
+
+# getSnapshotPorts(snapshot, serverID) returns the list of ports attached to the server with the ID serverID.
+def getSnapshotPorts(snapshot, serverID):
+    return snapshot["portsByDevice"].get(serverID, [])
+
+
+# getSnapshotNetworkByID(snapshot, networkID) returns the network with the ID networkID or None.
+def getSnapshotNetworkByID(snapshot, networkID):
+    return snapshot["networks"].get(networkID)
+
+
+# getSnapshotNetworkByName(snapshot, name) returns the network with the name "name" or None.
+def getSnapshotNetworkByName(snapshot, name):
+    return snapshot["networksByName"].get(name)
+
+
+# getSnapshotNetworkBySubnetID(snapshot, subnetID) returns the network, that contains the subnet with
+# the ID subnetID, or None if there is no such subnet or network.
+def getSnapshotNetworkBySubnetID(snapshot, subnetID):
+    subnet = snapshot["subnets"].get(subnetID)
+    if subnet is None:
+        return None
+    return snapshot["networks"].get(subnet["network_id"])
+
+
+# getServerTimestamp(server) returns the time of the last change of the server
+def getServerTimestamp(server):
+    timestamp = getattr(server, "updated_at", None)
+    if timestamp is None:
+        try:
+            timestamp = server["updated"]
+        except (KeyError, TypeError):
+            timestamp = None
+    return timestamp
+
+
+# _project(resource, fields) returns a plain dictionary with the listed fields of the resource
+def _project(resource, fields):
+    entry = {}
+    for field in fields:
+        if field == "updated":
+            entry[field] = getServerTimestamp(resource)
+        elif field == "fixed_ips":
+            entry[field] = [{"subnet_id": fi["subnet_id"], "ip_address": fi["ip_address"]}
+                            for fi in resource[field]]
+        else:
+            entry[field] = resource[field]
+    return entry
+
+
+# getInventoryStateFile(configFile) returns the file keeping the inventory snapshot of the last "--incremental"
+# config generation of the current region and the configuration file in the state directory
+def getInventoryStateFile(configFile):
+    region = currentRegion()
+    return getStatePath(CLOUD_NAME if region is None else region.label, configFile, "inventory-state", ".json")
+
+
+# loadInventoryState(configFile) returns the inventory snapshot saved by the previous config generation or None
+def loadInventoryState(configFile):
+    try:
+        with open(getInventoryStateFile(configFile)) as f:
+            inventoryState = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(inventoryState, dict) or inventoryState.get("version") != INVENTORY_STATE_VERSION:
+        return None
+    return inventoryState
+
+
+# saveInventoryState(snapshot, serverNames, configFile) saves the part of the snapshot describing the servers
+# "serverNames", so the next "--incremental" config generation re-queries only the servers changed since this one.
+# A failure to save it is reported, the next generation takes the full snapshot then
+def saveInventoryState(snapshot, serverNames, configFile):
+    inventoryState = getInventoryState(snapshot, serverNames)
+    stateFile = getInventoryStateFile(configFile)
+    tmpName = stateFile + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(stateFile), exist_ok=True)
+        with open(tmpName, "w") as f:
+            json.dump(inventoryState, f)
+        os.replace(tmpName, stateFile)
+    except OSError as e:
+        report('Saving of the inventory state "' + stateFile + '" ...   FAILED: ' + str(e))
+
+
+# getInventoryState(snapshot, serverNames) returns the part of the snapshot describing the servers "serverNames"
+# as plain dictionaries, see takeIncrementalSnapshot()
+def getInventoryState(snapshot, serverNames):
+    inventoryState = {"version": INVENTORY_STATE_VERSION, "timestamp": snapshot.get("timestamp"),
+                      "servers": {}, "ports": {},
+                      "subnets": [_project(s, SUBNET_FIELDS) for s in snapshot["subnets"].values()],
+                      "networks": [_project(n, NETWORK_FIELDS) for n in snapshot["networks"].values()]}
+    for name in serverNames:
+        server = getSnapshotServer(snapshot, name)
+        if server is None:
+            continue
+        inventoryState["servers"][name] = _project(server, SERVER_FIELDS)
+        inventoryState["ports"][server["id"]] = [_project(p, PORT_FIELDS) for p in getSnapshotPorts(snapshot,
+                                                                                                    server["id"])]
+    return inventoryState
+
+
+# loadCachedInventory(path, ttl, build) returns the dynamic inventory saved in the file "path", if it is not older
+# than "ttl" seconds, otherwise the inventory made by build(), which is saved to the file. Ansible runs the inventory
+# script for every playbook, the concurrent runs are serialized by a lock file, so only the first of them lists
+# the resources and the others read its result
+def loadCachedInventory(path, ttl, build):
+    inventory = _readCachedInventory(path, ttl)
+    if inventory is not None:
+        return inventory
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            # Another run might have refreshed the inventory, while this one has been waiting for the lock
+            inventory = _readCachedInventory(path, ttl)
+            if inventory is None:
+                inventory = build()
+                tmpName = path + ".tmp"
+                with open(tmpName, "w") as f:
+                    json.dump({"timestamp": time.time(), "inventory": inventory}, f)
+                os.replace(tmpName, path)
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+    return inventory
+
+
+# _readCachedInventory(path, ttl) returns the inventory of the file, if it is not older than "ttl" seconds, or None
+def _readCachedInventory(path, ttl):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or not 0 <= time.time() - cached.get("timestamp", 0) < ttl:
+        return None
+    return cached.get("inventory")
+
+
+# _latestTimestamp(timestamp, servers) returns the latest change time of the servers and the timestamp
+def _latestTimestamp(timestamp, servers):
+    for server in servers:
+        updated = getServerTimestamp(server)
+        if updated is not None and (timestamp is None or updated > timestamp):
+            timestamp = updated
+    return timestamp
+
+
+# takeIncrementalSnapshot(serverNames, previous) returns a snapshot like takeInventorySnapshot() does, but only
+# the servers "serverNames" added, removed or changed since the previous config generation are re-queried. Entries
+# of the unchanged servers and the known subnets and networks are taken from the inventory state "previous"
+# (see getInventoryState(), loadInventoryState()). The servers are listed with the "changes-since" filter only, which
+# returns the deleted servers too. The ports are still listed all at once, a port can change without its server, so
+# a server, whose ports have changed, is re-queried as well. Without the previous state, or if most of the servers
+# have changed, the full snapshot is taken.
+def takeIncrementalSnapshot(serverNames, previous):
+    if previous is None or not previous["timestamp"]:
+        return takeInventorySnapshot()
+
+    # Servers changed since the last generation: the new, updated, renamed and deleted ones
+    names = set(serverNames)
+    changedServers = list(conn.compute.servers(changes_since=previous["timestamp"]))
+    changedIDs = set(server["id"] for server in changedServers)
+    changed = {}
+    for server in changedServers:
+        if server["name"] in names and server["status"] != "DELETED":
+            changed.setdefault(server["name"], server)
+
+    # The servers, which are absent in the list, have not changed since the last generation
+    running = {}
+    for name, known in previous["servers"].items():
+        if name in names and known["id"] not in changedIDs:
+            running[name] = known
+    running.update(changed)
+
+    # Ports of all the servers with one list call. A port can change without its server (another fixed IP address,
+    # an interface attached or detached), its revision number changes then
+    ports = {}
+    for port in conn.network.ports():
+        ports.setdefault(port["device_id"], []).append(port)
+
+    # The filter is inclusive, the servers changed exactly at the timestamp are already known
+    requery = []
+    for name, server in running.items():
+        known = previous["servers"].get(name, {})
+        if known.get("id") != server["id"] or \
+                (name in changed and getServerTimestamp(changed[name]) != known.get("updated")) or \
+                _getPortRevisions(ports.get(server["id"], [])) != \
+                _getPortRevisions(previous["ports"].get(server["id"], [])):
+            requery.append(name)
+    if len(requery) > INCREMENTAL_LIMIT * max(len(names), 1):
+        return takeInventorySnapshot()
+
+    snapshot = {"servers": {}, "portsByDevice": {}, "subnets": {}, "networks": {}, "networksByName": {},
+                "timestamp": _latestTimestamp(previous["timestamp"], changedServers)}
+    for subnet in previous["subnets"]:
+        snapshot["subnets"][subnet["id"]] = subnet
+    for network in previous["networks"]:
+        snapshot["networks"][network["id"]] = network
+        snapshot["networksByName"].setdefault(network["name"], network)
+
+    for name, server in running.items():
+        if name not in requery:
+            snapshot["servers"][name] = previous["servers"][name]
+            snapshot["portsByDevice"][server["id"]] = previous["ports"].get(server["id"], [])
+            continue
+        entry = changed.get(name)
+        if entry is None:
+            # The server itself has not changed, only its ports, the inventory state has no addresses of the server
+            entry = conn.compute.get_server(server["id"])
+        snapshot["servers"][name] = entry
+        snapshot["portsByDevice"][server["id"]] = ports.get(server["id"], [])
+
+    # Subnets and networks are listed again only if the re-queried ports refer to unknown ones
+    for ports in snapshot["portsByDevice"].values():
+        if any(port["network_id"] not in snapshot["networks"] or
+               any(fi["subnet_id"] not in snapshot["subnets"] for fi in port["fixed_ips"]) for port in ports):
+            _refreshNetworks(snapshot)
+            break
+    return snapshot
+
+
+# _getPortRevisions(ports) returns the IDs and the revision numbers of the ports to compare them
+def _getPortRevisions(ports):
+    return sorted((port["id"], port["revision_number"]) for port in ports)
+
+
+# _refreshNetworks(snapshot) replaces the subnets and networks of the snapshot with the current ones
+def _refreshNetworks(snapshot):
+    snapshot["subnets"] = {}
+    snapshot["networks"] = {}
+    snapshot["networksByName"] = {}
+    for subnet in conn.network.subnets():
+        snapshot["subnets"][subnet["id"]] = subnet
+    for network in conn.network.networks():
+        snapshot["networks"][network["id"]] = network
+        snapshot["networksByName"].setdefault(network["name"], network)
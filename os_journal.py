@@ -0,0 +1,115 @@
+#         _                              _
+#        | |                            | |
+#        | | ___  _   _ _ __ _ __   __ _| |
+#    _   | |/ _ \| | | | '__| '_ \ / _` | |
+#   | |__| | (_) | |_| | |  | | | | (_| | |
+#    \____/ \___/ \__,_|_|  |_| |_|\__,_|_|
+#
+import os
+import json
+import time
+import threading
+
+from globals import CLOUD_NAME
+from os_regions import RegionLocal
+from os_state import state, getStatePath
+
+# States of the journaled operations: the request has been sent, the resource is ready, the operation has failed,
+# the deletion request has been sent, the resource is gone
+JOURNAL_CREATING = "creating"
+JOURNAL_CREATED = "created"
+JOURNAL_FAILED = "failed"
+JOURNAL_DELETING = "deleting"
+JOURNAL_DELETED = "deleted"
+
+
+# Journal of the create and delete operations of the networks and servers. Every operation appends a line with
+# the resource type, name, ID and state as soon as it changes, so a run interrupted at any point (a timeout of
+# the API, Ctrl+C, a sleeping laptop) leaves the record of what it has done. A "--resume" run replays the journal
+# of the interrupted run: the finished resources are taken from it without any lookup, the servers, which were still
+# booting or being deleted, are awaited by their IDs, and only the unfinished work is done again. The journal is
+# kept next to the state file, one per cloud, region and configuration file, every changing operation without
+# "--resume" starts a new one.
+class OperationJournal(object):
+    def __init__(self, region=None):
+        self._cloud = CLOUD_NAME if region is None else region.label
+        self._lock = threading.Lock()
+        self._file = None
+        self._operation = None
+        # (type, name) -> the last entry of the interrupted run, empty unless the run resumes it. The entry is dropped
+        # as soon as the resumed run changes the resource, it does not describe the resource anymore
+        self._resumed = {}
+
+    # open(configFile, operation, resume) starts the journal of the operation ("create", "restart", ...) with
+    # the configuration file. If "resume" is True, the journal of the interrupted run of the same operation is
+    # replayed first and continued, the resources IDs it has are stored in the state
+    def open(self, configFile, operation, resume=False):
+        path = getStatePath(self._cloud, configFile, "journal", ".jsonl")
+        with self._lock:
+            self._operation = operation
+            self._resumed = {}
+            if resume:
+                self._resumed = self._replay(path, operation)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, "a" if resume else "w")
+
+        for (kind, name), entry in self._resumed.items():
+            if entry["state"] == JOURNAL_CREATED:
+                state.record(kind, {"name": name, "id": entry["id"]})
+            elif entry["state"] == JOURNAL_DELETED:
+                state.forget(kind, name)
+
+    # _replay(path, operation) returns the last entry of every resource of the journal file. The entries of another
+    # operation are ignored, the interrupted run did something else
+    @staticmethod
+    def _replay(path, operation):
+        entries = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if entry.get("operation") == operation:
+                            entries[(entry["kind"], entry["name"])] = entry
+                    except (ValueError, KeyError, TypeError):
+                        # The last line might be cut by the interruption
+                        continue
+        except OSError:
+            pass
+        return entries
+
+    # close() closes the journal, the operations are not recorded anymore
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._resumed = {}
+
+    # record(kind, name, resourceID, status) appends the state of the operation with the resource to the journal
+    def record(self, kind, name, resourceID, status):
+        line = json.dumps({"time": int(time.time()), "operation": self._operation, "kind": kind, "name": name,
+                           "id": resourceID, "state": status})
+        with self._lock:
+            if self._file is None:
+                return
+            self._resumed.pop((kind, name), None)
+            self._file.write(line + "\n")
+            # The line has to survive the interruption of the process
+            self._file.flush()
+
+    # getResumed(kind, name) returns the last entry of the resource in the journal of the interrupted run or None,
+    # the entry has the "id" and the "state" of the resource
+    def getResumed(self, kind, name):
+        with self._lock:
+            return self._resumed.get((kind, name))
+
+    # isRecreated(kind, name) returns True if the interrupted run has already deleted the resource and created it
+    # again ("--restart"): the resource, which exists now, must not be deleted by the deletion phase of the resumed run
+    def isRecreated(self, kind, name):
+        entry = self.getResumed(kind, name)
+        return entry is not None and entry["state"] in (JOURNAL_CREATING, JOURNAL_CREATED)
+
+
+# Every region has its own journal
+journal = RegionLocal(OperationJournal)
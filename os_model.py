@@ -0,0 +1,235 @@
+#    __  __           _      _
+#   |  \/  |         | |    | |
+#   | \  / | ___   __| | ___| |
+#   | |\/| |/ _ \ / _` |/ _ \ |
+#   | |  | | (_) | (_| |  __/ |
+#   |_|  |_|\___/ \__,_|\___|_|
+#
+import os
+import ipaddress
+
+import yaml
+
+from os_templates import expandServerTemplates
+from os_userdata import userDataBuilder
+from os_regions import parseRegion
+
+# The C implementation of the YAML parser is several times faster, it is used when PyYAML is built with libyaml.
+# The loader accepts the same tags as yaml.full_load() of the previous versions, the existing configurations stay valid
+YAML_LOADER = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# Mandatory parameters of the configuration entries
+NETWORK_KEYS = ("name", "cidr")
+SERVER_KEYS = ("name", "image", "flavor", "networks")
+
+
+# Invalid configuration file, the message lists all the errors found
+class ConfigurationError(Exception):
+    def __init__(self, errors):
+        super(ConfigurationError, self).__init__("\n".join(errors))
+        self.errors = errors
+
+
+# The configuration file loaded once and indexed by the resource names. It is the dictionary of the YAML file,
+# so the entries are accessed like before ("config["servers"]"), and the lookups by name take constant time.
+class InfrastructureConfig(dict):
+    def __init__(self, data):
+        super(InfrastructureConfig, self).__init__(data or {})
+        self.parameters = self.get("parameters") or {}
+        # The first entry of a duplicated name wins, like it did with the linear search, validateConfig()
+        # reports the duplicates
+        self.servers = {}
+        for servConfig in self.get("servers") or []:
+            self.servers.setdefault(servConfig.get("name"), servConfig)
+        self.networks = {}
+        for netwConfig in self.get("networks") or []:
+            self.networks.setdefault(netwConfig.get("name"), netwConfig)
+
+    # getServer(name) returns the servers config entry with the name "name" or None
+    def getServer(self, name):
+        return self.servers.get(name)
+
+    # getNetwork(name) returns the networks config entry with the name "name" or None
+    def getNetwork(self, name):
+        return self.networks.get(name)
+
+    # getUser(image) returns the user name of the servers booted from the image or None
+    def getUser(self, image):
+        return (self.parameters.get("users") or {}).get(image)
+
+
+# loadConfig(fileName) reads the configuration file, expands the server templates and returns
+# the InfrastructureConfig. A syntax error or an error in a server template raises ConfigurationError
+def loadConfig(fileName):
+    try:
+        with open(fileName) as f:
+            data = yaml.load(f, Loader=YAML_LOADER)
+    except yaml.YAMLError as e:
+        raise ConfigurationError([str(e)])
+    if data is not None and not isinstance(data, dict):
+        raise ConfigurationError(['The root element has to be a dictionary.'])
+    for section in ("networks", "servers"):
+        entries = (data or {}).get(section) or []
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            raise ConfigurationError(['"' + section + '" has to be a list of dictionaries.'])
+
+    # Server templates with the "count" key are replaced with the servers generated from them
+    try:
+        expandServerTemplates(data)
+    except ValueError as e:
+        raise ConfigurationError([str(e)])
+    except KeyError as e:
+        raise ConfigurationError(['Server template has no "' + str(e.args[0]) + '" parameter.'])
+    return InfrastructureConfig(data)
+
+
+# validateConfig(config, ssh_dir) checks the configuration without any API call and returns the list of errors
+# and the list of warnings. The errors are the problems, which would fail a part of the run: duplicated names and
+# fixed IP addresses, invalid CIDRs, fixed IP addresses outside the CIDR of their network, unreadable init
+# scripts, user data over the Nova limit, unreadable ssh keys and invalid clouds. The warnings are the things,
+# which might be right: networks, which are not described in the configuration file (they have to exist in
+# OpenStack), images without a user in "parameters.users" and public keys without their private keys (the keypair
+# might exist in OpenStack, it can not be generated only).
+# The local files (init scripts, ssh keys in "ssh_dir") are checked only if "ssh_dir" is given
+def validateConfig(config, ssh_dir=None):
+    errors = []
+    warnings = []
+
+    # The clouds and regions, which the configuration is applied to
+    clouds = config.parameters.get("clouds")
+    if clouds is not None and not isinstance(clouds, list):
+        errors.append('"parameters.clouds" has to be a list.')
+    elif clouds is not None:
+        regions = set()
+        for value in clouds:
+            try:
+                region = parseRegion(value)
+            except ValueError as e:
+                errors.append(str(e))
+                continue
+            if region in regions:
+                errors.append('Cloud "' + region.label + '" is listed more than once in "parameters.clouds".')
+            regions.add(region)
+
+    ttl = config.parameters.get("inventory_ttl")
+    if ttl is not None and (not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or ttl < 0):
+        errors.append('"parameters.inventory_ttl" has to be a non-negative number of seconds.')
+
+    # Network name -> IPv4 network of the CIDR or None, if the CIDR is invalid
+    cidrs = {}
+    for netwConfig in config.get("networks") or []:
+        missing = [key for key in NETWORK_KEYS if not netwConfig.get(key)]
+        if missing:
+            errors.append('Network ' + _describe(netwConfig) + ' has no "' + missing[0] + '" parameter.')
+            continue
+        name = netwConfig["name"]
+        if name in cidrs:
+            errors.append('Network "' + name + '" is described more than once.')
+            continue
+        try:
+            cidrs[name] = ipaddress.IPv4Network(str(netwConfig["cidr"]))
+        except ValueError as e:
+            cidrs[name] = None
+            errors.append('Network "' + name + '" has invalid cidr "' + str(netwConfig["cidr"]) + '": ' + str(e))
+
+    serverNames = set()
+    # (network name, address) -> name of the server, which has the fixed address
+    addresses = {}
+    unknownNetworks = set()
+    unknownImages = set()
+    keypairs = set()
+    for servConfig in config.get("servers") or []:
+        missing = [key for key in SERVER_KEYS if not servConfig.get(key)]
+        if missing:
+            errors.append('Server ' + _describe(servConfig) + ' has no "' + missing[0] + '" parameter.')
+            continue
+        name = servConfig["name"]
+        if name in serverNames:
+            errors.append('Server "' + name + '" is described more than once.')
+            continue
+        serverNames.add(name)
+
+        connected = set()
+        for netw in servConfig["networks"]:
+            if not isinstance(netw, dict) or not netw.get("name"):
+                errors.append('Server "' + name + '" has a network connection without the "name" parameter.')
+                continue
+            netwName = netw["name"]
+            # The pre-created ports are named after the server and the network
+            if netwName in connected:
+                errors.append('Server "' + name + '" is connected to the network "' + netwName + '" more than once.')
+            connected.add(netwName)
+            if netwName not in cidrs:
+                unknownNetworks.add(netwName)
+            if "ipv4" not in netw:
+                continue
+
+            try:
+                address = ipaddress.IPv4Address(str(netw["ipv4"]))
+            except ValueError:
+                errors.append('Server "' + name + '" has invalid IPv4 address "' + str(netw["ipv4"]) +
+                              '" in the network "' + netwName + '".')
+                continue
+            cidr = cidrs.get(netwName)
+            if cidr is not None:
+                if address not in cidr:
+                    errors.append('Address ' + str(address) + ' of the server "' + name + '" is outside of the cidr ' +
+                                  str(cidr) + ' of the network "' + netwName + '".')
+                elif cidr.prefixlen < 31 and address in (cidr.network_address, cidr.broadcast_address):
+                    errors.append('Address ' + str(address) + ' of the server "' + name + '" is the network or '
+                                  'broadcast address of the network "' + netwName + '".')
+            owner = addresses.setdefault((netwName, address), name)
+            if owner != name:
+                errors.append('Address ' + str(address) + ' in the network "' + netwName + '" is assigned to both '
+                              'servers "' + owner + '" and "' + name + '".')
+
+        if config.getUser(servConfig["image"]) is None:
+            unknownImages.add(servConfig["image"])
+        keypairs.add(servConfig.get("keypair") or name)
+
+        # The user data is built and cached for the server creation, its size is checked too
+        if ssh_dir is not None and "init-script" in servConfig:
+            userData, error = userDataBuilder.build(config, servConfig)
+            if userData is None:
+                errors.append('Server "' + name + '": ' + error)
+
+    # A keypair, which is absent in OpenStack, is uploaded from the private key or generated, which overwrites
+    # the private key file
+    if ssh_dir is not None:
+        if os.path.exists(ssh_dir) and not os.path.isdir(ssh_dir):
+            errors.append('ssh directory "' + ssh_dir + '" is not a directory.')
+        else:
+            for keypair in sorted(keypairs):
+                privateKeyPath = ssh_dir + os.path.sep + keypair
+                if os.path.exists(privateKeyPath):
+                    error = _checkReadableFile(privateKeyPath)
+                    if error is not None:
+                        errors.append('Private key "' + privateKeyPath + '" ' + error)
+                elif os.path.exists(privateKeyPath + ".pub"):
+                    # The keypair might exist in OpenStack already, only its generation would fail
+                    warnings.append('Public key "' + privateKeyPath + '.pub" has no private key "' + privateKeyPath +
+                                    '" in the ssh directory, the keypair "' + keypair + '" can not be generated.')
+
+    for netwName in sorted(unknownNetworks):
+        warnings.append('Network "' + netwName + '" is not described in the "networks" section, '
+                        'it has to exist in OpenStack.')
+    for image in sorted(unknownImages):
+        warnings.append('Image "' + image + '" has no user in "parameters.users", '
+                        'the generated configs will have no user for its servers.')
+    return errors, warnings
+
+
+# _describe(entry) returns the name of the config entry for an error message
+def _describe(entry):
+    if isinstance(entry, dict) and entry.get("name"):
+        return '"' + str(entry["name"]) + '"'
+    return str(entry)
+
+
+# _checkReadableFile(path) returns the reason, why the file can not be read, or None
+def _checkReadableFile(path):
+    if not os.path.isfile(str(path)):
+        return 'does not exist.'
+    if not os.access(str(path), os.R_OK):
+        return 'is not readable.'
+    return None
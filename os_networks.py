@@ -6,118 +6,285 @@
 #   |_| \_|\___|\__| \_/\_/ \___/|_|  |_|\_\___/
 #
 #
-from globals import conn
+from globals import conn, report, getResourceLock
+from os_resolver import resolver
+from os_retry import callWithRetry, callCreateWithRetry
+from os_state import isNotFound
+from os_journal import journal, JOURNAL_CREATING, JOURNAL_CREATED, JOURNAL_FAILED, JOURNAL_DELETED
+from os_profile import inPhase
 
 
 # isNetworkExist(networkName) returns True if a network with the name networkName exists.
 def isNetworkExist(networkName):
-    return conn.network.find_network(networkName) is not None
+    return resolver.get("network", networkName) is not None
 
 
 # getNetworkByName(networkName) returns network object of the network with the name networkName.
 # if the network does not exist, the function returns None
 def getNetworkByName(networkName):
-    return conn.network.find_network(networkName)
+    return resolver.get("network", networkName)
 
 
-# getNetworkByID(networkID) returns network object of the network with the desired ID.
-# if the network does not exist, the function returns None
-def getNetworkByID(networkID):
-    for n in conn.network.networks():
-        if n.id == networkID:
-            return n
-    return None
+# createNetworkByName(config, name) creates the network and subnet with the name "name" and the parameters
+# from the "config" structure. The function returns the network object or None if the network can not be created
+@inPhase("network create")
+def createNetworkByName(config, name):
+    # Parallel workers creating the same network are serialized, the later ones find the network created
+    with getResourceLock("network", name):
+        return _createNetworkByName(config, name)
 
 
-# getNetworkBySubnetID(networkID) returns network object of the network, that contains the subnet with id subnetID.
-# if the network does not exist, the function returns None
-def getNetworkBySubnetID(subnetID):
-    for sn in conn.network.subnets():
-        if sn["id"] == subnetID:
-            for n in conn.network.networks():
-                if n["id"] == sn["network_id"]:
-                    return n
-    return None
+# _createNetworkByName(config, name) does the actual network creation for createNetworkByName(config, name)
+def _createNetworkByName(config, name):
+    # Look for an appropriate config entry in "config" dictionary
+    netConfig = config.getNetwork(name)
+    if netConfig is None:
+        return None
 
+    # The network created by the interrupted run is taken from the journal
+    network = getResumedNetwork(netConfig["name"])
+    if network is not None:
+        return network
 
-# createAllNetworks(config) creates all networks and subnets with the parameters from the "config" structure.
-def createNetworkByName(config, name):
-    # Look for an appropriate config entry in "config" dictionary
-    for netConfig in config["networks"]:
-        if netConfig["name"] != name:
-            continue
+    network = getNetworkByName(netConfig["name"])
+    # Check if the network already exists
+    if network is not None:
+        report('Creation of the network "' + netConfig['name'] + '" ...   SKIPPED: The network already exists.')
+        return network
+    # Creation of a new network without subnet
+    network = callCreateWithRetry(lambda: callWithRetry(conn.network.find_network, netConfig["name"]),
+                                  conn.network.create_network, name=netConfig["name"])
+    if network is None:
+        report('Creation of the network "' + netConfig['name'] + '" ...   '
+               'FAILED: Error during the network creation.')
+        return None
+    resolver.insert("network", network)
+    journal.record("network", network["name"], network["id"], JOURNAL_CREATING)
+
+    # If the subnet exists, report an error and exit
+    subnet = callWithRetry(conn.network.find_subnet, netConfig["name"])
+    if subnet is not None:
+        report('Creation of the network "' + netConfig['name'] + '" ...   FAILED: '
+               'Subnet with the name "' + netConfig["name"] + '" exists')
+        return None
+
+    subnet_args = _getSubnetArguments(config, netConfig, network["id"])
+
+    try:
+        subnet = callCreateWithRetry(lambda: callWithRetry(conn.network.find_subnet, netConfig["name"]),
+                                     conn.network.create_subnet, **subnet_args)
+    except Exception as e:
+        journal.record("network", network["name"], network["id"], JOURNAL_FAILED)
+        report('Creation of the network "' + netConfig['name'] + '" ...   FAILED: '
+               'Please, check parameters for a subnet creation: ' + str(e))
+        return None
+
+    # For some reason the subnet might not be created and no exceptions occurred
+    if subnet is None:
+        journal.record("network", network["name"], network["id"], JOURNAL_FAILED)
+        report('Creation of the network "' + netConfig['name'] + '" ...   FAILED: Error during subnet creation.')
+        return None
+    journal.record("network", network["name"], network["id"], JOURNAL_CREATED)
+    report('Creation of the network "' + netConfig['name'] + '" ...   OK')
+    return network
+
+
+# getResumedNetwork(name) returns the network, which the interrupted run has created according to the journal,
+# or None. The network is not looked up, only its name and ID are known
+def getResumedNetwork(name):
+    entry = journal.getResumed("network", name)
+    if entry is None or entry["state"] != JOURNAL_CREATED:
+        return None
+    network = {"name": name, "id": entry["id"]}
+    resolver.insert("network", network)
+    report('Creation of the network "' + name + '" ...   SKIPPED: The network has been created by the interrupted run.')
+    return network
+
+
+# Failure of a Neutron bulk request, it has the HTTP status code like the openstacksdk exceptions do
+class BulkRequestError(Exception):
+    def __init__(self, response):
+        super(BulkRequestError, self).__init__('Bulk request failed with HTTP ' + str(response.status_code) + ': ' +
+                                               response.text)
+        self.status_code = response.status_code
+        self.response = response
 
-        # The network config has been found
-        network = conn.network.find_network(netConfig["name"])
-        # Check if the network already exists
+
+# bulkCreate(collection, items) creates all the items of the Neutron collection ("networks", "subnets", "ports")
+# with one POST request and returns the created resources in the order of the items. Neutron creates either
+# all of them or none, BulkRequestError is raised on failure. The request is not sent again after a failure,
+# which might have created the items, the callers look the created items up
+def bulkCreate(collection, items):
+    def post():
+        response = conn.network.post("/" + collection, json={collection: items})
+        if response.status_code >= 400:
+            raise BulkRequestError(response)
+        return response.json()[collection]
+    return callCreateWithRetry(None, post)
+
+
+# _getSubnetArguments(config, netConfig, networkID) returns the parameters of the subnet of the network
+def _getSubnetArguments(config, netConfig, networkID):
+    subnet_args = {"name": netConfig["name"],
+                   "network_id": networkID,
+                   "ip_version": 4,
+                   "enable_dhcp": False,
+                   "gateway_ip": None,
+                   "cidr": netConfig["cidr"]}
+
+    # If DNS addresses on hostnames are in the config file, provide the information to the subnet creation process
+    if "parameters" in config.keys():
+        if "dns_nameservers" in config["parameters"]:
+            subnet_args["dns_nameservers"] = config["parameters"]["dns_nameservers"]
+    return subnet_args
+
+
+# createNetworks(config, names) creates the networks "names" with their subnets. Existing networks and subnets
+# are checked with one list call each, then all the missing networks are created with one Neutron bulk request
+# and all their subnets with another one. If a bulk request fails, its items are created one by one, so the
+# failed ones are found. The function returns a dictionary of network name -> network object or None if the
+# network can not be created
+@inPhase("network create")
+def createNetworks(config, names):
+    netConfigs = []
+    for name in dict.fromkeys(names):
+        if config.getNetwork(name) is not None:
+            netConfigs.append(config.getNetwork(name))
+    results = {name: None for name in names}
+
+    # The networks created by the interrupted run are taken from the journal, the others are looked up
+    for netConfig in list(netConfigs):
+        network = getResumedNetwork(netConfig["name"])
         if network is not None:
-            print('Creation of the network "' + netConfig['name'] + '" ...   SKIPPED: The network already exists.')
-            return network
-        # Creation of a new network without subnet
-        network = conn.network.create_network(name=netConfig["name"])
-        if network is None:
-            print('Creation of the network "' + netConfig['name'] + '" ...   FAILED: Error during the network creation.')
-            return None
-
-        # If the subnet exists, report an error and exit
-        subnet = conn.network.find_subnet(netConfig["name"])
-        if subnet is not None:
-            print('Creation of the network "' + netConfig['name'] + '" ...   FAILED: '
-                  'Subnet with the name "' + netConfig["name"] + '" exists')
-            return None
-
-        subnet_args = {"name": netConfig["name"],
-                       "network_id": network.id,
-                       "ip_version": "4",
-                       "enable_dhcp": False,
-                       "disable_gateway_ip": True,
-                       "gateway_ip": None,
-                       "cidr": netConfig["cidr"]}
-
-        # If DNS addresses on hostnames are in the config file, provide the information to the subnet creation process
-        if "parameters" in config.keys():
-            if "dns_nameservers" in config["parameters"]:
-                subnet_args["dns_nameservers"] = config["parameters"]["dns_nameservers"]
+            results[netConfig["name"]] = network
+            netConfigs.remove(netConfig)
+    if not netConfigs:
+        return results
+
+    # Parallel workers creating the same network are serialized, the later ones find the network created
+    locks = [getResourceLock("network", name) for name in sorted(set(n["name"] for n in netConfigs))]
+    for lock in locks:
+        lock.acquire()
+    try:
+        existing = {}
+        for network in callWithRetry(lambda: list(conn.network.networks())):
+            existing.setdefault(network["name"], network)
+        subnetNames = set(subnet["name"] for subnet in callWithRetry(lambda: list(conn.network.subnets())))
 
+        missing = []
+        for netConfig in netConfigs:
+            name = netConfig["name"]
+            network = existing.get(name)
+            if network is not None:
+                resolver.insert("network", network)
+                report('Creation of the network "' + name + '" ...   SKIPPED: The network already exists.')
+                results[name] = network
+            elif name in subnetNames:
+                report('Creation of the network "' + name + '" ...   FAILED: '
+                       'Subnet with the name "' + name + '" exists')
+            else:
+                missing.append(netConfig)
+        if not missing:
+            return results
+
+        # Creation of new networks without subnets, network or subnet name -> the reason of its failure
+        networks = {}
+        errors = {}
         try:
-            subnet = conn.network.create_subnet(**subnet_args)
+            for network in bulkCreate("networks", [{"name": netConfig["name"]} for netConfig in missing]):
+                networks[network["name"]] = network
         except Exception:
-            print('Creation of the network "' + netConfig['name'] + '" ...   FAILED: '
-                  'Please, check parameters for a subnet creation')
-            return None
-
-        # For some reason the subnet might not be created and no exceptions occurred
-        if subnet is None:
-            print('Creation of the network "' + netConfig['name'] + '" ...   FAILED: Error during subnet creation.')
-            return None
-        print('Creation of the network "' + netConfig['name'] + '" ...   OK')
-        return network
+            # Neutron plugins without native bulk support might have created a part of the networks
+            names = set(netConfig["name"] for netConfig in missing)
+            for network in callWithRetry(lambda: list(conn.network.networks())):
+                if network["name"] in names:
+                    networks.setdefault(network["name"], network)
+            for netConfig in missing:
+                if netConfig["name"] in networks:
+                    continue
+                try:
+                    networks[netConfig["name"]] = callCreateWithRetry(
+                        lambda n=netConfig["name"]: callWithRetry(conn.network.find_network, n),
+                        conn.network.create_network, name=netConfig["name"])
+                except Exception as e:
+                    errors[netConfig["name"]] = str(e)
+        for netConfig in missing:
+            network = networks.get(netConfig["name"])
+            if network is None:
+                report('Creation of the network "' + netConfig['name'] + '" ...   FAILED: ' +
+                       errors.get(netConfig["name"], 'Error during the network creation.'))
+                continue
+            resolver.insert("network", network)
+            journal.record("network", network["name"], network["id"], JOURNAL_CREATING)
 
+        # Creation of the subnets of the new networks
+        missing = [netConfig for netConfig in missing if networks.get(netConfig["name"]) is not None]
+        subnets = {}
+        try:
+            for subnet in bulkCreate("subnets", [_getSubnetArguments(config, netConfig,
+                                                                     networks[netConfig["name"]]["id"])
+                                                 for netConfig in missing]):
+                subnets[subnet["name"]] = subnet
+        except Exception:
+            names = set(netConfig["name"] for netConfig in missing)
+            for subnet in callWithRetry(lambda: list(conn.network.subnets())):
+                if subnet["name"] in names:
+                    subnets.setdefault(subnet["name"], subnet)
+            for netConfig in missing:
+                if netConfig["name"] in subnets:
+                    continue
+                try:
+                    subnets[netConfig["name"]] = callCreateWithRetry(
+                        lambda n=netConfig["name"]: callWithRetry(conn.network.find_subnet, n),
+                        conn.network.create_subnet,
+                        **_getSubnetArguments(config, netConfig, networks[netConfig["name"]]["id"]))
+                except Exception as e:
+                    if isNotFound(e):
+                        errors[netConfig["name"]] = 'The network has been deleted during the creation.'
+                    else:
+                        errors[netConfig["name"]] = str(e)
 
-# createAllNetworks(config) creates all networks and subnets with the parameters from the "config" structure.
-def createAllNetworks(config):
-    for netConfig in config["networks"]:
-        createNetworkByName(config, netConfig["name"])
+        for netConfig in missing:
+            name = netConfig["name"]
+            if subnets.get(name) is None:
+                journal.record("network", name, networks[name]["id"], JOURNAL_FAILED)
+                report('Creation of the network "' + name + '" ...   FAILED: ' +
+                       errors.get(name, 'Please, check parameters for a subnet creation'))
+            else:
+                journal.record("network", name, networks[name]["id"], JOURNAL_CREATED)
+                report('Creation of the network "' + name + '" ...   OK')
+                results[name] = networks[name]
+        return results
+    finally:
+        for lock in reversed(locks):
+            lock.release()
 
 
 # deleteNetworkByName(name) deletes the network with a special name if it exists
+@inPhase("network delete")
 def deleteNetworkByName(name):
+    if journal.isRecreated("network", name):
+        report('Deleting of the network "' + name + '" with its subnet(s) ...   '
+               'SKIPPED: The network has been recreated by the interrupted run.')
+        return
+    entry = journal.getResumed("network", name)
+    if entry is not None and entry["state"] == JOURNAL_DELETED:
+        report('Deleting of the network "' + name + '" with its subnet(s) ...   '
+               'SKIPPED: The network has been deleted by the interrupted run.')
+        return
+
     # If the network exists, try to delete it
-    netw = conn.network.find_network(name)
+    netw = getNetworkByName(name)
     if netw is not None:
         try:
-            conn.network.delete_network(netw)
+            callWithRetry(conn.network.delete_network, netw)
+            resolver.invalidate("network", name)
+            journal.record("network", name, netw["id"], JOURNAL_DELETED)
         except Exception:
-            print('Deleting of the network "' + name + '" with its subnet(s) ...   '
-                  'FAILED: Some hosts might be still connected to the network.')
-        print('Deleting of the network "' + name + '" with its subnet(s) ...   OK')
+            report('Deleting of the network "' + name + '" with its subnet(s) ...   '
+                   'FAILED: Some hosts might be still connected to the network.')
+            return
+        report('Deleting of the network "' + name + '" with its subnet(s) ...   OK')
     # The network doesn't exist yet, nothing to delete
     else:
-        print('Deleting of the network "' + name + '" with its subnet(s) ...   SKIPPED: The network does not exist.')
-
-
-# deleteServers(config) deletes servers with the parameters from the "config" structure.
-def deleteAllNetworks(config):
-    if "networks" in config.keys():
-        for netwConfig in config["networks"]:
-            deleteNetworkByName(netwConfig["name"])
+        report('Deleting of the network "' + name + '" with its subnet(s) ...   SKIPPED: The network does not exist.')
@@ -0,0 +1,141 @@
+#    _____  _
+#   |  __ \| |
+#   | |__) | | __ _ _ __
+#   |  ___/| |/ _` | '_ \
+#   | |    | | (_| | | | |
+#   |_|    |_|\__,_|_| |_|
+#
+from globals import conn, report
+from os_images import getImageByName
+from os_flavor import getFlavorByName
+from os_snapshots import getSnapshotByName
+from os_resolver import resolver
+from os_servers import isManagedServer
+from os_environment import isServerSnapshot
+from os_inventory import takeInventorySnapshot, getSnapshotServer, getSnapshotPorts, getSnapshotNetworkByID, \
+    getSnapshotNetworkByName
+from os_scheduler import createInfrastructure
+from os_teardown import deleteInfrastructure
+from os_profile import inPhase
+
+
+# getServerDrift(servConfig, server, snapshot) returns the list of differences between the running
+# server and its configuration: image, flavor, connected networks and fixed IPv4 addresses.
+# A server restored from its snapshot by "--restore" runs the snapshot image, it is not a drift.
+def getServerDrift(servConfig, server, snapshot):
+    drift = []
+
+    # Image or instance snapshot the server is booted from
+    if "instance_snapshot" in servConfig:
+        imageName = servConfig["instance_snapshot"]
+        image = getSnapshotByName(imageName)
+    else:
+        imageName = servConfig["image"]
+        image = getImageByName(imageName)
+    serverImage = server["image"] or {}
+    if image is not None and serverImage.get("id") != image["id"] and \
+            not (serverImage.get("id") and isServerSnapshot(resolver.get("image", serverImage["id"]),
+                                                            servConfig["name"])):
+        drift.append('image -> "' + imageName + '"')
+
+    # Newer compute API versions return only the flavor name instead of its ID
+    flavor = getFlavorByName(conn, servConfig["flavor"])
+    serverFlavor = server["flavor"] or {}
+    if flavor is not None and serverFlavor.get("id") != flavor["id"] and \
+            (serverFlavor.get("original_name") or serverFlavor.get("name")) != flavor["name"]:
+        drift.append('flavor -> "' + servConfig["flavor"] + '"')
+
+    # Addresses of the server grouped by network name
+    addresses = {}
+    for port in getSnapshotPorts(snapshot, server["id"]):
+        network = getSnapshotNetworkByID(snapshot, port["network_id"])
+        if network is not None:
+            addresses.setdefault(network["name"], set()).update(fi["ip_address"] for fi in port["fixed_ips"])
+
+    configured = set(netw["name"] for netw in servConfig["networks"])
+    if configured != set(addresses):
+        drift.append('networks -> ' + ', '.join('"' + n + '"' for n in sorted(configured)))
+
+    for netw in servConfig["networks"]:
+        if "ipv4" in netw.keys() and netw["name"] in addresses and netw["ipv4"] not in addresses[netw["name"]]:
+            drift.append('address in "' + netw["name"] + '" -> ' + netw["ipv4"])
+    return drift
+
+
+# computePlan(config, snapshot) compares the desired infrastructure from the configuration file with the actual
+# one, read with bulk list calls, and returns the list of changes. Every change is a dictionary:
+#   "action" - "create", "replace" or "delete"
+#   "kind"   - "network" or "server"
+#   "name"   - name of the resource
+#   "reason" - a list of human readable explanations of the change
+# Servers, which the tool has created, which are not in the configuration file, but connected to its networks, are
+# orphans to be deleted. The servers created by other means are never deleted.
+@inPhase("plan")
+def computePlan(config, snapshot=None):
+    if snapshot is None:
+        snapshot = takeInventorySnapshot()
+
+    plan = []
+    for netwConfig in config.get("networks", []):
+        if getSnapshotNetworkByName(snapshot, netwConfig["name"]) is None:
+            plan.append({"action": "create", "kind": "network", "name": netwConfig["name"], "reason": []})
+
+    configuredServers = set()
+    for servConfig in config.get("servers", []):
+        configuredServers.add(servConfig["name"])
+        server = getSnapshotServer(snapshot, servConfig["name"])
+        if server is None:
+            plan.append({"action": "create", "kind": "server", "name": servConfig["name"], "reason": []})
+            continue
+
+        drift = getServerDrift(servConfig, server, snapshot)
+        if drift:
+            plan.append({"action": "replace", "kind": "server", "name": servConfig["name"], "reason": drift})
+
+    # IDs of the configured networks, that exist
+    managedNetworks = set()
+    for netwConfig in config.get("networks", []):
+        network = getSnapshotNetworkByName(snapshot, netwConfig["name"])
+        if network is not None:
+            managedNetworks.add(network["id"])
+
+    for name, server in sorted(snapshot["servers"].items()):
+        if name in configuredServers or not isManagedServer(server):
+            continue
+        if any(port["network_id"] in managedNetworks for port in getSnapshotPorts(snapshot, server["id"])):
+            plan.append({"action": "delete", "kind": "server", "name": name,
+                         "reason": ["not in the configuration file"]})
+    return plan
+
+
+# printPlan(plan) prints the list of changes in a human readable form
+def printPlan(plan):
+    if not plan:
+        report('No changes. The infrastructure matches the configuration file.')
+        return
+
+    counts = {action: len([c for c in plan if c["action"] == action]) for action in ("create", "replace", "delete")}
+    report('Plan: ' + str(counts["create"]) + ' to create, ' + str(counts["replace"]) + ' to replace, ' +
+           str(counts["delete"]) + ' to delete.')
+
+    signs = {"create": "+", "replace": "~", "delete": "-"}
+    for change in plan:
+        line = '  ' + signs[change["action"]] + ' ' + change["kind"] + ' "' + change["name"] + '"'
+        if change["reason"]:
+            line += ': ' + '; '.join(change["reason"])
+        report(line)
+
+
+# applyPlan(config, plan, arguments) makes only the changes of the plan: orphans and drifted servers are deleted,
+# then missing networks and missing or drifted servers are created. The function returns the results of the creation,
+# see createInfrastructure()
+def applyPlan(config, plan, arguments):
+    serversToDelete = [c["name"] for c in plan if c["kind"] == "server" and c["action"] in ("replace", "delete")]
+    serversToCreate = [c["name"] for c in plan if c["kind"] == "server" and c["action"] in ("create", "replace")]
+    networksToCreate = [c["name"] for c in plan if c["kind"] == "network" and c["action"] == "create"]
+
+    if serversToDelete:
+        deleteInfrastructure(config, serversToDelete, [])
+    if serversToCreate or networksToCreate:
+        return createInfrastructure(config, serversToCreate, networksToCreate, arguments)
+    return {}
@@ -0,0 +1,183 @@
+#    _____      _ _
+#   |  __ \    | | |
+#   | |__) |__ | | | ___ _ __
+#   |  ___/ _ \| | |/ _ \ '__|
+#   | |  | (_) | | |  __/ |
+#   |_|   \___/|_|_|\___|_|
+#
+import time
+import threading
+
+from globals import conn
+from os_retry import callWithRetry
+from os_inventory import getServerTimestamp
+from os_profile import profiler
+from os_regions import RegionLocal, withCurrentRegion
+
+# Status of the servers to wait for: booted or deleted
+ACTIVE = "ACTIVE"
+DELETED = "DELETED"
+
+# Maximum time to wait for a server transition, seconds
+SERVER_WAIT_TIMEOUT = 300
+# Interval between two polls while the servers are changing and the maximum interval, seconds
+POLL_INTERVAL_MIN = 1.0
+POLL_INTERVAL_MAX = 10.0
+# Growth of the interval after a poll, which has not finished any transition
+POLL_BACKOFF = 1.5
+# Every this number of polls lists all the servers instead of the changed ones, so the vanished servers are noticed
+FULL_REFRESH_POLLS = 10
+
+
+# Failure of an awaited server transition: the server went to ERROR state, vanished or the time is out
+class ServerStatusError(Exception):
+    pass
+
+
+# A pending transition of one server, see ServerPoller.watch()
+class ServerWatch(object):
+    def __init__(self, server, target, deadline):
+        self.serverID = server["id"]
+        self.name = server["name"]
+        self.target = target
+        self.deadline = deadline
+        # A server deleted in ERROR state stays in it until the deletion is done
+        self.initialStatus = getattr(server, "status", None)
+        self.server = None
+        self.error = None
+        self._event = threading.Event()
+
+    # done() returns True if the transition has finished, successfully or not
+    def done(self):
+        return self._event.is_set()
+
+    # wait() waits for the transition and returns the server in its final state, ServerStatusError is raised
+    # if the transition has failed
+    def wait(self):
+        self._event.wait()
+        if self.error is not None:
+            raise ServerStatusError(self.error)
+        return self.server
+
+    def _finish(self, server, error=None):
+        self.server = server
+        self.error = error
+        self._event.set()
+
+
+# Single poller of the servers being booted or deleted. Instead of a GET loop per server, all the pending
+# transitions are refreshed with one list call of the servers changed since the previous poll. The poll interval
+# is reset to POLL_INTERVAL_MIN after a poll, which has finished some transitions, and grows otherwise, so the tail
+# of a long boot is polled less often. A server in ERROR state fails its transition immediately.
+# The polling thread runs only while there are pending transitions.
+class ServerPoller(object):
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._watches = {}
+        self._thread = None
+        self._interval = POLL_INTERVAL_MIN
+        self._marker = None
+        self._polls = 0
+
+    # watch(server, target, timeout) starts tracking of the server transition to the "target" status
+    # (ACTIVE or DELETED) and returns the ServerWatch object of it
+    def watch(self, server, target, timeout=SERVER_WAIT_TIMEOUT):
+        with self._condition:
+            watch = ServerWatch(server, target, time.monotonic() + timeout)
+            self._watches.setdefault(watch.serverID, []).append(watch)
+            if self._thread is None:
+                # The first poll lists all the servers, some of them might have finished their transitions already
+                self._interval = POLL_INTERVAL_MIN
+                self._marker = None
+                self._polls = 0
+                self._thread = threading.Thread(target=withCurrentRegion(self._run), name="server-poller", daemon=True)
+                self._thread.start()
+            return watch
+
+    # wait(server, target, timeout) waits for the server transition and returns the server in its final state
+    def wait(self, server, target, timeout=SERVER_WAIT_TIMEOUT):
+        return self.watch(server, target, timeout).wait()
+
+    # _run() polls the servers until there are no pending transitions
+    def _run(self):
+        with profiler.phase("status polling"):
+            while True:
+                with self._condition:
+                    self._condition.wait(self._interval)
+                    if not self._watches:
+                        self._thread = None
+                        return
+                self._poll()
+
+    # _poll() refreshes all the pending transitions with one list call
+    def _poll(self):
+        # The changes-since filter returns the servers deleted since then with the DELETED status,
+        # but the list of all servers is the only way to notice a server vanished without a trace
+        full = self._marker is None or self._polls % FULL_REFRESH_POLLS == 0
+        self._polls += 1
+        query = {} if full else {"changes_since": self._marker}
+        failure = None
+        try:
+            servers = callWithRetry(lambda: list(conn.compute.servers(**query)))
+        except Exception as e:
+            # The pending transitions are failed only when their time is out
+            servers = []
+            full = False
+            failure = str(e)
+        listed = {server["id"]: server for server in servers}
+
+        with self._condition:
+            finished = 0
+            for serverID, watches in list(self._watches.items()):
+                for watch in list(watches):
+                    server, done, error = _checkTransition(watch, listed.get(serverID), full)
+                    if not done and time.monotonic() > watch.deadline:
+                        done, error = True, failure or 'Timeout while waiting for the server "' + watch.name + '".'
+                    if done:
+                        watch._finish(server, error)
+                        watches.remove(watch)
+                        finished += 1
+                if not watches:
+                    del self._watches[serverID]
+
+            for server in servers:
+                updated = getServerTimestamp(server)
+                if updated is not None and (self._marker is None or updated > self._marker):
+                    self._marker = updated
+            if finished:
+                self._interval = POLL_INTERVAL_MIN
+            else:
+                self._interval = min(POLL_INTERVAL_MAX, self._interval * POLL_BACKOFF)
+
+
+# _checkTransition(watch, server, full) checks the transition of the watch against the server found in the list
+# call (None if it is absent in the list) and returns the server, True if the transition has finished,
+# and the error message or None
+def _checkTransition(watch, server, full):
+    if server is None:
+        # Only the list of all servers proves, that the server does not exist
+        if not full:
+            return None, False, None
+        if watch.target == DELETED:
+            return None, True, None
+        return None, True, 'Server "' + watch.name + '" has disappeared.'
+
+    status = server["status"]
+    if watch.target == DELETED:
+        if status == DELETED:
+            return server, True, None
+        if status == "ERROR" and watch.initialStatus != "ERROR":
+            return server, True, 'Server "' + watch.name + '" went to ERROR state during the deletion.'
+        return server, False, None
+
+    if status == ACTIVE:
+        return server, True, None
+    if status == "ERROR":
+        return server, True, 'Server "' + watch.name + '" went to ERROR state.'
+    if status == DELETED:
+        return server, True, 'Server "' + watch.name + '" has been deleted.'
+    return server, False, None
+
+
+# Every region has its own poller
+poller = RegionLocal(lambda region: ServerPoller())
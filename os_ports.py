@@ -0,0 +1,187 @@
+#    _____           _
+#   |  __ \         | |
+#   | |__) |__  _ __| |_ ___
+#   |  ___/ _ \| '__| __/ __|
+#   | |  | (_) | |  | |_\__ \
+#   |_|   \___/|_|   \__|___/
+#
+from globals import conn, report
+from os_resolver import resolver
+from os_retry import callWithRetry, callCreateWithRetry
+from os_networks import bulkCreate
+from os_profile import inPhase
+
+
+# getPortName(serverName, networkName) returns the name of the port pre-created for the server in the network
+def getPortName(serverName, networkName):
+    return serverName + "_" + networkName
+
+
+# getPortNames(config) returns the names of the ports of all the servers of the configuration
+def getPortNames(config):
+    return set(getPortName(servConfig["name"], netw["name"])
+               for servConfig in config.get("servers", []) for netw in servConfig["networks"])
+
+
+# usesPreparedPorts(servConfig) returns True if the server boots with pre-created ports. The servers of a template
+# without fixed IP addresses are booted by one multi-create request, which can not take a port per instance
+def usesPreparedPorts(servConfig):
+    if "template" not in servConfig:
+        return True
+    return any("ipv4" in netw for netw in servConfig["networks"])
+
+
+# _getFixedIP(port) returns the first fixed IP address of the port or None
+def _getFixedIP(port):
+    for fixedIP in port["fixed_ips"] or []:
+        return fixedIP["ip_address"]
+    return None
+
+
+# _getPortArguments(portName, networkID, netw) returns the parameters of the port for the server network entry
+def _getPortArguments(portName, networkID, netw):
+    port_args = {"name": portName, "network_id": networkID}
+    if "ipv4" in netw:
+        port_args["fixed_ips"] = [{"ip_address": netw["ipv4"]}]
+    return port_args
+
+
+# preparePorts(config, serverNames) creates the ports of the servers "names", which do not exist yet, before they
+# are booted. Existing ports and servers are checked with one list call each, the ports left by the previous runs
+# are reused, and all the missing ports are created with one Neutron bulk request. If the bulk request fails
+# (e.g. a fixed IP address is already allocated), the ports are created one by one, so the failed ones are found.
+# The function returns a dictionary of server name -> (list of port IDs in the order of the server networks, None)
+# or (None, reason of the failure). Existing servers and the servers booted without pre-created ports are absent
+@inPhase("ports")
+def preparePorts(config, serverNames):
+    servConfigs = [config.getServer(name) for name in dict.fromkeys(serverNames)
+                   if config.getServer(name) is not None and usesPreparedPorts(config.getServer(name))]
+    if not servConfigs:
+        return {}
+
+    existingServers = set(server["name"] for server in callWithRetry(
+        lambda: list(conn.compute.servers(details=False))))
+    ports = {}
+    for port in callWithRetry(lambda: list(conn.network.ports())):
+        if port["name"]:
+            ports.setdefault(port["name"], port)
+
+    # Server name -> names of its ports, and the error of the server, which can not get its ports (None if
+    # it boots without them)
+    serverPorts = {}
+    errors = {}
+    # Port name -> arguments of the port creation
+    requests = {}
+    for servConfig in servConfigs:
+        name = servConfig["name"]
+        if name in existingServers:
+            continue
+        serverPorts[name] = []
+        for netw in servConfig["networks"]:
+            network = resolver.get("network", netw["name"])
+            if network is None:
+                # The server creates its missing network itself and boots without pre-created ports
+                errors[name] = None
+                break
+            portName = getPortName(name, netw["name"])
+            serverPorts[name].append(portName)
+            port = ports.get(portName)
+            if port is not None:
+                if port["device_id"]:
+                    errors[name] = 'Port "' + portName + '" is used by another device.'
+                    break
+                if port["network_id"] == network["id"] and \
+                        ("ipv4" not in netw or _getFixedIP(port) == netw["ipv4"]):
+                    continue
+                # The port of the previous run does not match the configuration anymore
+                callWithRetry(conn.network.delete_port, port)
+                del ports[portName]
+            requests[portName] = _getPortArguments(portName, network["id"], netw)
+
+    # The ports of the servers, which have failed already, are not created
+    for name in errors:
+        for portName in serverPorts[name]:
+            requests.pop(portName, None)
+
+    failures = {}
+    if requests:
+        try:
+            for port in bulkCreate("ports", list(requests.values())):
+                ports[port["name"]] = port
+        except Exception:
+            # Neutron plugins without native bulk support might have created a part of the ports
+            for port in callWithRetry(lambda: list(conn.network.ports())):
+                if port["name"] in requests and not port["device_id"]:
+                    ports.setdefault(port["name"], port)
+            for portName, port_args in requests.items():
+                if portName in ports:
+                    continue
+                try:
+                    ports[portName] = callCreateWithRetry(lambda n=portName: _findUnboundPort(n),
+                                                          conn.network.create_port, **port_args)
+                except Exception as e:
+                    failures[portName] = str(e)
+
+    results = {}
+    for name, portNames in serverPorts.items():
+        if name in errors:
+            if errors[name] is not None:
+                results[name] = (None, errors[name])
+            continue
+        failed = [portName for portName in portNames if portName in failures]
+        if failed:
+            results[name] = (None, 'Port "' + failed[0] + '" can not be created: ' + failures[failed[0]])
+        else:
+            results[name] = ([ports[portName]["id"] for portName in portNames], None)
+    return results
+
+
+# _findUnboundPort(portName) returns the unbound port with the name or None
+def _findUnboundPort(portName):
+    for port in callWithRetry(lambda: list(conn.network.ports(name=portName))):
+        if port["name"] == portName and not port["device_id"]:
+            return port
+    return None
+
+
+# deleteUnboundPorts(ports) deletes the pre-created ports, which are not bound to a server anymore, so their
+# network can be deleted
+def deleteUnboundPorts(ports):
+    for port in ports:
+        if not port["device_id"]:
+            try:
+                callWithRetry(conn.network.delete_port, port)
+            except Exception as e:
+                report('Deleting of the port "' + port["name"] + '" ...   FAILED: ' + str(e))
+
+
+# getServerPorts(config, servers, serverNames) returns a dictionary of server name -> pre-created ports of the servers
+# "serverNames" with one list call: the ports bound to the server (name -> server in "servers") and the unbound ports
+# left by its failed boots. The ports created by Nova have no name and are deleted with their server
+def getServerPorts(config, servers, serverNames):
+    serverNames = set(serverNames)
+    owners = {server["id"]: name for name, server in servers.items() if name in serverNames}
+    unboundOwners = {}
+    for servConfig in config.get("servers", []):
+        if servConfig["name"] in serverNames:
+            for netw in servConfig["networks"]:
+                unboundOwners[getPortName(servConfig["name"], netw["name"])] = servConfig["name"]
+
+    ports = {}
+    for port in callWithRetry(lambda: list(conn.network.ports())):
+        if not port["name"]:
+            continue
+        if port["device_id"] in owners and port["name"].startswith(owners[port["device_id"]] + "_"):
+            ports.setdefault(owners[port["device_id"]], []).append(port)
+        elif not port["device_id"] and port["name"] in unboundOwners:
+            ports.setdefault(unboundOwners[port["name"]], []).append(port)
+    return ports
+
+
+# deleteServerPorts(name, ports) deletes the pre-created ports of the server "name", which has been deleted
+def deleteServerPorts(name, ports):
+    for port in ports:
+        try:
+            callWithRetry(conn.network.delete_port, port)
+        except Exception as e:
+            report('Deleting of the port "' + port["name"] + '" of the server "' + name + '" ...   FAILED: ' + str(e))
@@ -0,0 +1,198 @@
+#    _____            __ _ _
+#   |  __ \          / _(_) |
+#   | |__) | __ ___ | |_ _| | ___
+#   |  ___/ '__/ _ \|  _| | |/ _ \
+#   | |   | | | (_) | | | | |  __/
+#   |_|   |_|  \___/|_| |_|_|\___|
+#
+import json
+import functools
+import time
+import threading
+import contextlib
+
+# Phase of the calls made outside of any named phase
+DEFAULT_PHASE = "other"
+
+
+# Recorder of the OpenStack SDK calls made through "conn": service, operation, duration, resource name
+# and the phase of the run (network create, keypair, server boot, config generation, ...), which made the call.
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls = []
+        self._started = time.time()
+
+    # enable() starts the recording of the calls
+    def enable(self):
+        with self._lock:
+            self.enabled = True
+            self._calls = []
+            self._started = time.time()
+
+    # disable() stops the recording of the calls
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+
+    # currentPhase() returns the innermost phase of the current thread
+    def currentPhase(self):
+        phases = getattr(self._local, "phases", None)
+        return phases[-1] if phases else DEFAULT_PHASE
+
+    # phase(name) is a context manager attributing the calls of the current thread to the phase "name"
+    @contextlib.contextmanager
+    def phase(self, name):
+        phases = getattr(self._local, "phases", None)
+        if phases is None:
+            phases = self._local.phases = []
+        phases.append(name)
+        try:
+            yield
+        finally:
+            phases.pop()
+
+    # record(service, operation, duration, resource) saves one finished call
+    def record(self, service, operation, duration, resource=None):
+        if not self.enabled:
+            return
+        call = {"service": service, "operation": operation, "duration": duration,
+                "resource": resource, "phase": self.currentPhase(), "start": time.time() - duration - self._started}
+        with self._lock:
+            self._calls.append(call)
+
+    # calls() returns a copy of the recorded calls
+    def calls(self):
+        with self._lock:
+            return list(self._calls)
+
+    # printSummary(extra) prints the time spent per phase and per operation
+    def printSummary(self, extra=None):
+        calls = self.calls()
+        print('')
+        print('Profile: ' + str(len(calls)) + ' API calls, wall time ' + '%.2f' % (time.time() - self._started) + ' s')
+
+        print('')
+        print('%-24s %8s %10s' % ("Phase", "Calls", "Time, s"))
+        for phase, group in sorted(_group(calls, "phase").items(), key=lambda g: -_total(g[1])):
+            print('%-24s %8d %10.2f' % (phase, len(group), _total(group)))
+
+        print('')
+        print('%-34s %8s %10s %10s %10s' % ("Operation", "Calls", "Time, s", "Avg, ms", "Max, ms"))
+        for operation, group in sorted(_group(calls, "operation").items(), key=lambda g: -_total(g[1])):
+            print('%-34s %8d %10.2f %10.1f %10.1f' % (operation, len(group), _total(group),
+                                                      _total(group) / len(group) * 1000,
+                                                      max(c["duration"] for c in group) * 1000))
+        if extra:
+            for title, lines in extra:
+                if not lines:
+                    continue
+                print('')
+                print(title)
+                for line in lines:
+                    print('    ' + line)
+
+    # writeTrace(fileName, extra) saves the recorded calls in a JSON file to compare different runs
+    def writeTrace(self, fileName, extra=None):
+        trace = {"started": self._started, "wall": time.time() - self._started, "calls": self.calls()}
+        if extra:
+            trace.update(extra)
+        with open(fileName, "w") as f:
+            json.dump(trace, f, indent=1)
+
+
+# _group(calls, key) groups the calls by the value of the key, the operation key includes the service name
+def _group(calls, key):
+    groups = {}
+    for call in calls:
+        value = call["service"] + "." + call["operation"] if key == "operation" else call[key]
+        groups.setdefault(value, []).append(call)
+    return groups
+
+
+# _total(calls) returns the total duration of the calls
+def _total(calls):
+    return sum(call["duration"] for call in calls)
+
+
+profiler = Profiler()
+
+
+# inPhase(name) is a decorator attributing the calls made by the function to the phase "name"
+def inPhase(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# _resourceName(args, kwargs) returns the name of the resource an SDK call is made for
+def _resourceName(args, kwargs):
+    if "name" in kwargs:
+        return str(kwargs["name"])
+    for arg in args:
+        if isinstance(arg, str):
+            return arg
+        try:
+            return str(arg["name"])
+        except (KeyError, TypeError, AttributeError, IndexError):
+            continue
+    return None
+
+
+# _timedGenerator(service, operation, resource, generator, elapsed) records the time spent in a list call,
+# which is made page by page while the caller iterates over the result. "elapsed" is the time spent in the call,
+# which has returned the generator
+def _timedGenerator(service, operation, resource, generator, elapsed):
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        profiler.record(service, operation, elapsed, resource)
+
+
+# Wrapper of an SDK service proxy (conn.compute, conn.network, ...) recording every call
+class InstrumentedService(object):
+    def __init__(self, serviceName, service):
+        self._serviceName = serviceName
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        def call(*args, **kwargs):
+            resource = _resourceName(args, kwargs)
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                profiler.record(self._serviceName, name, time.perf_counter() - start, resource)
+                raise
+            elapsed = time.perf_counter() - start
+            # List calls return generators, the API requests are made during the iteration
+            if hasattr(result, "__next__") and hasattr(result, "send"):
+                return _timedGenerator(self._serviceName, name, resource, result, elapsed)
+            profiler.record(self._serviceName, name, elapsed, resource)
+            return result
+        return call
+
+
+# instrument(serviceName, service) returns the service proxy, which records its calls if profiling is enabled
+def instrument(serviceName, service):
+    if profiler.enabled:
+        return InstrumentedService(serviceName, service)
+    return service
@@ -0,0 +1,162 @@
+#    _____                _ _
+#   |  __ \              | (_)
+#   | |__) |___  __ _  __| |_ _ __   ___  ___ ___
+#   |  _  // _ \/ _` |/ _` | | '_ \ / _ \/ __/ __|
+#   | | \ \  __/ (_| | (_| | | | | |  __/\__ \__ \
+#   |_|  \_\___|\__,_|\__,_|_|_| |_|\___||___/___/
+#
+import os
+import time
+import asyncio
+
+from globals import report
+from os_inventory import takeInventorySnapshot
+from os_configs import generateSSHConfig, getConfigSSHDirectory
+from os_profile import inPhase
+
+# Interval between two probes of a server, which is not reachable yet, seconds
+READY_PROBE_INTERVAL = 2.0
+# Maximum time of one TCP connect and of reading the ssh banner, seconds
+READY_CONNECT_TIMEOUT = 5.0
+READY_SSH_PORT = 22
+# Maximum number of the ssh sessions checking cloud-init at once
+READY_SSH_CONCURRENCY = 32
+# Options of the ssh sessions: the host keys of the new servers are not known yet, a password is never asked
+READY_SSH_OPTIONS = ("-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+                     "-o", "LogLevel=ERROR", "-o", "ConnectTimeout=10")
+# Exit code of ssh, if the connection or the authentication has failed
+SSH_CONNECTION_FAILED = 255
+# Exit codes of "cloud-init status --wait": done and done with recoverable errors
+CLOUD_INIT_DONE = (0, 2)
+
+
+# waitForReadiness(config, serverNames, arguments) waits until the servers "serverNames" can be used. Every server
+# is probed on all the addresses, which the ssh config of the server would have, until one of them accepts a TCP
+# connection on port 22 and answers with the ssh banner. With "--wait-ready cloud-init" the server is ready, when
+# "cloud-init status --wait" run over ssh with the keypair of the server has finished as well. All the servers are
+# probed concurrently by one event loop, the time to ready of every server is reported as soon as it is ready and
+# the function returns as soon as the whole fleet is ready or "--ready-timeout" has passed.
+# The function returns the names of the ready servers
+@inPhase("readiness")
+def waitForReadiness(config, serverNames, arguments):
+    serverNames = list(dict.fromkeys(serverNames))
+    if not serverNames:
+        return []
+
+    # The addresses of all the servers are taken from one snapshot of the project resources
+    hosts = {}
+    for host in generateSSHConfig(config, takeInventorySnapshot(), quiet=True):
+        hosts.setdefault(host["server"], []).append(host)
+
+    ssh_dir = getConfigSSHDirectory(arguments)
+    start = time.monotonic()
+    results = asyncio.run(_probeServers(serverNames, hosts, arguments.wait_ready, ssh_dir, arguments.ready_timeout))
+
+    ready = [name for name, error in zip(serverNames, results) if error is None]
+    title = 'Readiness of ' + str(len(serverNames)) + ' server(s)'
+    if len(ready) < len(serverNames):
+        report(title + ' ...   FAILED: ' + str(len(serverNames) - len(ready)) + ' server(s) are not ready.')
+    else:
+        report(title + ' ...   OK: ready in ' + _formatSeconds(time.monotonic() - start) + '.')
+    return ready
+
+
+# _probeServers(serverNames, hosts, mode, ssh_dir, timeout) probes all the servers at once and returns the list of
+# the errors of the servers, None for the ready ones
+async def _probeServers(serverNames, hosts, mode, ssh_dir, timeout):
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(READY_SSH_CONCURRENCY)
+
+    async def probe(name):
+        title = 'Readiness of server "' + name + '"'
+        try:
+            error = await asyncio.wait_for(_probeServer(hosts.get(name, []), mode, ssh_dir, semaphore), timeout)
+        except asyncio.TimeoutError:
+            error = 'Timeout after ' + str(timeout) + ' s.'
+        if error is not None:
+            report(title + ' ...   FAILED: ' + error)
+        else:
+            report(title + ' ...   OK: ready in ' + _formatSeconds(time.monotonic() - start) + '.')
+        return error
+
+    return await asyncio.gather(*[probe(name) for name in serverNames])
+
+
+# _probeServer(hosts, mode, ssh_dir, semaphore) waits until the server with the hosts "hosts" is ready and returns
+# None or the reason, why it never will be
+async def _probeServer(hosts, mode, ssh_dir, semaphore):
+    if not hosts:
+        return 'The server has no address.'
+    host = await _waitForSSHPort(hosts)
+    if mode != "cloud-init":
+        return None
+    if "username" not in host:
+        return 'The user of the image is unknown, see "parameters.users".'
+    return await _waitForCloudInit(host, ssh_dir, semaphore)
+
+
+# _waitForSSHPort(hosts) probes all the addresses of the server at once until one of them answers with
+# the ssh banner and returns its host. Every address is probed again on its own, an address dropping the packets
+# does not delay the probes of the others
+async def _waitForSSHPort(hosts):
+    probes = {asyncio.ensure_future(_waitForAddress(host["ip"])): host for host in hosts}
+    try:
+        done, _ = await asyncio.wait(probes, return_when=asyncio.FIRST_COMPLETED)
+        return probes[done.pop()]
+    finally:
+        for probe in probes:
+            probe.cancel()
+
+
+# _waitForAddress(ip) probes the address until its ssh server answers
+async def _waitForAddress(ip):
+    while not await _probeSSHPort(ip):
+        await asyncio.sleep(READY_PROBE_INTERVAL)
+
+
+# _probeSSHPort(ip) returns True if the ssh server of the address accepts a connection and sends its banner
+async def _probeSSHPort(ip):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, READY_SSH_PORT), READY_CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        # The port is open before sshd has started, if the port is forwarded, the banner proves the ssh server is up
+        banner = await asyncio.wait_for(reader.readline(), READY_CONNECT_TIMEOUT)
+        return banner.startswith(b"SSH-")
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+# _waitForCloudInit(host, ssh_dir, semaphore) waits until cloud-init of the host has finished and returns None or
+# its error. The sessions, which can not log in yet (the keypair is installed by cloud-init too), are repeated
+async def _waitForCloudInit(host, ssh_dir, semaphore):
+    command = ["ssh", "-i", ssh_dir + os.path.sep + host["keypair"]] + list(READY_SSH_OPTIONS) + \
+              [host["username"] + "@" + host["ip"], "cloud-init", "status", "--wait"]
+    while True:
+        async with semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL,
+                                                               stdout=asyncio.subprocess.PIPE,
+                                                               stderr=asyncio.subprocess.STDOUT)
+            except OSError as e:
+                return 'ssh can not be started: ' + str(e)
+            try:
+                output, _ = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+        if process.returncode in CLOUD_INIT_DONE:
+            return None
+        if process.returncode != SSH_CONNECTION_FAILED:
+            lines = output.decode("utf-8", "replace").strip().splitlines()
+            return 'cloud-init has failed: ' + (lines[-1] if lines else 'exit code ' + str(process.returncode))
+        await asyncio.sleep(READY_PROBE_INTERVAL)
+
+
+# _formatSeconds(seconds) returns the duration for the result lines
+def _formatSeconds(seconds):
+    return "%.1f" % seconds + " s"
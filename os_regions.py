@@ -0,0 +1,131 @@
+#    _____            _
+#   |  __ \          (_)
+#   | |__) |___  __ _ _  ___  _ __  ___
+#   |  _  // _ \/ _` | |/ _ \| '_ \/ __|
+#   | | \ \  __/ (_| | | (_) | | | \__ \
+#   |_|  \_\___|\__, |_|\___/|_| |_|___/
+#                __/ |
+#               |___/
+import re
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Region of the operations of the current thread, None for the default cloud of clouds.yaml
+_currentRegion = contextvars.ContextVar("region", default=None)
+
+
+# A cloud of clouds.yaml and optionally one of its regions. The same configuration file is applied to every
+# region given with "--cloud" or "parameters.clouds", each of them has its own connection, resolver, state,
+# poller and concurrency controller.
+class Region(object):
+    def __init__(self, cloud, name=None):
+        self.cloud = cloud
+        self.name = name
+        # The result lines are prefixed with the label, if several regions are managed at once
+        self.showLabel = False
+
+    # label is "cloud" or "cloud:region"
+    @property
+    def label(self):
+        if self.name is None:
+            return self.cloud
+        return self.cloud + ":" + self.name
+
+    # slug is the label usable in host and group names of the generated files
+    @property
+    def slug(self):
+        return re.sub(r"[^A-Za-z0-9_]", "_", self.label)
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and (self.cloud, self.name) == (other.cloud, other.name)
+
+    def __hash__(self):
+        return hash((self.cloud, self.name))
+
+    def __repr__(self):
+        return "Region(" + self.label + ")"
+
+
+# parseRegion(value) returns the Region of the "cloud" or "cloud:region" string or of the dictionary with
+# the "cloud" and optional "region" keys. An invalid value raises ValueError
+def parseRegion(value):
+    if isinstance(value, dict):
+        if not value.get("cloud"):
+            raise ValueError('Cloud "' + str(value) + '" has no "cloud" name.')
+        return Region(str(value["cloud"]), str(value["region"]) if value.get("region") else None)
+    cloud, _, name = str(value).partition(":")
+    if not cloud:
+        raise ValueError('Cloud "' + str(value) + '" has no name.')
+    return Region(cloud, name or None)
+
+
+# currentRegion() returns the Region of the current operations or None for the default cloud
+def currentRegion():
+    return _currentRegion.get()
+
+
+# getRegionLabel() returns the prefix of the result lines of the current region or an empty string
+def getRegionLabel():
+    region = _currentRegion.get()
+    if region is None or not region.showLabel:
+        return ""
+    return "[" + region.label + "] "
+
+
+# withCurrentRegion(func) returns the function, which runs "func" in the region of the caller. The threads started
+# by the workers pools and the poller do not inherit the region of the thread starting them otherwise
+def withCurrentRegion(func):
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can be entered by one thread at a time, every call gets its own copy
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+# runInRegions(regions, func) calls "func" in every region concurrently and returns the list of (region, result).
+# With one region "func" is called in the current thread. An exception of "func" is raised after all the regions
+# have finished
+def runInRegions(regions, func):
+    if len(regions) > 1:
+        for region in regions:
+            region.showLabel = True
+
+    def run(region):
+        _currentRegion.set(region)
+        return func()
+
+    if len(regions) == 1:
+        return [(regions[0], contextvars.copy_context().run(run, regions[0]))]
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, run, region) for region in regions]
+        return [(region, future.result()) for region, future in zip(regions, futures)]
+
+
+# Proxy of a per-region object: the resolver, the state, the poller, ... Every region gets its own instance
+# created with factory(region) on the first use, the attributes are taken from the instance of the current region.
+class RegionLocal(object):
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    # instance() returns the object of the current region
+    def instance(self):
+        region = _currentRegion.get()
+        instance = self._instances.get(region)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(region)
+                if instance is None:
+                    instance = self._instances[region] = self._factory(region)
+        return instance
+
+    # instances() returns the objects of all the regions used so far
+    def instances(self):
+        with self._lock:
+            return list(self._instances.values())
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
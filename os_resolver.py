@@ -0,0 +1,243 @@
+#    _____                 _
+#   |  __ \               | |
+#   | |__) |___  ___  ___ | |_   _____ _ __
+#   |  _  // _ \/ __|/ _ \| \ \ / / _ \ '__|
+#   | | \ \  __/\__ \ (_) | |\ V /  __/ |
+#   |_|  \_\___||___/\___/|_| \_/ \___|_|
+#
+import threading
+
+from globals import conn
+from os_state import state, isNotFound
+from os_profile import inPhase
+from os_regions import RegionLocal
+
+
+# Per-run cache of the resources, which are looked up by name many times during one run:
+# images (and instance snapshots, which are images too), flavors, keypairs and networks.
+# The first lookup of a resource type lists all the resources of the type with one API call, the next
+# lookups are answered from the cache. A name, that is absent in the list, is searched once with the
+# "find_*" call and the result is cached as well.
+# If the ID of a resource is known from the persistent state of the previous runs, the resource is fetched
+# by the ID without listing all the resources of the type. Stale IDs are removed from the state.
+# The API calls are made without holding the cache lock: the parallel workers looking up different resources
+# do not wait for each other, the workers looking up the same resource (or listing the same type) wait for
+# the one, which makes the call, and take its result.
+class ResourceResolver(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (type, name or ID) or (type, None) for the list call -> the lock of the lookup
+        self._lookupLocks = {}
+        self._cache = {}
+        self._fetched = {}
+        self._hits = {}
+        self._misses = {}
+
+    # reset() drops all the cached resources and the counters
+    def reset(self):
+        with self._lock:
+            self._cache = {}
+            self._fetched = {}
+            self._hits = {}
+            self._misses = {}
+
+    # _getLookupLock(kind, nameOrID) returns the lock serializing the lookups of the same resource, nameOrID is None
+    # for the list call of the type
+    def _getLookupLock(self, kind, nameOrID):
+        with self._lock:
+            return self._lookupLocks.setdefault((kind, nameOrID), threading.Lock())
+
+    # _count(counters, kind) increments the hit or the miss counter of the type
+    def _count(self, counters, kind):
+        with self._lock:
+            counters[kind] = counters.get(kind, 0) + 1
+
+    # _listResources(kind) returns all the resources of the type "kind"
+    @staticmethod
+    def _listResources(kind):
+        if kind == "image":
+            return conn.image.images()
+        if kind == "flavor":
+            return conn.compute.flavors()
+        if kind == "keypair":
+            return conn.compute.keypairs()
+        if kind == "network":
+            return conn.network.networks()
+        raise ValueError('Unknown resource type "' + kind + '"')
+
+    # _findResource(kind, nameOrID) looks up the resource of the type "kind" with the OpenStack "find_*" call
+    @staticmethod
+    def _findResource(kind, nameOrID):
+        if kind == "image":
+            return conn.compute.find_image(nameOrID)
+        if kind == "flavor":
+            return conn.compute.find_flavor(nameOrID)
+        if kind == "keypair":
+            return conn.compute.find_keypair(nameOrID)
+        if kind == "network":
+            return conn.network.find_network(nameOrID)
+        raise ValueError('Unknown resource type "' + kind + '"')
+
+    # _getResource(kind, resourceID) fetches the resource of the type "kind" by its ID
+    @staticmethod
+    def _getResource(kind, resourceID):
+        if kind == "image":
+            return conn.image.get_image(resourceID)
+        if kind == "flavor":
+            return conn.compute.get_flavor(resourceID)
+        if kind == "keypair":
+            return conn.compute.get_keypair(resourceID)
+        if kind == "network":
+            return conn.network.get_network(resourceID)
+        raise ValueError('Unknown resource type "' + kind + '"')
+
+    # _fetchFromState(kind, name) returns the resource with the ID stored in the persistent state or None,
+    # if there is no such ID or it is stale
+    def _fetchFromState(self, kind, name):
+        resourceID = state.getID(kind, name)
+        if resourceID is None:
+            return None
+        try:
+            resource = self._getResource(kind, resourceID)
+        except Exception as e:
+            if not isNotFound(e):
+                raise
+            resource = None
+        # The resource has been deleted or renamed
+        if resource is None or resource["name"] != name:
+            state.forget(kind, name)
+            return None
+        return resource
+
+    # _prefetch(kind) fills the cache of the resource type "kind" with one list call, if it is not filled yet
+    def _prefetch(self, kind):
+        with self._getLookupLock(kind, None):
+            with self._lock:
+                if kind in self._cache:
+                    return
+            resources = {}
+            for resource in self._listResources(kind):
+                # The first resource with a name wins, like in the "find_*" calls
+                resources.setdefault(resource["name"], resource)
+                resources[resource["id"]] = resource
+            with self._lock:
+                # The resources created, deleted or fetched during the list call are newer than the list
+                for (fetchedKind, name), resource in self._fetched.items():
+                    if fetchedKind != kind:
+                        continue
+                    resources[name] = resource
+                    if resource is not None:
+                        resources[resource["id"]] = resource
+                self._cache[kind] = resources
+
+    # _getCached(kind, nameOrID) returns True and the resource, if the lookup can be answered from the cache,
+    # otherwise False and None
+    def _getCached(self, kind, nameOrID):
+        with self._lock:
+            if kind not in self._cache:
+                if (kind, nameOrID) in self._fetched:
+                    return True, self._fetched[(kind, nameOrID)]
+            elif nameOrID in self._cache[kind]:
+                return True, self._cache[kind][nameOrID]
+        return False, None
+
+    # get(kind, nameOrID) returns the resource of the type "kind" with the name or ID nameOrID.
+    # If the resource does not exist, the function returns None
+    def get(self, kind, nameOrID):
+        cached, resource = self._getCached(kind, nameOrID)
+        if cached:
+            self._count(self._hits, kind)
+            return resource
+
+        with self._getLookupLock(kind, nameOrID):
+            # Another worker might have looked the resource up, while this one has been waiting for the lock
+            cached, resource = self._getCached(kind, nameOrID)
+            if cached:
+                self._count(self._hits, kind)
+                return resource
+            self._count(self._misses, kind)
+
+            with self._lock:
+                listed = kind in self._cache
+            if not listed:
+                resource = self._fetchFromState(kind, nameOrID)
+                if resource is not None:
+                    with self._lock:
+                        self._fetched[(kind, nameOrID)] = resource
+                    return resource
+                self._prefetch(kind)
+
+            cached, resource = self._getCached(kind, nameOrID)
+            if not cached:
+                resource = self._findResource(kind, nameOrID)
+                with self._lock:
+                    self._cache[kind][nameOrID] = resource
+
+            if resource is not None and resource["name"] == nameOrID:
+                state.record(kind, resource)
+            return resource
+
+    # getAll(kind) returns a dictionary of name -> resource of all the resources of the type "kind".
+    # The resources are listed with one API call per run, like the first get() call does
+    def getAll(self, kind):
+        with self._lock:
+            listed = kind in self._cache
+        if not listed:
+            self._count(self._misses, kind)
+            self._prefetch(kind)
+        with self._lock:
+            return {name: resource for name, resource in self._cache[kind].items()
+                    if resource is not None and resource["name"] == name}
+
+    # insert(kind, resource) puts the resource created by the tool into the cache
+    def insert(self, kind, resource):
+        with self._lock:
+            state.record(kind, resource)
+            self._fetched[(kind, resource["name"])] = resource
+            if kind in self._cache:
+                self._cache[kind][resource["name"]] = resource
+                self._cache[kind][resource["id"]] = resource
+
+    # invalidate(kind, name) removes the resource deleted by the tool from the cache
+    def invalidate(self, kind, name):
+        with self._lock:
+            state.forget(kind, name)
+            self._fetched[(kind, name)] = None
+            if kind in self._cache:
+                resource = self._cache[kind].pop(name, None)
+                if resource is not None:
+                    self._cache[kind].pop(resource["id"], None)
+                self._cache[kind][name] = None
+
+    # stats() returns hit and miss counters of the cache per resource type
+    def stats(self):
+        with self._lock:
+            return {kind: {"hits": self._hits.get(kind, 0), "misses": self._misses.get(kind, 0)}
+                    for kind in sorted(set(self._hits) | set(self._misses))}
+
+
+# Every region has its own cache
+resolver = RegionLocal(lambda region: ResourceResolver())
+
+
+# refreshState(config) rebuilds the persistent state of the resources from the configuration file with
+# one list call per resource type
+@inPhase("state refresh")
+def refreshState(config):
+    for netwConfig in config.get("networks", []):
+        resolver.get("network", netwConfig["name"])
+
+    servNames = set()
+    for servConfig in config.get("servers", []):
+        servNames.add(servConfig["name"])
+        resolver.get("flavor", servConfig["flavor"])
+        resolver.get("image", servConfig["image"])
+        if "instance_snapshot" in servConfig:
+            resolver.get("image", servConfig["instance_snapshot"])
+        resolver.get("keypair", servConfig.get("keypair", servConfig["name"]))
+        for netw in servConfig["networks"]:
+            resolver.get("network", netw["name"])
+
+    for server in conn.compute.servers():
+        if server["name"] in servNames:
+            state.record("server", server)
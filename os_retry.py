@@ -0,0 +1,165 @@
+#    _____      _
+#   |  __ \    | |
+#   | |__) |___| |_ _ __ _   _
+#   |  _  // _ \ __| '__| | | |
+#   | | \ \  __/ |_| |  | |_| |
+#   |_|  \_\___|\__|_|   \__, |
+#                         __/ |
+#                        |___/
+import time
+import random
+import threading
+
+from os_regions import RegionLocal
+
+# Maximum number of attempts of one API call
+RETRY_ATTEMPTS = 6
+# Backoff of the first retry and the maximum backoff, seconds
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 30.0
+# A call is slow if it takes more than the given times of the fastest average latency
+LATENCY_TOLERANCE = 3.0
+
+# HTTP statuses of the overloaded control plane, the call might succeed later
+TRANSIENT_STATUSES = (409, 429, 502, 503, 504)
+# 409 Conflict is transient only while the resource is busy, not if it already exists
+PERMANENT_CONFLICTS = ("already exists", "duplicate", "already allocated", "in use by another")
+# Exceptions of the network layer, the call might succeed after reconnection
+TRANSIENT_EXCEPTIONS = ("ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout", "ConnectFailure",
+                        "RetriableConnectionFailure")
+# Exceptions and HTTP statuses, which mean that the request has not been executed: the connection has not been
+# established or the request has been rejected before its processing. Only these failures of the requests creating
+# resources are retried without checking, whether the resource has been created
+UNSENT_EXCEPTIONS = ("ConnectTimeout", "ConnectFailure")
+UNSENT_STATUSES = (429, 503)
+
+
+# getStatusCode(e) returns the HTTP status code of the failed OpenStack call or None
+def getStatusCode(e):
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status
+
+
+# isTransient(e) returns True if the exception of an OpenStack call is worth a retry
+def isTransient(e):
+    if any(cls.__name__ in TRANSIENT_EXCEPTIONS for cls in type(e).__mro__):
+        return True
+    status = getStatusCode(e)
+    if status not in TRANSIENT_STATUSES:
+        return False
+    if status == 409:
+        message = str(e).lower()
+        return not any(conflict in message for conflict in PERMANENT_CONFLICTS)
+    return True
+
+
+# isUnsent(e) returns True if the failed request has certainly not been executed by the cloud
+def isUnsent(e):
+    if any(cls.__name__ in UNSENT_EXCEPTIONS for cls in type(e).__mro__):
+        return True
+    return getStatusCode(e) in UNSENT_STATUSES
+
+
+# getRetryDelay(e, attempt) returns the delay before the next attempt: the "Retry-After" header of the response,
+# if the server provides it, or an exponential backoff with full jitter.
+def getRetryDelay(e, attempt):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return min(float(headers.get("Retry-After")), RETRY_BACKOFF_MAX)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
+
+# AIMD controller of the number of API requests in flight. The limit grows by one request per
+# "limit" successful fast calls (additive increase) and is halved on every transient failure
+# (multiplicative decrease). Slow calls shrink the limit slightly, before the control plane starts to fail.
+class ConcurrencyController(object):
+    def __init__(self, limit=1):
+        self._condition = threading.Condition()
+        self._maxLimit = limit
+        self._limit = float(limit)
+        self._inFlight = 0
+        self._latency = None
+        self._bestLatency = None
+
+    # configure(maxLimit) sets the maximum number of requests in flight, e.g. the number of parallel workers
+    def configure(self, maxLimit):
+        with self._condition:
+            self._maxLimit = max(1, maxLimit)
+            self._limit = float(self._maxLimit)
+            self._condition.notify_all()
+
+    # limit() returns the current number of allowed requests in flight
+    def limit(self):
+        with self._condition:
+            return max(1, int(self._limit))
+
+    # acquire() waits until one more request is allowed to be in flight
+    def acquire(self):
+        with self._condition:
+            while self._inFlight >= max(1, int(self._limit)):
+                self._condition.wait()
+            self._inFlight += 1
+
+    # release(latency, transientFailure) adjusts the limit with the result of a finished request
+    def release(self, latency, transientFailure):
+        with self._condition:
+            self._inFlight -= 1
+            if transientFailure:
+                self._limit = max(1.0, self._limit / 2)
+            else:
+                # Exponentially weighted average latency and the best one observed
+                self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+                if self._bestLatency is None or self._latency < self._bestLatency:
+                    self._bestLatency = self._latency
+                if self._latency > self._bestLatency * LATENCY_TOLERANCE:
+                    self._limit = max(1.0, self._limit * 0.9)
+                else:
+                    self._limit = min(float(self._maxLimit), self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+
+# Every region has its own control plane, its load is measured separately
+controller = RegionLocal(lambda region: ConcurrencyController())
+
+
+# callWithRetry(func, *args, **kwargs) calls the OpenStack API function with the arguments. Transient failures
+# (overload, rate limits, connection problems) are retried with a jittered backoff, other exceptions are raised
+# immediately. The number of calls in flight of all the workers is limited by the AIMD controller.
+# The function must be idempotent, see callCreateWithRetry() for the requests creating resources
+def callWithRetry(func, *args, **kwargs):
+    return _callWithRetry(func, args, kwargs, None, False)
+
+
+# callCreateWithRetry(find, func, *args, **kwargs) calls the OpenStack API function creating a resource like
+# callWithRetry() does. A request, which might have been executed (a read timeout, HTTP 502 or 504), is not sent
+# again blindly, that would create a duplicate: find() is called first and its result is returned, if it is not
+# None. If "find" is None, such failures are raised.
+def callCreateWithRetry(find, func, *args, **kwargs):
+    return _callWithRetry(func, args, kwargs, find, True)
+
+
+# _callWithRetry(func, args, kwargs, find, creating) does the calls of callWithRetry() and callCreateWithRetry()
+def _callWithRetry(func, args, kwargs, find, creating):
+    for attempt in range(RETRY_ATTEMPTS):
+        controller.acquire()
+        start = time.perf_counter()
+        transient = False
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            transient = isTransient(e)
+            if not transient or attempt == RETRY_ATTEMPTS - 1 or (creating and find is None and not isUnsent(e)):
+                raise
+            error = e
+        finally:
+            # The slot is released on any exception, KeyboardInterrupt too, the other workers must not wait for it
+            controller.release(time.perf_counter() - start, transient)
+        time.sleep(getRetryDelay(error, attempt))
+        # The failed request might have created the resource
+        if creating and not isUnsent(error):
+            resource = find()
+            if resource is not None:
+                return resource
@@ -0,0 +1,160 @@
+#     _____      _              _       _
+#    / ____|    | |            | |     | |
+#   | (___   ___| |__   ___  __| |_   _| | ___ _ __
+#    \___ \ / __| '_ \ / _ \/ _` | | | | |/ _ \ '__|
+#    ____) | (__| | | |  __/ (_| | |_| | |  __/ |
+#   |_____/ \___|_| |_|\___|\__,_|\__,_|_|\___|_|
+#
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from globals import report
+from os_regions import withCurrentRegion
+from os_keypairs import getSSHDirectory, getKeypairName, prepareKeypairs
+from os_networks import createNetworks
+from os_servers import createServerByName, createServerGroup
+from os_ports import preparePorts
+
+
+# runTasks(tasks, parallel) executes a dependency graph of tasks with at most "parallel" tasks at a time.
+# "tasks" is an ordered dictionary of task name -> task description:
+#   "title"    - a prefix of the result line, e.g. 'Creation of server "srv"'
+#   "run"      - a function without arguments, returning None if the task has failed
+#   "requires" - names of the tasks which have to succeed before the task is started
+# Tasks are started in the dictionary order as soon as their requirements are done. If a requirement has
+# failed, the dependent task is not started and reported as FAILED.
+# The function returns a dictionary of task name -> result of the task function.
+def runTasks(tasks, parallel):
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        while pending or running:
+            # Start every task, that is ready, until the worker pool is full
+            started = True
+            while started and len(running) < parallel:
+                started = False
+                for name, task in pending.items():
+                    requires = [r for r in task["requires"] if r in tasks]
+                    if any(r not in results for r in requires):
+                        continue
+
+                    del pending[name]
+                    failed = [r for r in requires if results[r] is None]
+                    if failed:
+                        results[name] = None
+                        report(task["title"] + ' ...   FAILED: "' + tasks[failed[0]]["name"] +
+                               '" has not been created.')
+                    else:
+                        running[executor.submit(withCurrentRegion(task["run"]))] = name
+                    started = True
+                    break
+
+            # Nothing can be started anymore, but the graph is not finished (a dependency cycle)
+            if not running:
+                for name in pending:
+                    results[name] = None
+                    report(tasks[name]["title"] + ' ...   FAILED: Unresolvable dependencies.')
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = None
+                    report(tasks[name]["title"] + ' ...   FAILED: ' + str(e))
+    return results
+
+
+# getCreatedServerNames(results) returns the names of the servers, which are running after createInfrastructure()
+# with the results "results"
+def getCreatedServerNames(results):
+    names = []
+    for taskName, result in results.items():
+        if taskName.startswith("server:") and result is not None:
+            names.append(taskName[len("server:"):])
+        elif taskName.startswith("template:") and result is not None:
+            names.extend(name for name, server in result.items() if server is not None)
+    return names
+
+
+# createInfrastructure(config, serverNames, networkNames, arguments) creates the listed networks and servers.
+# Networks are created first, then the ports of the servers and ssh keypairs, then servers. Each server depends
+# only on the listed networks it is connected to, on the ports and on its keypair, so independent resources are
+# created concurrently by up to "arguments.parallel" workers. The servers of one server template are created
+# by one task.
+def createInfrastructure(config, serverNames, networkNames, arguments):
+    tasks = {}
+
+    # All the networks are created with two bulk requests by one task, the task of every network only
+    # passes its result to the servers depending on it
+    if networkNames:
+        networks = {}
+        tasks["networks"] = {
+            "name": "networks",
+            "title": 'Creation of the networks',
+            "run": lambda: networks.update(createNetworks(config, networkNames)) or networks,
+            "requires": []}
+    for netwName in networkNames:
+        tasks["network:" + netwName] = {
+            "name": netwName,
+            "title": 'Creation of the network "' + netwName + '"',
+            "run": lambda n=netwName: networks.get(n),
+            "requires": ["networks"]}
+
+    servConfigs = [config.getServer(name) for name in dict.fromkeys(serverNames) if config.getServer(name) is not None]
+
+    # The ports of all the servers are created with one bulk request before any server boots, so the servers
+    # boot with their ports and a fixed IP address conflict is found before the boot
+    ports = {}
+    if servConfigs:
+        tasks["ports"] = {
+            "name": "ports",
+            "title": 'Creation of the ports',
+            "run": lambda: ports.update(preparePorts(config, serverNames)) or ports,
+            "requires": ["networks"]}
+
+        # Every keypair is prepared once by one task, even if several servers share it, the task of every keypair
+        # only passes its result to the servers using it
+        ssh_dir = getSSHDirectory(arguments)
+        keypairNames = list(dict.fromkeys(getKeypairName(servConfig) for servConfig in servConfigs))
+        keypairs = {}
+        tasks["keypairs"] = {
+            "name": "keypairs",
+            "title": 'Creation of the ssh keypairs',
+            "run": lambda: keypairs.update(prepareKeypairs(keypairNames, ssh_dir, arguments.parallel)) or keypairs,
+            "requires": []}
+        for sshKeyName in keypairNames:
+            tasks["keypair:" + sshKeyName] = {
+                "name": sshKeyName,
+                "title": 'Creation of the ssh keypair "' + sshKeyName + '"',
+                "run": lambda k=sshKeyName: keypairs.get(k),
+                "requires": ["keypairs"]}
+
+    # Servers of a template are created together, see createServerGroup()
+    templates = {}
+    for servConfig in servConfigs:
+        if "template" in servConfig:
+            templates.setdefault(servConfig["template"], []).append(servConfig)
+    for pattern, members in templates.items():
+        tasks["template:" + pattern] = {
+            "name": pattern,
+            "title": 'Creation of servers "' + pattern + '"',
+            "run": lambda m=[s["name"] for s in members]: createServerGroup(config, m, arguments, ports),
+            "requires": ["ports"] + ["network:" + netw["name"] for netw in members[0]["networks"]] +
+                        ["keypair:" + getKeypairName(members[0])]}
+
+    for servConfig in servConfigs:
+        if "template" in servConfig:
+            continue
+        servName = servConfig["name"]
+        tasks["server:" + servName] = {
+            "name": servName,
+            "title": 'Creation of server "' + servName + '"',
+            "run": lambda s=servName: createServerByName(config, s, arguments, ports),
+            "requires": ["ports"] + ["network:" + netw["name"] for netw in servConfig["networks"]] +
+                        ["keypair:" + getKeypairName(servConfig)]}
+
+    return runTasks(tasks, arguments.parallel)
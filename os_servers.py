@@ -5,197 +5,346 @@
 #    ____) |  __/ |   \ V /  __/ |  \__ \
 #   |_____/ \___|_|    \_/ \___|_|  |___/
 #
-import os
-import errno
-import base64
+import re
 
-from globals import conn
+from globals import conn, report
+from os_state import state, isNotFound
+from os_retry import callWithRetry, callCreateWithRetry
+from os_keypairs import getSSHDirectory, getKeypairName, prepareKeypair
 from os_images import getImageByName
+from os_flavor import getFlavorByName
 from os_snapshots import getSnapshotByName
 from os_networks import getNetworkByName, createNetworkByName
+from os_templates import getTemplateRegex, getTemplateBaseName
+from os_poller import poller, ServerStatusError, ACTIVE
+from os_userdata import userDataBuilder
+from os_journal import journal, JOURNAL_CREATING, JOURNAL_CREATED, JOURNAL_FAILED
+from os_profile import inPhase
 
+# Metadata of the servers created by the tool, only they are deleted as orphans, see computePlan()
+SERVER_METADATA = {"openstack_vim_managed": "true"}
 
-# createServerByName(config, name) creates a server with the name "name" and the parameters from the "config" structure
-def createServerByName(config, name, arguments):
-    # Looking for a config of the server to be created
-    for servConfig in config["servers"]:
-        if servConfig["name"] != name:
-            continue
 
-        # The config has been found
-        server = conn.compute.find_server(name)
+# isManagedServer(server) returns True if the server has been created by the tool
+def isManagedServer(server):
+    metadata = server["metadata"] or {}
+    return all(metadata.get(key) == value for key, value in SERVER_METADATA.items())
 
-        # If the server exists, skip its creation
-        if server is not None:
-            print('Creation of server "' + name + '" ...   SKIPPED: The server already exists.')
-            return
-
-        snapshot = None
-        if "instance_snapshot" in servConfig:
-            # Get the instance snapshot name for the server creation
-            snapshot = getSnapshotByName(servConfig["instance_snapshot"])
-            if snapshot is None:
-                print('Creation of server "' + name + '" ...   FAILED: Snapshot "' +
-                      servConfig["image"] + '" does not exist.')
-                return
-
-        # Get the image for the server creation
-        image = getImageByName(servConfig["image"])
-        if image is None:
-            print('Creation of server "' + name + '" ...   FAILED: Image "' +
-                  servConfig["image"] + '" does not exist.')
-            return
-
-        # Get the flavor for the server creation
-        flavor = conn.compute.find_flavor(servConfig["flavor"])
-        if flavor is None:
-            print('Creation of server "' + name + '" ...   FAILED: Flavor "' +
-                  servConfig["flavor"] + '" does not exist.')
-            return
-
-        # Try to create a directory for generated ssh keys
-        # Default path is user's "~/.ssh" directory
-        ssh_dir = os.path.expanduser("~") + os.path.sep + ".ssh"
-        if arguments.ssh_directory is not None:
-            ssh_dir = arguments.ssh_directory
 
+# getServerByName(name) returns server object of the server with the name "name".
+# The server is fetched by its ID, if the ID is known from the previous runs, otherwise it is searched by name.
+# If the server does not exist, the function returns None
+def getServerByName(name):
+    serverID = state.getID("server", name)
+    if serverID is not None:
         try:
-            os.mkdir(ssh_dir)
-        # Nothing bad happened. The directory exists.
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise e
-
-        # Default sshKeyName = serverName
-        sshKeyName = name
-        # If config contains new ssh key name, redefine the value
-        if "keypair" in servConfig.keys():
-            sshKeyName = servConfig["keypair"]
-
-        privateKeyPath = ssh_dir + os.path.sep + sshKeyName
-        publicKeyPath = privateKeyPath + ".pub"
-
-        # Attempt to get existing ssh key
-        keypair = conn.compute.find_keypair(sshKeyName)
-
-        # The keypair <keyPairName> is absent in Openstack
-        if keypair is None:
-
-            # If the private key <keyPairName> is present in local user .ssh folder
-            if os.path.isfile(privateKeyPath):
-
-                # The public key <keyPairName> is absent in local user .ssh folder
-                if not os.path.isfile(publicKeyPath):
-                    # Generate public ssh key from the private one
-                    os.system('ssh-keygen -y -f ' + privateKeyPath + ' > ' + publicKeyPath)
-                    os.chmod(publicKeyPath, 0o444)
-
-                # Upload  public key to Openstack
-                with open(os.path.expanduser(publicKeyPath)) as f:
-                    public_key = f.read()
-                    keypair = conn.compute.create_keypair(name=sshKeyName, public_key=public_key)
-                    if keypair is None:
-                        print('Creation of server "' + name + '" ...   FAILED: Error during upload public ssh key "' +
-                              sshKeyName + '" to Openstack')
-                        return
-
-            # If the keypair <keyPairName> is absent in local user .ssh folder
-            else:
+            server = callWithRetry(conn.compute.get_server, serverID)
+        except Exception as e:
+            if not isNotFound(e):
+                raise
+            server = None
+        if server is not None and server["name"] == name:
+            return server
+        # The stored ID is stale
+        state.forget("server", name)
+
+    server = callWithRetry(conn.compute.find_server, name)
+    if server is not None:
+        state.record("server", server)
+    return server
+
+
+# prepareServerArguments(config, servConfig, arguments, ports) resolves the image, flavor, keypair, networks and
+# init script of the server config entry and returns the arguments of the create_server call. If the server has
+# pre-created ports in "ports" (see preparePorts()), it is connected to them instead of the networks.
+# If a resource is not available, the function returns None and the reason of the failure
+def prepareServerArguments(config, servConfig, arguments, ports=None):
+    snapshot = None
+    if "instance_snapshot" in servConfig:
+        # Get the instance snapshot name for the server creation
+        snapshot = getSnapshotByName(servConfig["instance_snapshot"])
+        if snapshot is None:
+            return None, 'Snapshot "' + servConfig["instance_snapshot"] + '" does not exist.'
+
+    # Get the image for the server creation
+    image = getImageByName(servConfig["image"])
+    if image is None:
+        return None, 'Image "' + servConfig["image"] + '" does not exist.'
+
+    # Get the flavor for the server creation
+    flavor = getFlavorByName(conn, servConfig["flavor"])
+    if flavor is None:
+        return None, 'Flavor "' + servConfig["flavor"] + '" does not exist.'
+
+    # Get the ssh keypair for the server, it is uploaded or generated if it is absent in OpenStack
+    sshKeyName = getKeypairName(servConfig)
+    keypair = prepareKeypair(sshKeyName, getSSHDirectory(arguments))
+    if keypair is None:
+        return None, 'Error during ssh keypair "' + sshKeyName + '" preparation for the server "' + \
+            servConfig["name"] + '".'
+
+    # Prepare the list networks for connecting the server, the pre-created ports already have the fixed IPs
+    if ports and servConfig["name"] in ports:
+        portIDs, error = ports[servConfig["name"]]
+        if portIDs is None:
+            return None, error
+        networks = [{"port": portID} for portID in portIDs]
+    else:
+        networks, error = _getServerNetworks(config, servConfig)
+        if networks is None:
+            return None, error
+
+    # Post-installation init script, the files shared by several servers are read and encoded once
+    user_data, error = userDataBuilder.build(config, servConfig)
+    if user_data is None:
+        return None, error
+
+    if snapshot is not None:
+        image = snapshot
+
+    return {"name": servConfig["name"],
+            "image_id": image.id,
+            "flavor_id": flavor.id,
+            "networks": networks,
+            "user_data": user_data,
+            "key_name": keypair["name"],
+            "metadata": dict(SERVER_METADATA)}, None
+
+
+# _getServerNetworks(config, servConfig) returns the networks argument of the create_server call for the server
+# config entry, missing networks are created. If a network is not available, the function returns None and
+# the reason of the failure
+def _getServerNetworks(config, servConfig):
+    networks = []
+    for netw in servConfig["networks"]:
+        # If the network does not exist, create it
+        network = getNetworkByName(netw["name"])
+        if network is None:
+            network = createNetworkByName(config, netw["name"])
+        if network is None:
+            return None, 'Network "' + netw["name"] + '" is not available.'
+
+        # If config contains desired IPv4 addresses, append them to networks config
+        if "ipv4" in netw.keys():
+            networks.append({"uuid": network["id"], "fixed_ip": netw["ipv4"]})
+        else:
+            networks.append({"uuid": network["id"]})
+    return networks, None
 
-                # Generate new ssh keypair
-                keypair = conn.compute.create_keypair(name=sshKeyName)
-
-                # Save the private key to local .ssh folder
-                with open(privateKeyPath, 'w') as f:
-                    f.write("%s" % keypair.private_key)
-                os.chmod(privateKeyPath, 0o400)
-
-                # If error
-                if keypair is None:
-                    print('Creation of server "' + name + '" ...   FAILED: Error during ssh keypair "' + sshKeyName +
-                          '" creation for the server "' + name + '".')
-                    return
-
-        # Prepare the list networks for connecting the server
-        networks = []
-        for netw in servConfig["networks"]:
-            # If the network does not exist, create it
-            network = getNetworkByName(netw["name"])
-            if network is None:
-                network = createNetworkByName(config, netw["name"])
-
-            # If config contains desired IPv4 addresses, append them to networks config
-            if "ipv4" in netw.keys():
-                networks.append({"uuid": network.id, "fixed_ip": netw["ipv4"]})
-            else:
-                networks.append({"uuid": network.id})
-
-        # Load post-installation init script from file
-        user_data = ""
-        if "init-script" in servConfig:
-            # If the script file doesn't exists
-            if not os.path.isfile(servConfig["init-script"]):
-                print('Creation of server "' + name + '" ...   FAILED: Init script file "' +
-                      servConfig["init-script"] + '" does not exist.')
-                return
-
-            with open(servConfig["init-script"], "r") as initfile:
-                initscript = initfile.read()
-                # OpenStack requires special encoding for the user_data argument
-                user_data = base64.b64encode(initscript.encode('ascii')).decode('ascii')
-
-        if snapshot is not None:
-            image = snapshot
-
-        # Create server
-        server = conn.compute.create_server(
-            name=name,
-            image_id=image.id,
-            flavor_id=flavor.id,
-            networks=networks,
-            user_data=user_data,
-            key_name=keypair["name"])
-
-        # It takes some time
-        conn.compute.wait_for_server(server)
-
-        # If the server is absent, an error occured
-        if server is None:
-            print('Creation of server "' + name + '" ...   FAILED: Error during the server creation.')
-            return
-
-        print('Creation of server "' + name + '" ...   OK')
+
+# createServerByName(config, name) creates a server with the name "name" and the parameters from the "config" structure
+# The server is connected to its pre-created ports, if they are in "ports" (see preparePorts()).
+# The function returns the server object or None if the server can not be created
+@inPhase("server boot")
+def createServerByName(config, name, arguments, ports=None):
+    # Looking for a config of the server to be created
+    servConfig = config.getServer(name)
+    if servConfig is None:
+        # Unknown server name
+        report('Creation of server "' + name + '" ...   FAILED: There is no entry for the server "' + name +
+               '" in the configuration file.')
         return
 
-    # Unknown server name
-    print('Creation of server "' + name + '" ...   FAILED: There is no entry for the server "' + name +
-          '" in the configuration file.')
-    return
+    # The server of the interrupted run is taken from the journal, the booting one is awaited by its ID
+    entry = journal.getResumed("server", name)
+    if entry is not None and entry["state"] == JOURNAL_CREATED:
+        report('Creation of server "' + name + '" ...   SKIPPED: The server has been created by the interrupted run.')
+        return {"id": entry["id"], "name": name}
+    if entry is not None and entry["state"] == JOURNAL_CREATING:
+        return _awaitServers({entry["id"]: name}, {})[name]
 
+    server = getServerByName(name)
 
-# createAllServers(config) creates servers with the parameters from the "config" structure.
-def createAllServers(config, arguments):
-    if "servers" in config.keys():
-        for servConfig in config["servers"]:
-            createServerByName(config, servConfig["name"], arguments)
-    else:
-        print('No "servers" section has been found in the configuration file.')
+    # If the server exists, skip its creation
+    if server is not None:
+        report('Creation of server "' + name + '" ...   SKIPPED: The server already exists.')
+        return server
 
+    serverArguments, error = prepareServerArguments(config, servConfig, arguments, ports)
+    if serverArguments is None:
+        report('Creation of server "' + name + '" ...   FAILED: ' + error)
+        return
 
-# deleteServerByName(name) deletes the server with a special name if it exists
-def deleteServerByName(name):
-    serv = conn.compute.find_server(name)
-    if serv is not None:
-        conn.compute.delete_server(serv)
-        conn.compute.wait_for_delete(serv, wait=300)
-        print('Deleting of the server "' + name + '" ...   OK')
+    # Create server
+    server = callCreateWithRetry(lambda: callWithRetry(conn.compute.find_server, name), conn.compute.create_server,
+                                 **serverArguments)
+    journal.record("server", name, server["id"], JOURNAL_CREATING)
+
+    # It takes some time, the status of all the servers being booted is polled at once
+    try:
+        server = poller.wait(server, ACTIVE)
+    except ServerStatusError:
+        journal.record("server", name, server["id"], JOURNAL_FAILED)
+        raise
+
+    state.record("server", server)
+    journal.record("server", name, server["id"], JOURNAL_CREATED)
+    report('Creation of server "' + name + '" ...   OK')
+    return server
+
+
+# createServerGroup(config, names, arguments) creates the servers "names" generated from one server template.
+# Servers without fixed IP addresses are booted with one multi-create request (min_count = max_count) and
+# renamed afterwards. Nova can not assign a different fixed IP to every instance of a multi-create request, so
+# servers with fixed IP addresses or with different user data are requested one by one without waiting, connected
+# to their pre-created ports if they are in "ports". Both are awaited by the poller.
+# The function returns a dictionary of server name -> server object, None if the server can not be created
+@inPhase("server boot")
+def createServerGroup(config, names, arguments, ports=None):
+    members = [config.getServer(name) for name in names if config.getServer(name) is not None]
+    if not members:
+        return {}
+    pattern = members[0]["template"]
+    nameRegex = getTemplateRegex(pattern)
+    results = {}
+
+    # Server ID -> name of the server it has to get
+    requested = {}
+
+    # The servers of the interrupted run are taken from the journal, the booting ones are awaited by their IDs
+    for servConfig in list(members):
+        entry = journal.getResumed("server", servConfig["name"])
+        if entry is not None and entry["state"] == JOURNAL_CREATED:
+            report('Creation of server "' + servConfig["name"] + '" ...   SKIPPED: The server has been created by '
+                   'the interrupted run.')
+            results[servConfig["name"]] = {"id": entry["id"], "name": servConfig["name"]}
+            members.remove(servConfig)
+        elif entry is not None and entry["state"] == JOURNAL_CREATING:
+            requested[entry["id"]] = servConfig["name"]
+            members.remove(servConfig)
+    if not members:
+        return _awaitServers(requested, results)
+
+    # The servers of the template, which already exist, are listed at once
+    existing = {}
+    for server in callWithRetry(lambda: list(conn.compute.servers(name=nameRegex))):
+        existing.setdefault(server["name"], server)
+    missing = []
+    for servConfig in members:
+        server = existing.get(servConfig["name"])
+        if server is not None:
+            state.record("server", server)
+            report('Creation of server "' + servConfig["name"] + '" ...   SKIPPED: The server already exists.')
+            results[servConfig["name"]] = server
+        else:
+            missing.append(servConfig)
+    if not missing:
+        return _awaitServers(requested, results)
+
+    # Image, flavor, keypair and networks are shared by all the servers of the template
+    serverArguments, error = prepareServerArguments(config, missing[0], arguments)
+    if serverArguments is None:
+        for servConfig in missing:
+            report('Creation of server "' + servConfig["name"] + '" ...   FAILED: ' + error)
+            results[servConfig["name"]] = None
+        return _awaitServers(requested, results)
+
+    # The variables of the init script might give every server its own user data
+    userData = {}
+    for servConfig in list(missing):
+        userData[servConfig["name"]], error = userDataBuilder.build(config, servConfig)
+        if error is not None:
+            report('Creation of server "' + servConfig["name"] + '" ...   FAILED: ' + error)
+            results[servConfig["name"]] = None
+            missing.remove(servConfig)
+    if not missing:
+        return _awaitServers(requested, results)
+
+    if any("fixed_ip" in netw for netw in serverArguments["networks"]) or len(set(userData.values())) > 1:
+        # A failure of one request fails only its server, the others are requested anyway
+        for servConfig in missing:
+            if ports and servConfig["name"] in ports:
+                portIDs, error = ports[servConfig["name"]]
+                if portIDs is None:
+                    report('Creation of server "' + servConfig["name"] + '" ...   FAILED: ' + error)
+                    results[servConfig["name"]] = None
+                    continue
+                networks = [{"port": portID} for portID in portIDs]
+            else:
+                networks = [dict(netw) for netw in serverArguments["networks"]]
+                for netw, netwConfig in zip(networks, servConfig["networks"]):
+                    if "ipv4" in netwConfig:
+                        netw["fixed_ip"] = netwConfig["ipv4"]
+            try:
+                server = callCreateWithRetry(lambda n=servConfig["name"]: callWithRetry(conn.compute.find_server, n),
+                                             conn.compute.create_server,
+                                             **dict(serverArguments, name=servConfig["name"], networks=networks,
+                                                    user_data=userData[servConfig["name"]]))
+            except Exception as e:
+                report('Creation of server "' + servConfig["name"] + '" ...   FAILED: ' + str(e))
+                results[servConfig["name"]] = None
+                continue
+            requested[server["id"]] = servConfig["name"]
+            journal.record("server", servConfig["name"], server["id"], JOURNAL_CREATING)
     else:
-        print('Deleting of the server "' + name + '" ...   SKIPPED: The server does not exist.')
-    return
-
-
-# deleteAllServers(config) deletes all servers with the parameters from the "config" structure.
-def deleteAllServers(config):
-    if "servers" in config.keys():
-        for servConfig in config["servers"]:
-            deleteServerByName(servConfig["name"])
+        try:
+            baseName = getTemplateBaseName(pattern)
+            instanceRegex = "^" + re.escape(baseName) + "(-[0-9]+)?$"
+            listInstances = lambda: callWithRetry(lambda: list(conn.compute.servers(name=instanceRegex)))
+            existingIDs = set(server["id"] for server in listInstances())
+            # A failed request might have booted the instances, they are not requested again then
+            findInstances = lambda: [server for server in listInstances() if server["id"] not in existingIDs] or None
+            callCreateWithRetry(findInstances, conn.compute.create_server, min_count=len(missing),
+                                max_count=len(missing), **dict(serverArguments, name=baseName))
+            assigned = _assignGroupNames(instanceRegex, existingIDs, [servConfig["name"] for servConfig in missing])
+            for serverID, name in assigned.items():
+                requested[serverID] = name
+                journal.record("server", name, serverID, JOURNAL_CREATING)
+        except Exception as e:
+            # One request boots all the servers, its failure fails all of them
+            for servConfig in missing:
+                if servConfig["name"] not in requested.values() and servConfig["name"] not in results:
+                    report('Creation of server "' + servConfig["name"] + '" ...   FAILED: ' + str(e))
+                    results[servConfig["name"]] = None
+
+    # Nova might be configured to give the instances of a multi-create request names of another form
+    for servConfig in missing:
+        if servConfig["name"] not in results and servConfig["name"] not in requested.values():
+            report('Creation of server "' + servConfig["name"] + '" ...   FAILED: The instance of the multi-create '
+                   'request has not been found.')
+            results[servConfig["name"]] = None
+
+    return _awaitServers(requested, results)
+
+
+# _awaitServers(requested, results) waits for the boot of the servers "requested" (server ID -> name) together and
+# adds the booted servers to "results" (server name -> server object), None if the boot has failed.
+# The function returns "results"
+def _awaitServers(requested, results):
+    watches = {name: poller.watch({"id": serverID, "name": name}, ACTIVE) for serverID, name in requested.items()}
+    for name, watch in watches.items():
+        try:
+            server = watch.wait()
+        except ServerStatusError as e:
+            journal.record("server", name, watch.serverID, JOURNAL_FAILED)
+            report('Creation of server "' + name + '" ...   FAILED: ' + str(e))
+            server = None
+        else:
+            state.record("server", server)
+            journal.record("server", name, server["id"], JOURNAL_CREATED)
+            report('Creation of server "' + name + '" ...   OK')
+        results[name] = server
+    return results
+
+
+# _assignGroupNames(instanceRegex, existingIDs, names) finds the instances of a multi-create request among the
+# servers matching instanceRegex, which are not in existingIDs, and renames them to "names". The instances are
+# identical, so any of them can get any name; the ones already named right by Nova are not renamed.
+# The function returns a dictionary of server ID -> its name
+def _assignGroupNames(instanceRegex, existingIDs, names):
+    instances = [server for server in callWithRetry(lambda: list(conn.compute.servers(name=instanceRegex)))
+                 if server["id"] not in existingIDs]
+
+    assigned = {}
+    free = list(names)
+    for server in instances:
+        if server["name"] in free:
+            free.remove(server["name"])
+            assigned[server["id"]] = server["name"]
+    for server in instances:
+        if server["id"] in assigned or not free:
+            continue
+        name = free.pop(0)
+        callWithRetry(conn.compute.update_server, server, name=name)
+        assigned[server["id"]] = name
+    return assigned
@@ -5,15 +5,15 @@
 #   |____/|_| |_|\__,_| .__/|___/_| |_|\___/ \__|___/
 #                     |_|
 
-from globals import conn
+from os_resolver import resolver
 
 
 # isSnapshotExist(imageName) returns True if an image with the name imageName exists.
 def isSnapshotExist(imageName):
-    return conn.compute.find_image(imageName) is not None
+    return resolver.get("image", imageName) is not None
 
 
 # getSnapshotByName(imageName) returns image object of the image with the name imageName.
 # if the image does not exist, the function returns None
 def getSnapshotByName(imageName):
-    return conn.compute.find_image(imageName)
\ No newline at end of file
+    return resolver.get("image", imageName)
\ No newline at end of file
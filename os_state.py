@@ -0,0 +1,97 @@
+#     _____ _        _
+#    / ____| |      | |
+#   | (___ | |_ __ _| |_ ___
+#    \___ \| __/ _` | __/ _ \
+#    ____) | || (_| | ||  __/
+#   |_____/ \__\__,_|\__\___|
+#
+import os
+import json
+import time
+import hashlib
+import threading
+
+from globals import CLOUD_NAME
+from os_regions import RegionLocal
+
+# Directory for the state files, one file per cloud and configuration file
+STATE_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                               "openstack-vim")
+
+
+# isNotFound(e) returns True if the exception of an OpenStack call means, that the resource does not exist
+def isNotFound(e):
+    return getattr(e, "status_code", None) == 404
+
+
+# getStatePath(cloud, configFile, prefix, extension) returns the path of the file of the cloud (or the region label)
+# and the configuration file in the state directory
+def getStatePath(cloud, configFile, prefix, extension):
+    key = cloud + "\n" + os.path.abspath(configFile)
+    return os.path.join(STATE_DIRECTORY, prefix + "-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + extension)
+
+
+# Persistent cache of name -> ID of the resources, which the tool has created or resolved.
+# The next runs fetch the resources by ID instead of searching them by name. The file is keyed by
+# the cloud name, the region and the configuration file path, stale entries are removed by the users of the cache.
+class ResourceState(object):
+    def __init__(self, region=None):
+        # The default cloud keeps the file name of the single cloud versions
+        self._cloud = CLOUD_NAME if region is None else region.label
+        self._lock = threading.Lock()
+        self._path = None
+        self._resources = {}
+        self._changed = False
+
+    # load(configFile, refresh) reads the state of the configuration file. If "refresh" is True,
+    # the stored state is discarded and rebuilt from the resources resolved during the run.
+    def load(self, configFile, refresh=False):
+        with self._lock:
+            self._path = getStatePath(self._cloud, configFile, "state", ".json")
+            self._resources = {}
+            self._changed = refresh
+            if refresh or not os.path.isfile(self._path):
+                return
+            try:
+                with open(self._path) as f:
+                    self._resources = json.load(f).get("resources", {})
+            except (OSError, ValueError):
+                # A broken state file is rebuilt from scratch
+                self._changed = True
+
+    # save() writes the state to the disk, if it has been changed during the run
+    def save(self):
+        with self._lock:
+            if self._path is None or not self._changed:
+                return
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            tmpPath = self._path + "." + str(os.getpid()) + ".tmp"
+            with open(tmpPath, "w") as f:
+                json.dump({"cloud": self._cloud, "resources": self._resources}, f, indent=2, sort_keys=True)
+            os.replace(tmpPath, self._path)
+            self._changed = False
+
+    # getID(kind, name) returns the stored ID of the resource "name" of the type "kind" or None
+    def getID(self, kind, name):
+        with self._lock:
+            entry = self._resources.get(kind, {}).get(name)
+            return entry["id"] if entry is not None else None
+
+    # record(kind, resource) stores the ID of the resource, which has been created or resolved
+    def record(self, kind, resource):
+        with self._lock:
+            entry = self._resources.setdefault(kind, {}).get(resource["name"])
+            if entry is not None and entry["id"] == resource["id"]:
+                return
+            self._resources[kind][resource["name"]] = {"id": resource["id"], "recorded_at": int(time.time())}
+            self._changed = True
+
+    # forget(kind, name) removes the stale or deleted resource from the state
+    def forget(self, kind, name):
+        with self._lock:
+            if self._resources.get(kind, {}).pop(name, None) is not None:
+                self._changed = True
+
+
+# Every region has its own state file
+state = RegionLocal(ResourceState)
@@ -0,0 +1,158 @@
+#    _______                  _
+#   |__   __|                | |
+#      | | ___  __ _ _ __ __| | _____      ___ __
+#      | |/ _ \/ _` | '__/ _` |/ _ \ \ /\ / / '_ \
+#      | |  __/ (_| | | | (_| | (_) \ V  V /| | | |
+#      |_|\___|\__,_|_|  \__,_|\___/ \_/\_/ |_| |_|
+#
+import time
+
+from globals import conn, report
+from os_state import state
+from os_retry import callWithRetry
+from os_networks import deleteNetworkByName
+from os_ports import getPortNames, deleteUnboundPorts, getServerPorts, deleteServerPorts
+from os_poller import poller, DELETED
+from os_journal import journal, JOURNAL_DELETING, JOURNAL_DELETED
+from os_profile import inPhase
+
+# Maximum time to wait for the servers deletion, seconds
+TEARDOWN_TIMEOUT = 300
+# Interval between two checks of the ports state, seconds
+TEARDOWN_POLL_INTERVAL = 2
+
+
+# deleteInfrastructure(config, serverNames, networkNames) deletes the listed servers and networks.
+# All server deletions are issued at once. Every listed network is deleted as soon as the last port of
+# the servers being deleted disappears from it, so the whole teardown takes roughly one server deletion time.
+# The pre-created ports of the servers survive the servers deletion, they are deleted as soon as their server
+# is gone. The unbound pre-created ports left in a network are deleted right before the network.
+@inPhase("teardown")
+def deleteInfrastructure(config, serverNames, networkNames):
+    wanted = set(serverNames)
+    servers = {}
+    for server in callWithRetry(lambda: list(conn.compute.servers())):
+        if server["name"] in wanted and server["name"] not in servers:
+            servers[server["name"]] = server
+
+    networks = {}
+    if networkNames:
+        wanted = set(networkNames)
+        for network in callWithRetry(lambda: list(conn.network.networks())):
+            if network["name"] in wanted and network["name"] not in networks:
+                networks[network["name"]] = network
+
+    # Pre-created ports of the servers, they are listed before the deletions release them
+    serverPorts = getServerPorts(config, servers, serverNames) if serverNames else {}
+
+    # Issue all the server deletions up front
+    deleting = {}
+    for name in serverNames:
+        # The server of the interrupted restart is the new one, the old one has been deleted already
+        if journal.isRecreated("server", name):
+            report('Deleting of the server "' + name + '" ...   SKIPPED: The server has been recreated by '
+                   'the interrupted run.')
+            continue
+        # The deletion requested by the interrupted run is only awaited
+        entry = journal.getResumed("server", name)
+        resumed = entry is not None and entry["state"] == JOURNAL_DELETING
+        if name not in servers:
+            if resumed:
+                state.forget("server", name)
+                journal.record("server", name, entry["id"], JOURNAL_DELETED)
+                report('Deleting of the server "' + name + '" ...   OK')
+            else:
+                report('Deleting of the server "' + name + '" ...   SKIPPED: The server does not exist.')
+            deleteServerPorts(name, serverPorts.get(name, []))
+            continue
+        if not resumed or entry["id"] != servers[name]["id"]:
+            # A failed request fails only its server, the other servers and the networks are deleted anyway
+            try:
+                callWithRetry(conn.compute.delete_server, servers[name])
+            except Exception as e:
+                report('Deleting of the server "' + name + '" ...   FAILED: ' + str(e))
+                continue
+            journal.record("server", name, servers[name]["id"], JOURNAL_DELETING)
+        deleting[servers[name]["id"]] = poller.watch(servers[name], DELETED, TEARDOWN_TIMEOUT)
+
+    for name in networkNames:
+        if journal.isRecreated("network", name):
+            report('Deleting of the network "' + name + '" with its subnet(s) ...   '
+                   'SKIPPED: The network has been recreated by the interrupted run.')
+            networks.pop(name, None)
+        elif name not in networks:
+            report('Deleting of the network "' + name + '" with its subnet(s) ...   '
+                   'SKIPPED: The network does not exist.')
+
+    # Networks, the deleted servers are attached to according to the configuration file
+    pendingNetworks = {name: networks[name]["id"] for name in networkNames if name in networks}
+    configured = {}
+    for servConfig in config.get("servers", []):
+        server = servers.get(servConfig["name"])
+        if server is None or server["id"] not in deleting:
+            continue
+        for netw in servConfig["networks"]:
+            if netw["name"] in pendingNetworks:
+                configured.setdefault(pendingNetworks[netw["name"]], set()).add(server["id"])
+
+    # IDs of all the deleted servers, their ports are tracked until they disappear
+    deleted = set(deleting)
+    portNames = getPortNames(config)
+
+    deadline = time.time() + TEARDOWN_TIMEOUT
+    while True:
+        # Servers, that are still being deleted, and the ports of deleted servers, that still exist,
+        # grouped by network
+        attached = {}
+        for networkID, serverIDs in configured.items():
+            attached[networkID] = set(serverID for serverID in serverIDs if serverID in deleting)
+        # Pre-created ports of the configured servers, which are not bound anymore, grouped by network
+        unbound = {}
+        polled = True
+        if pendingNetworks:
+            try:
+                for port in callWithRetry(lambda: list(conn.network.ports())):
+                    if port["device_id"] in deleted:
+                        attached.setdefault(port["network_id"], set()).add(port["device_id"])
+                    elif not port["device_id"] and port["name"] in portNames:
+                        unbound.setdefault(port["network_id"], []).append(port)
+            except Exception:
+                # The ports are polled again with the next check, the networks wait until then or until the timeout
+                polled = time.time() > deadline
+
+        # Delete every network, which has no ports of the deleted servers anymore
+        if polled:
+            for name, networkID in list(pendingNetworks.items()):
+                if not attached.get(networkID):
+                    deleteUnboundPorts(unbound.get(networkID, []))
+                    deleteNetworkByName(name)
+                    del pendingNetworks[name]
+
+        if not deleting and not pendingNetworks:
+            break
+
+        # Stop waiting, the remaining networks deletion is tried anyway
+        if time.time() > deadline:
+            for watch in deleting.values():
+                report('Deleting of the server "' + watch.name + '" ...   '
+                       'FAILED: Timeout while waiting for the deletion.')
+            deleting = {}
+            deleted = set()
+            continue
+
+        time.sleep(TEARDOWN_POLL_INTERVAL)
+
+        # Report the servers, which have disappeared since the previous check, the servers status is polled
+        # by the shared poller
+        for serverID, watch in list(deleting.items()):
+            if not watch.done():
+                continue
+            del deleting[serverID]
+            if watch.error is not None:
+                report('Deleting of the server "' + watch.name + '" ...   FAILED: ' + watch.error)
+                deleted.discard(serverID)
+            else:
+                report('Deleting of the server "' + watch.name + '" ...   OK')
+                deleteServerPorts(watch.name, serverPorts.get(watch.name, []))
+                state.forget("server", watch.name)
+                journal.record("server", watch.name, serverID, JOURNAL_DELETED)
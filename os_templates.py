@@ -0,0 +1,118 @@
+#    _______                   _       _
+#   |__   __|                 | |     | |
+#      | | ___ _ __ ___  _ __ | | __ _| |_ ___  ___
+#      | |/ _ \ '_ ` _ \| '_ \| |/ _` | __/ _ \/ __|
+#      | |  __/ | | | | | |_) | | (_| | ||  __/\__ \
+#      |_|\___|_| |_| |_| .__/|_|\__,_|\__\___||___/
+#                       | |
+#                       |_|
+import re
+import copy
+import ipaddress
+
+# Placeholder of the instance index in the name of a server template, e.g. "worker-{index}" or "node{index:02d}"
+INDEX_PATTERN = re.compile(r"\{index(:[^}]*)?\}")
+
+
+# isServerTemplate(servConfig) returns True if the servers config entry describes a group of identical servers
+def isServerTemplate(servConfig):
+    return "count" in servConfig
+
+
+# getTemplateRegex(pattern) returns the regular expression matching the names generated from the name pattern
+def getTemplateRegex(pattern):
+    parts = INDEX_PATTERN.split(pattern)
+    # re.split() returns the format specs of the placeholders between the literal parts
+    return "^" + "[0-9]+".join(re.escape(part) for part in parts[::2]) + "$"
+
+
+# getTemplateBaseName(pattern) returns the name of a multi-create request for the template, Nova names its
+# instances "<name>-1", "<name>-2", ... So for the pattern "worker-{index}" they already have the final names.
+def getTemplateBaseName(pattern):
+    base = INDEX_PATTERN.sub("", pattern)
+    return base.rstrip("-_.") or base
+
+
+# formatServerName(pattern, index) returns the name of the server with the index generated from the name pattern.
+# Only the "{index}" placeholders are replaced, other braces are a part of the name. An invalid format spec of
+# the placeholder raises ValueError
+def formatServerName(pattern, index):
+    try:
+        return INDEX_PATTERN.sub(lambda match: format(index, (match.group(1) or ":")[1:]), pattern)
+    except ValueError as e:
+        raise ValueError('Name "' + pattern + '" of the server template has an invalid "{index}" format: ' + str(e))
+
+
+# parseAddressRange(value) returns the first and the last address of the range "A-B", or only the first one
+# and None for an unbounded range "A"
+def parseAddressRange(value):
+    if "-" in str(value):
+        first, last = str(value).split("-", 1)
+        return ipaddress.IPv4Address(first.strip()), ipaddress.IPv4Address(last.strip())
+    return ipaddress.IPv4Address(str(value).strip()), None
+
+
+# expandServerTemplate(servConfig) returns the list of servers config entries generated from the template:
+#   name        - name pattern with the "{index}" placeholder
+#   count       - number of the servers
+#   start       - index of the first server, 1 by default
+#   ipv4_range  - range of the fixed IPv4 addresses of the servers in a network, "10.0.0.10-10.0.0.99"
+#                 or just the first address "10.0.0.10"
+# The entries get the "template" key with the name pattern, so the servers of a template are created together.
+# An error in the template raises ValueError
+def expandServerTemplate(servConfig):
+    pattern = servConfig["name"]
+    if not INDEX_PATTERN.search(pattern):
+        raise ValueError('Name "' + pattern + '" of the server template has no "{index}" placeholder.')
+    count = servConfig["count"]
+    start = servConfig.get("start", 1)
+    if not isinstance(count, int) or count < 0 or not isinstance(start, int):
+        raise ValueError('Server template "' + pattern + '" must have integer "count" and "start".')
+
+    # First address of every network with a range of the fixed addresses
+    ranges = {}
+    for netw in servConfig["networks"]:
+        if "ipv4_range" not in netw:
+            continue
+        try:
+            first, last = parseAddressRange(netw["ipv4_range"])
+        except ValueError:
+            raise ValueError('Server template "' + pattern + '" has invalid "ipv4_range" "' +
+                             str(netw["ipv4_range"]) + '" in the network "' + netw["name"] + '".')
+        if last is not None and int(last) - int(first) + 1 < count:
+            raise ValueError('Range "' + str(netw["ipv4_range"]) + '" of the server template "' + pattern +
+                             '" has less than ' + str(count) + ' addresses.')
+        ranges[netw["name"]] = first
+
+    members = []
+    for offset in range(count):
+        index = start + offset
+        member = copy.deepcopy(servConfig)
+        del member["count"]
+        member.pop("start", None)
+        member["name"] = formatServerName(pattern, index)
+        member["template"] = pattern
+        member["index"] = index
+        # All the servers of the template share one keypair, it is named after the template
+        member.setdefault("keypair", getTemplateBaseName(pattern))
+        for netw in member["networks"]:
+            if "ipv4_range" in netw:
+                netw["ipv4"] = str(ranges[netw["name"]] + offset)
+                del netw["ipv4_range"]
+        members.append(member)
+    return members
+
+
+# expandServerTemplates(config) replaces the server templates of the configuration with the servers generated
+# from them. The configuration is changed in place. An error in a template raises ValueError
+def expandServerTemplates(config):
+    if not config or not config.get("servers"):
+        return config
+    servers = []
+    for servConfig in config["servers"]:
+        if isServerTemplate(servConfig):
+            servers.extend(expandServerTemplate(servConfig))
+        else:
+            servers.append(servConfig)
+    config["servers"] = servers
+    return config
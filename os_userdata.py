@@ -0,0 +1,179 @@
+#    _    _                  _       _
+#   | |  | |                | |     | |
+#   | |  | |___  ___ _ __ __| | __ _| |_ __ _
+#   | |  | / __|/ _ \ '__/ _` |/ _` | __/ _` |
+#   | |__| \__ \  __/ | | (_| | (_| | || (_| |
+#    \____/|___/\___|_|  \__,_|\__,_|\__\__,_|
+#
+import os
+import re
+import gzip
+import base64
+import hashlib
+import threading
+
+# Nova rejects the user data longer than 64KB after the base64 encoding
+USER_DATA_LIMIT = 65535
+# Placeholder of a variable in an init script, e.g. "{{ name }}"
+VARIABLE_PATTERN = re.compile(rb"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+# Formats of the user data: the init script as it is or wrapped in a cloud-init multipart MIME message
+FORMATS = ("script", "mime")
+# Compression of the user data: "auto" compresses only the user data, which does not fit USER_DATA_LIMIT otherwise
+COMPRESSIONS = ("auto", True, False)
+# MIME type of a part of the multipart message by the first line of the init script, see the cloud-init docs
+MIME_SUBTYPES = (("#!", "x-shellscript"),
+                 ("#cloud-config", "cloud-config"),
+                 ("#cloud-boothook", "cloud-boothook"),
+                 ("#include", "x-include-url"),
+                 ("#part-handler", "part-handler"))
+
+
+# Builder of the user_data argument of the server creation. The init script files are read once per run and
+# the encoded user data is cached by the hash of its content, so the servers sharing an init script share
+# the work, unless its variables are different for them. Files are re-read only if they have changed.
+class UserDataBuilder(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Path of the file -> (modification time, size, content)
+        self._files = {}
+        # (content hash, format, compression) -> encoded user data
+        self._payloads = {}
+        self._hits = 0
+        self._misses = 0
+
+    # reset() drops the cached files and user data
+    def reset(self):
+        with self._lock:
+            self._files = {}
+            self._payloads = {}
+            self._hits = 0
+            self._misses = 0
+
+    # stats() returns the numbers of the user data taken from the cache and built
+    def stats(self):
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses}
+
+    # build(config, servConfig) returns the base64 encoded user data of the server, an empty string if it has
+    # no init script, and None or the reason, why the user data can not be built
+    def build(self, config, servConfig):
+        if "init-script" not in servConfig:
+            return "", None
+        path = servConfig["init-script"]
+        try:
+            content = self._read(path)
+        except (IOError, OSError) as e:
+            if not os.path.isfile(path):
+                return None, 'Init script file "' + path + '" does not exist.'
+            return None, 'Init script file "' + path + '" can not be read: ' + str(e)
+
+        userDataFormat = getUserDataOption(config, servConfig, "user_data_format", "script")
+        compression = getUserDataOption(config, servConfig, "user_data_gzip", "auto")
+        if userDataFormat not in FORMATS or compression not in COMPRESSIONS:
+            return None, 'Invalid "user_data_format" or "user_data_gzip" of the server "' + servConfig["name"] + '".'
+
+        content = renderInitScript(content, getInitScriptVariables(config, servConfig))
+        key = (hashlib.sha256(content).hexdigest(), userDataFormat, compression)
+        with self._lock:
+            userData = self._payloads.get(key)
+            if userData is not None:
+                self._hits += 1
+        if userData is None:
+            try:
+                userData = encodeUserData(content, userDataFormat, compression, os.path.basename(path))
+            except UnicodeDecodeError:
+                return None, 'Init script file "' + path + '" is not a UTF-8 text, it can not be wrapped in MIME.'
+            with self._lock:
+                self._payloads[key] = userData
+                self._misses += 1
+
+        if len(userData) > USER_DATA_LIMIT:
+            return None, 'User data of the server "' + servConfig["name"] + '" is ' + str(len(userData)) + \
+                ' bytes long, Nova accepts up to ' + str(USER_DATA_LIMIT) + ' bytes.'
+        return userData, None
+
+    # _read(path) returns the content of the file, it is read again only if its modification time or size
+    # has changed
+    def _read(self, path):
+        info = os.stat(path)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is not None and cached[0] == info.st_mtime_ns and cached[1] == info.st_size:
+            return cached[2]
+        with open(path, "rb") as f:
+            content = f.read()
+        with self._lock:
+            self._files[path] = (info.st_mtime_ns, info.st_size, content)
+        return content
+
+
+# getUserDataOption(config, servConfig, name, default) returns the user data option of the server, which
+# overrides the one of the "parameters" section
+def getUserDataOption(config, servConfig, name, default):
+    if name in servConfig:
+        return servConfig[name]
+    return (config.get("parameters") or {}).get(name, default)
+
+
+# getInitScriptVariables(config, servConfig) returns the variables of the server init script: "name", "index"
+# of the servers generated from a template and the "init-script-vars" of the "parameters" section and of the server
+def getInitScriptVariables(config, servConfig):
+    variables = {"name": servConfig["name"], "index": servConfig.get("index", "")}
+    variables.update((config.get("parameters") or {}).get("init-script-vars") or {})
+    variables.update(servConfig.get("init-script-vars") or {})
+    return variables
+
+
+# renderInitScript(content, variables) replaces the "{{ variable }}" placeholders of the init script with
+# the values of the variables. Unknown placeholders are left as they are, they might belong to the script itself
+def renderInitScript(content, variables):
+    if b"{{" not in content:
+        return content
+
+    def replace(match):
+        name = match.group(1).decode("ascii")
+        if name not in variables:
+            return match.group(0)
+        return str(variables[name]).encode("utf-8")
+    return VARIABLE_PATTERN.sub(replace, content)
+
+
+# encodeUserData(content, userDataFormat, compression, fileName) returns the base64 encoded user data of
+# the init script content. The script is taken as it is, any encoding is kept byte for byte, or wrapped in
+# a multipart MIME message. The gzip compressed user data is unpacked by cloud-init
+def encodeUserData(content, userDataFormat, compression, fileName):
+    if userDataFormat == "mime":
+        content = wrapMultipart(content, fileName)
+    userData = base64.b64encode(content).decode("ascii")
+    if compression is True or (compression == "auto" and len(userData) > USER_DATA_LIMIT):
+        # The fixed modification time keeps the compressed user data of the same script the same
+        userData = base64.b64encode(gzip.compress(content, mtime=0)).decode("ascii")
+    return userData
+
+
+# wrapMultipart(content, fileName) returns the cloud-init multipart MIME message with the init script
+def wrapMultipart(content, fileName):
+    # The email package is imported only by the runs, which build MIME user data
+    from email.charset import Charset
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    text = content.decode("utf-8")
+    subtype = "plain"
+    for prefix, mimeSubtype in MIME_SUBTYPES:
+        if text.startswith(prefix):
+            subtype = mimeSubtype
+            break
+
+    # The script is kept 8-bit, the whole message is base64 encoded anyway
+    charset = Charset("utf-8")
+    charset.body_encoding = None
+    part = MIMEText(text, subtype, charset)
+    part.add_header("Content-Disposition", "attachment", filename=fileName)
+    # The boundary depends only on the content, so the same script gives the same user data
+    message = MIMEMultipart(boundary="==========" + hashlib.sha256(content).hexdigest()[:32] + "==")
+    message.attach(part)
+    return message.as_bytes()
+
+
+userDataBuilder = UserDataBuilder()